@@ -0,0 +1,228 @@
+"""
+Asyncio facade over `Inference` for long-running gateway processes.
+
+Detection and OCR run in an executor while the SUMAL lookups of other plates
+are in flight on an aiohttp session, so network latency overlaps with model
+work instead of leaving the CPU idle.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from instrumentation import NULL_METRICS
+from sumal_client import BASE_URL, RETRY_STATUSES, TTLCache, parse_notice
+
+_MISSING = object()
+
+
+class AsyncSumalClient:
+    """
+    Asynchronous counterpart of `SumalClient`, sharing its cache format, retries and metrics.
+
+    Parameters:
+        base_url (str): Root of the aviz API.
+        timeout (float): Total timeout in seconds of every HTTP request.
+        concurrency (int): Maximum number of HTTP requests in flight.
+        cache (TTLCache): Cache for plate and notice lookups, can be shared with a `SumalClient`.
+        retries (int): Number of retries for failed connections and 5xx responses.
+        backoff_factor (float): The n-th retry waits `backoff_factor * 2 ** (n - 1)` seconds.
+        negative_ttl (float): Lifetime of cached "no legal notice" answers.
+        metrics (Metrics): Receives the HTTP latencies, request and retry counts, see
+            `instrumentation`.
+    """
+
+    def __init__(self, base_url: str = BASE_URL, timeout: float = 10, concurrency: int = 16,
+                 cache: TTLCache = None, retries: int = 2, backoff_factor: float = 0.3,
+                 negative_ttl: float = 300, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.concurrency = concurrency
+        self.cache = cache if cache is not None else TTLCache()
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.negative_ttl = negative_ttl
+        self.metrics = metrics or NULL_METRICS
+        self._session = None
+        self._semaphore = None
+        self._inflight = {}
+
+    async def _get_json(self, url, params=None):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=self.timeout,
+                                                  connector=aiohttp.TCPConnector(limit=self.concurrency))
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        # Same metrics as `SumalClient._get_json`: one request per lookup, timed with its retries
+        start_time = time.perf_counter()
+        retries = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    async with self._session.get(url, params=params) as response:
+                        if response.status not in RETRY_STATUSES or retries == self.retries:
+                            self.metrics.observe('sumal_http_seconds', time.perf_counter() - start_time)
+                            self.metrics.increment('sumal_http_requests_total', labels={'status': response.status})
+                            if retries:
+                                self.metrics.increment('sumal_http_retries_total', retries)
+                            response.raise_for_status()
+                            return await response.json(content_type=None)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if retries == self.retries:
+                    raise
+            retries += 1
+            await asyncio.sleep(self.backoff_factor * 2 ** (retries - 1))
+
+    async def _cached(self, key, fetch):
+        value = self.cache.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        # Plates seen by several requests at once are only fetched by the first one. The fetch
+        # forgets its own key when done, a waiter cancelled meanwhile must not let a second
+        # fetch start
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(fetch())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def codes(self, license_plate):
+        async def fetch():
+            data = await self._get_json(f'{self.base_url}/locations', params={'nr': license_plate})
+            codes = data['codAviz'] or []
+            self.cache.set(f'plate:{license_plate}', codes, ttl=None if codes else self.negative_ttl)
+            return codes
+
+        return await self._cached(f'plate:{license_plate}', fetch)
+
+    async def notice(self, code):
+        async def fetch():
+            notice = parse_notice(code, await self._get_json(f'{self.base_url}/{code}'))
+            self.cache.set(f'aviz:{code}', notice)
+            return notice
+
+        return await self._cached(f'aviz:{code}', fetch)
+
+    async def lookup(self, license_plate):
+        """
+        Get every legal notice of a license plate, the detail requests running concurrently.
+
+        Parameters:
+            license_plate (str): Cleaned license plate number.
+
+        Returns:
+            list: One dict per legal notice, see `sumal_client.parse_notice`.
+        """
+        codes = await self.codes(license_plate)
+        return list(await asyncio.gather(*(self.notice(code) for code in codes)))
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self.cache.save()
+
+
+class AsyncInference:
+    """
+    Runs the plate -> legal notice pipeline without blocking the event loop.
+
+    Parameters:
+        inference (Inference): Loaded detection and OCR models.
+        sumal_client (AsyncSumalClient): Client for the legal notice lookups.
+        model_workers (int): Threads running model work. The models release the GIL in
+            their native kernels, raise it only if the CPU is not saturated with one.
+    """
+
+    def __init__(self, inference, sumal_client: AsyncSumalClient = None, model_workers: int = 1):
+        self.sync_inference = inference
+        self.sumal_client = sumal_client or AsyncSumalClient(metrics=inference.metrics)
+        self.model_workers = model_workers
+        self._executor = ThreadPoolExecutor(max_workers=model_workers)
+
+    async def predict(self, image):
+        """
+        Read the license plate of an image in the model executor.
+
+        Parameters:
+            image: Path to the image, encoded image bytes or decoded BGR array.
+
+        Returns:
+            str: License plate text, None when no plate was detected.
+        """
+        loop = asyncio.get_running_loop()
+        plates = await loop.run_in_executor(self._executor, self.sync_inference.predict_batch, [image], 1)
+        return self.sync_inference.resolve_plate(plates[0])
+
+    async def inference(self, image):
+        """
+        Read the license plate of an image and look up its legal notices.
+
+        Returns:
+            tuple: (license plate, list of legal notices), the notices being None without a plate.
+        """
+        # Same stages, counters and plate index updates as `Inference.inference`. The request
+        # is timed without the profiler, other requests run on the same thread meanwhile.
+        inference = self.sync_inference
+        start_time = time.perf_counter()
+        license_plate = await self.predict(image)
+        notices = None
+        if license_plate:
+            with inference.metrics.stage('sumal'):
+                notices = await self.sumal_client.lookup(license_plate)
+            inference.record_lookup(license_plate, notices)
+        inference.metrics.observe('request_seconds', time.perf_counter() - start_time)
+        return license_plate, notices
+
+    async def serve(self, requests: asyncio.Queue, concurrency: int = None):
+        """
+        Service loop answering the requests put on `requests` until `None` is received.
+
+        Every request is an (image, future) tuple, the future receives the
+        (license plate, legal notices) tuple or the raised exception. Use `submit`
+        to create them. Enough requests are handled at once to keep the model
+        executor busy while others wait for the network.
+
+        Parameters:
+            requests (asyncio.Queue): Queue of incoming requests.
+            concurrency (int): Requests handled at once, by default the HTTP concurrency
+                limit plus two per model worker.
+        """
+        concurrency = concurrency or self.sumal_client.concurrency + 2 * self.model_workers
+
+        async def worker():
+            while True:
+                item = await requests.get()
+                if item is None:
+                    # Hand the stop signal over to the next worker
+                    requests.put_nowait(None)
+                    return
+                image, future = item
+                try:
+                    result = await self.inference(image)
+                except Exception as error:
+                    if not future.cancelled():
+                        future.set_exception(error)
+                else:
+                    if not future.cancelled():
+                        future.set_result(result)
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+    @staticmethod
+    async def submit(requests: asyncio.Queue, image):
+        """
+        Queue an image for the service loop and wait for its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await requests.put((image, future))
+        return await future
+
+    async def close(self):
+        self._executor.shutdown(wait=False)
+        await self.sumal_client.close()
@@ -0,0 +1,376 @@
+"""
+Bulk offline audit of archived checkpoint photos.
+
+Every photo goes through plate detection, OCR, SUMAL lookup and log-volume
+estimation, and the estimated volume is compared with the legal one. Photos
+are processed in chunks; every chunk is written as its own Parquet file,
+renamed into place once complete. A crashed (or extended) run resumes with the
+photos no written chunk holds, matched by path, so photos added to the source
+since are simply audited in new chunks. Only one detector batch of decoded
+frames (plus the one being prefetched) is held in memory, whatever the size of
+the run.
+"""
+
+import csv
+import re
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from inference import best_detection, crop_plate, load_image
+from log_volume import DEFAULT_LOG_LENGTH_CM, estimate_volumes
+from verified_trucks import make_record, select_notice
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+_PART_NAME = re.compile(r'^part-(\d+)\.parquet$')
+
+COLUMNS = ['path', 'capture_time', 'license_plate', 'plate_x', 'plate_y', 'plate_w', 'plate_h', 'logs',
+           'estimated_volume', 'notice_codes', 'legal_volume', 'notice_valid', 'volume_difference', 'error']
+
+
+def report_schema():
+    import pyarrow as pa
+
+    return pa.schema([
+        ('path', pa.string()),
+        ('capture_time', pa.int64()),
+        ('license_plate', pa.string()),
+        ('plate_x', pa.int32()),
+        ('plate_y', pa.int32()),
+        ('plate_w', pa.int32()),
+        ('plate_h', pa.int32()),
+        ('logs', pa.int32()),
+        ('estimated_volume', pa.float64()),
+        ('notice_codes', pa.list_(pa.string())),
+        ('legal_volume', pa.float64()),
+        ('notice_valid', pa.bool_()),
+        ('volume_difference', pa.float64()),
+        ('error', pa.string()),
+    ])
+
+
+def list_inputs(source):
+    """
+    List the photos to audit.
+
+    Parameters:
+        source (str): Directory searched recursively for images, or a manifest: a text file
+            with one path per line, or a CSV file with a `path` column and an optional
+            `log_length_cm` column.
+
+    Returns:
+        list: (path, log length in cm or None) tuples, in a stable order.
+    """
+    if os.path.isdir(source):
+        paths = []
+        for root, _, filenames in os.walk(source):
+            paths.extend(os.path.join(root, filename) for filename in filenames
+                         if filename.lower().endswith(IMAGE_EXTENSIONS))
+        return [(path, None) for path in sorted(paths)]
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='') as file:
+        first_line = file.readline()
+        file.seek(0)
+        if source.lower().endswith('.csv') and 'path' in first_line:
+            rows = [(row['path'], float(row['log_length_cm']) if row.get('log_length_cm') else None)
+                    for row in csv.DictReader(file)]
+        else:
+            rows = [(line.strip(), None) for line in file if line.strip()]
+    # Relative manifest entries are relative to the manifest itself
+    return [(os.path.join(base, path), log_length) for path, log_length in rows]
+
+
+def select_legal_volume(notices, capture_time):
+    """
+    Pick the legal volume a photo is compared with.
+
+    Returns:
+        tuple: (volume, valid), the volume of the latest notice valid when the photo was taken,
+        or of the last notice (as the app does) with `valid` False when none was.
+    """
+    notice, valid = select_notice(notices, capture_time)
+    if notice is None:
+        return np.nan, False
+    return float(notice['Volume']), valid
+
+
+class Auditor:
+    """
+    Audits photos chunk by chunk.
+
+    Parameters:
+        inference (Inference): Loaded plate detection and OCR models, with its SUMAL client.
+        log_model (DetectorBackend): Loaded log model, see `log_volume.load_log_model`.
+            Without it the volumes are not estimated.
+        batch_size (int): Frames per detector call.
+        decode_workers (int): Threads decoding the next batch while the current one runs.
+        lookup (bool): Look up the SUMAL legal notices of the plates.
+        conf (float): Detection confidence threshold of both models.
+        store (VerifiedTruckStore): Optional store every looked up plate is recorded in,
+            one transaction per chunk.
+    """
+
+    def __init__(self, inference, log_model=None, batch_size: int = 8, decode_workers: int = 4,
+                 lookup: bool = True, conf: float = 0.4, store=None):
+        self.inference = inference
+        self.log_model = log_model
+        self.batch_size = batch_size
+        self.lookup = lookup
+        self.conf = conf
+        self.store = store
+        self._decoder = ThreadPoolExecutor(max_workers=decode_workers)
+        self._lookups = ThreadPoolExecutor(max_workers=8)
+
+    @staticmethod
+    def _decode(path):
+        try:
+            return load_image(path), None
+        except (OSError, ValueError) as error:
+            return None, str(error)
+
+    def _decoded_batches(self, paths):
+        # Decode the next batch while the models run on the current one
+        batches = [paths[start:start + self.batch_size] for start in range(0, len(paths), self.batch_size)]
+        pending = [self._decoder.submit(self._decode, path) for path in batches[0]] if batches else []
+        for index in range(len(batches)):
+            decoded = [future.result() for future in pending]
+            if index + 1 < len(batches):
+                pending = [self._decoder.submit(self._decode, path) for path in batches[index + 1]]
+            yield index * self.batch_size, decoded
+
+    def _lookup(self, license_plate):
+        try:
+            return self.inference.sumal_client.lookup(license_plate), None
+        except Exception as error:
+            return None, f'SUMAL lookup failed: {error!r}'
+
+    def audit(self, inputs):
+        """
+        Audit a chunk of photos.
+
+        Parameters:
+            inputs (list): (path, log length in cm or None) tuples.
+
+        Returns:
+            dict: One list per column of `COLUMNS`.
+        """
+        paths = [path for path, _ in inputs]
+        size = len(paths)
+        columns = {name: [None] * size for name in COLUMNS}
+        columns['path'] = paths
+        columns['logs'] = [0] * size
+        columns['estimated_volume'] = [np.nan] * size
+        columns['legal_volume'] = [np.nan] * size
+        columns['notice_valid'] = [False] * size
+        plate_widths = np.full(size, np.nan)
+        log_detections = [np.zeros((0, 6), dtype=np.float32)] * size
+
+        for start, decoded in self._decoded_batches(paths):
+            frames = []
+            for offset, (frame, error) in enumerate(decoded):
+                index = start + offset
+                if frame is None:
+                    columns['error'][index] = error
+                    continue
+                columns['capture_time'][index] = int(os.stat(paths[index]).st_mtime * 1000)
+                frames.append((index, frame))
+            if not frames:
+                continue
+
+            images = [frame for _, frame in frames]
+            crops = []
+            owners = []
+            confidences = []
+            for (index, frame), detections in zip(frames, self.inference.BB_MODEL.predict(images, conf=self.conf)):
+                box, confidence = best_detection(detections)
+                if box is None:
+                    continue
+                columns['plate_x'][index], columns['plate_y'][index], columns['plate_w'][index], \
+                    columns['plate_h'][index] = box
+                plate_widths[index] = box[2]
+                crops.append(crop_plate(frame, box))
+                owners.append(index)
+                confidences.append(confidence)
+            # Same quality gate as `Inference.predict_batch`: rejected crops keep their box
+            # (the volume scale) but are not read
+            kept = self.inference.gate_crops(crops, confidences)
+            crops = [crops[index] for index in kept]
+            owners = [owners[index] for index in kept]
+            for index, license_plate in zip(owners, self.inference.ocr.read(crops) if crops else []):
+                columns['license_plate'][index] = self.inference.resolve_plate(license_plate) or None
+
+            if self.log_model is not None:
+                for (index, _), detections in zip(frames, self.log_model.predict(images, conf=self.conf)):
+                    log_detections[index] = detections
+                    columns['logs'][index] = len(detections)
+
+        if self.log_model is not None:
+            log_lengths = np.array([DEFAULT_LOG_LENGTH_CM if log_length is None else log_length
+                                    for _, log_length in inputs], dtype=np.float64)
+            volumes = estimate_volumes(log_detections, np.where(np.isnan(plate_widths), 1, plate_widths),
+                                       log_lengths)
+            # Without a plate (no scale) or without logs there is no estimate
+            volumes[np.isnan(plate_widths) | (volumes == 0)] = np.nan
+            columns['estimated_volume'] = volumes.tolist()
+
+        if self.lookup:
+            # Every plate is looked up once per chunk; the client cache dedupes across chunks
+            plates = sorted({plate for plate in columns['license_plate'] if plate})
+            answers = dict(zip(plates, self._lookups.map(self._lookup, plates)))
+            records = []
+            for index, license_plate in enumerate(columns['license_plate']):
+                if not license_plate:
+                    continue
+                notices, error = answers[license_plate]
+                if error:
+                    columns['error'][index] = error
+                    continue
+                columns['notice_codes'][index] = [notice['Code'] for notice in notices]
+                columns['legal_volume'][index], columns['notice_valid'][index] = select_legal_volume(
+                    notices, columns['capture_time'][index])
+                estimated_volume = columns['estimated_volume'][index]
+                records.append(make_record(license_plate, notices,
+                                           None if np.isnan(estimated_volume) else estimated_volume,
+                                           columns['capture_time'][index]))
+            if self.store is not None and records:
+                self.store.add_many(records)
+
+        difference = np.array(columns['estimated_volume'], dtype=np.float64) - \
+            np.array(columns['legal_volume'], dtype=np.float64)
+        # Missing volumes are written as nulls rather than NaN
+        for name, values in (('estimated_volume', columns['estimated_volume']),
+                             ('legal_volume', columns['legal_volume']), ('volume_difference', difference)):
+            columns[name] = [None if np.isnan(value) else float(value) for value in values]
+        return columns
+
+    def close(self):
+        self._decoder.shutdown()
+        self._lookups.shutdown()
+
+
+def _written_parts(output_directory):
+    # Part files are renamed into place once complete, so every one on disk is done
+    parts = [filename for filename in os.listdir(output_directory) if _PART_NAME.match(filename)]
+    return sorted(parts, key=lambda part: int(_PART_NAME.match(part).group(1)))
+
+
+def _audited_paths(output_directory, parts):
+    import pyarrow.parquet as pq
+
+    paths = set()
+    for part in parts:
+        paths.update(pq.read_table(os.path.join(output_directory, part), columns=['path']).column('path').to_pylist())
+    return paths
+
+
+def run_audit(source, output_directory, auditor, chunk_size: int = 1024):
+    """
+    Audit every photo of `source`, resuming a previous run into the same directory.
+
+    The photos already held by a written part file (matched by path) are skipped, the
+    others are audited in new part files, so the source may grow between runs.
+
+    Parameters:
+        source (str): Directory or manifest, see `list_inputs`.
+        output_directory (str): Directory of the `part-NNNNN.parquet` files.
+        auditor (Auditor): Loaded models.
+        chunk_size (int): Photos per Parquet file.
+
+    Returns:
+        dict: Number of photos, photos audited and skipped, chunks written and skipped,
+        and photos per second.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(output_directory, exist_ok=True)
+    inputs = list_inputs(source)
+    parts = _written_parts(output_directory)
+    audited_paths = _audited_paths(output_directory, parts)
+    pending = [item for item in inputs if item[0] not in audited_paths]
+    first_part = int(_PART_NAME.match(parts[-1]).group(1)) + 1 if parts else 0
+    schema = report_schema()
+
+    start_time = time.time()
+    audited = 0
+    chunks = range((len(pending) + chunk_size - 1) // chunk_size)
+    for chunk in chunks:
+        chunk_inputs = pending[chunk * chunk_size:(chunk + 1) * chunk_size]
+        table = pa.Table.from_pydict(auditor.audit(chunk_inputs), schema=schema)
+
+        # Files starting with '.' are ignored by Parquet readers, so a partial file is never read
+        part = f'part-{first_part + chunk:05d}.parquet'
+        tmp_path = os.path.join(output_directory, f'.{part}.tmp')
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, os.path.join(output_directory, part))
+        parts.append(part)
+
+        audited += len(chunk_inputs)
+        elapsed = time.time() - start_time
+        print(f'chunk {chunk + 1}/{len(chunks)}: {audited} photos, {audited / elapsed:.1f} photos/s')
+
+    elapsed = time.time() - start_time
+    return {'photos': len(inputs), 'audited': audited, 'skipped_photos': len(inputs) - len(pending),
+            'chunks': len(chunks), 'skipped_chunks': len(parts) - len(chunks),
+            'seconds': elapsed, 'photos_per_second': audited / elapsed if elapsed else 0.0}
+
+
+def load_report(output_directory):
+    """
+    Read the whole audit report as a `pyarrow.Table`.
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(output_directory)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from detector_backends import MODEL_VARIANTS
+    from inference import Inference
+    from log_volume import LOG_MODEL_PATH, load_log_model
+    from sumal_client import BASE_URL, SumalClient, TTLCache
+    from verified_trucks import SqliteTTLCache, VerifiedTruckStore
+
+    parser = argparse.ArgumentParser(description='Audit archived truck photos against their SUMAL legal volume.')
+    parser.add_argument('source', help='Directory of photos, or a .txt/.csv manifest')
+    parser.add_argument('--output', required=True, help='Directory of the Parquet report')
+    parser.add_argument('--model', required=True, help='Path to the license plate detection model')
+    parser.add_argument('--ocr-model', default='microsoft/trocr-base-printed')
+    parser.add_argument('--log-model', default=LOG_MODEL_PATH, help="Path to the log model, '' to skip volumes")
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--variant', default=None, choices=MODEL_VARIANTS,
+                        help='Precision of the detection models, e.g. int8 (see quantization.py)')
+    parser.add_argument('--tile-size', type=int, default=None,
+                        help='Also detect the logs on tiles of this size, for high-resolution photos')
+    parser.add_argument('--adaptive-tiling', action='store_true', help='Only run the tiles found dense')
+    parser.add_argument('--chunk-size', type=int, default=1024)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--no-lookup', action='store_true', help='Skip the SUMAL lookups')
+    parser.add_argument('--sumal-url', default=BASE_URL)
+    parser.add_argument('--sumal-cache', default=None, help='JSON file persisting the SUMAL cache across runs')
+    parser.add_argument('--store', default=None,
+                        help='SQLite database recording the checks, also persisting the SUMAL cache '
+                             'unless --sumal-cache is given')
+    args = parser.parse_args()
+
+    store = VerifiedTruckStore(args.store) if args.store else None
+    cache = SqliteTTLCache(store) if store and not args.sumal_cache else TTLCache(path=args.sumal_cache)
+    with SumalClient(args.sumal_url, cache=cache) as client:
+        inf = Inference(rf_bb_model=args.model, ocr_model=args.ocr_model, sumal_client=client, backend=args.backend,
+                        model_variant=args.variant)
+        log_model = load_log_model(args.log_model, backend=args.backend, tile_size=args.tile_size,
+                                   adaptive=args.adaptive_tiling, variant=args.variant) if args.log_model else None
+        auditor = Auditor(inf, log_model, batch_size=args.batch_size, lookup=not args.no_lookup, store=store)
+        try:
+            print(run_audit(args.source, args.output, auditor, chunk_size=args.chunk_size))
+        finally:
+            auditor.close()
+            cache.save()
+            if store is not None:
+                store.close()
@@ -0,0 +1,281 @@
+"""
+Benchmark suite for the license plate pipeline.
+
+Every benchmark is warmed up before it is timed, and model loading and disk
+I/O stay out of the timed region. The suite covers:
+
+- microbenchmarks of `bounding_box_prediction`, `ocr_prediction`, cropping and
+  the IoU / matching helpers,
+- detector and `predict_batch` throughput at several batch sizes,
+- end-to-end `Inference.inference` latency against a local SUMAL stub.
+
+Results are written as JSON together with the commit they were measured on,
+and `compare` flags regressions between two result files.
+"""
+
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from boxes import calculate_iou
+from inference import crop_plate, load_image
+from matching import greedy_match, iou_matrix, xywh_to_xyxy
+
+BATCH_SIZES = (1, 4, 8, 16)
+
+# Relative slowdown of a benchmark reported as a regression
+REGRESSION_THRESHOLD = 0.1
+
+
+def measure(function, warmup: int = 3, repeat: int = 20):
+    """
+    Time a function after warming it up.
+
+    Parameters:
+        function (callable): Function called without arguments.
+        warmup (int): Untimed calls made first (caches, lazy initialization, JIT...).
+        repeat (int): Timed calls.
+
+    Returns:
+        dict: Mean, standard deviation, min and p50/p95/p99 of the calls in milliseconds.
+    """
+    for _ in range(warmup):
+        function()
+    timings = np.empty(repeat)
+    for index in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        timings[index] = time.perf_counter() - start_time
+    return latency_stats(timings)
+
+
+def latency_stats(timings):
+    timings = np.asarray(timings) * 1000
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {'mean_ms': float(timings.mean()), 'std_ms': float(timings.std()), 'min_ms': float(timings.min()),
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'runs': len(timings)}
+
+
+def measure_throughput(function, items, batch_size: int, warmup: int = 1, repeat: int = 3):
+    """
+    Items per second processed by `function(batch)` on consecutive batches of `items`.
+    """
+    batches = [items[start:start + batch_size] for start in range(0, len(items), batch_size)]
+    for _ in range(warmup):
+        function(batches[0])
+    best = np.inf
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        for batch in batches:
+            function(batch)
+        best = min(best, time.perf_counter() - start_time)
+    return {'batch_size': batch_size, 'items': len(items), 'seconds': float(best),
+            'items_per_second': len(items) / best}
+
+
+def _random_boxes(rng, count, size=640):
+    # Center (x, y, w, h) boxes inside a size x size image
+    width_height = rng.uniform(10, 120, size=(count, 2))
+    centers = rng.uniform(width_height / 2, size - width_height / 2)
+    return np.hstack([centers, width_height])
+
+
+def micro_benchmarks(frames, repeat: int = 200):
+    """
+    Benchmarks of the model-free steps: cropping, scalar IoU, IoU matrix and greedy matching.
+    """
+    rng = np.random.default_rng(0)
+    frame = frames[0]
+    height, width = frame.shape[:2]
+    box = (width // 2, height // 2, width // 5, height // 10)
+    boxes = _random_boxes(rng, 100)
+    corners = xywh_to_xyxy(boxes)
+    scores = rng.random(100)
+    ious = iou_matrix(corners, corners[rng.permutation(100)])
+    pairs = [(tuple(boxes[index]), tuple(boxes[index + 1])) for index in range(50)]
+
+    return {
+        'micro/crop_plate': measure(lambda: crop_plate(frame, box), repeat=repeat),
+        'micro/crop_plate_contiguous': measure(lambda: np.ascontiguousarray(crop_plate(frame, box)), repeat=repeat),
+        'micro/calculate_iou_x50': measure(lambda: [calculate_iou(box1, box2) for box1, box2 in pairs],
+                                           repeat=repeat),
+        'micro/iou_matrix_100x100': measure(lambda: iou_matrix(corners, corners), repeat=repeat),
+        'micro/greedy_match_100x100': measure(lambda: greedy_match(ious, scores), repeat=repeat),
+    }
+
+
+def model_benchmarks(inference, frames, batch_sizes=BATCH_SIZES, repeat: int = 20):
+    """
+    Microbenchmarks and throughput of the detector and the OCR backend.
+    """
+    results = {}
+    frame = frames[0]
+    results['micro/bounding_box_prediction'] = measure(lambda: inference.bounding_box_prediction(frame),
+                                                       repeat=repeat)
+
+    box = inference.bounding_box_prediction(frame)
+    crops = [crop_plate(image, box) for image in frames] if box is not None else []
+    if crops:
+        # Bypass the crop cache, the model itself is measured here
+        backend = getattr(inference.ocr, 'backend', inference.ocr)
+        results['micro/ocr_prediction'] = measure(lambda: backend.read(crops[:1]), repeat=repeat)
+        results['micro/ocr_prediction_cached'] = measure(lambda: inference.ocr_prediction(crops[0]), repeat=repeat)
+
+    for batch_size in batch_sizes:
+        results[f'throughput/detector/bs={batch_size}'] = measure_throughput(
+            lambda batch: inference.BB_MODEL.predict(batch, conf=0.4, iou=0.45), frames, batch_size)
+        results[f'throughput/predict_batch/bs={batch_size}'] = measure_throughput(
+            lambda batch: inference.predict_batch(batch, batch_size=batch_size), frames, batch_size)
+    return results
+
+
+def end_to_end_benchmark(inference, image_paths, latency: float = 0.05, requests: int = 50):
+    """
+    Latency of `Inference.inference` (decode, detection, OCR and SUMAL lookup) against a
+    local SUMAL stub answering after `latency` seconds. The SUMAL cache is disabled so
+    every request pays for the lookups.
+    """
+    from sumal_client import SumalClient, TTLCache
+    from sumal_stub import SumalStubServer, make_notice
+
+    # Give every plate the pipeline reads two legal notices
+    plates = {plate for plate in inference.predict_batch(image_paths) if plate}
+    now = int(time.time() * 1000)
+    notices = {}
+    plate_codes = {}
+    for index, plate in enumerate(sorted(plates)):
+        plate_codes[plate] = [f'AV{index}A', f'AV{index}B']
+        for code in plate_codes[plate]:
+            notices[code] = make_notice(code, 25.0, now - 3600 * 1000, now + 3600 * 1000)
+
+    previous_client = inference.sumal_client
+    with SumalStubServer(plate_codes, notices, latency=latency) as stub, \
+            SumalClient(stub.base_url, cache=TTLCache(maxsize=0)) as client:
+        inference.sumal_client = client
+        timings = []
+        try:
+            # `scrape` prints every notice, keep that out of the timings
+            with contextlib.redirect_stdout(io.StringIO()):
+                inference.inference(image_paths[0])
+                for index in range(requests):
+                    start_time = time.perf_counter()
+                    inference.inference(image_paths[index % len(image_paths)])
+                    timings.append(time.perf_counter() - start_time)
+        finally:
+            inference.sumal_client = previous_client
+    return {'e2e/inference': {**latency_stats(timings), 'stub_latency_s': latency, 'plates': len(plates)}}
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor(),
+            'cpus': os.cpu_count()}
+
+
+def run_suite(image_paths, model_path=None, ocr_model=None, backend='auto', batch_sizes=BATCH_SIZES,
+              stub_latency: float = 0.05, requests: int = 50):
+    """
+    Run the benchmarks. The model benchmarks need `model_path` and `ocr_model`.
+
+    Returns:
+        dict: {'environment': ..., 'results': {benchmark name: measurements}}.
+    """
+    frames = [load_image(path) for path in image_paths]
+    results = micro_benchmarks(frames)
+    if model_path and ocr_model:
+        from inference import Inference
+
+        inference = Inference(rf_bb_model=model_path, ocr_model=ocr_model, backend=backend)
+        results.update(model_benchmarks(inference, frames, batch_sizes))
+        results.update(end_to_end_benchmark(inference, image_paths, stub_latency, requests))
+    return {'environment': environment(), 'results': results}
+
+
+def compare(baseline, current, threshold: float = REGRESSION_THRESHOLD):
+    """
+    Compare two result files of `run_suite`.
+
+    Latency benchmarks are compared on their p50, throughput ones on items per second.
+
+    Returns:
+        list: (name, baseline value, current value, relative change, regression) tuples, the
+        relative change being positive when the current commit is slower.
+    """
+    rows = []
+    for name, current_result in current['results'].items():
+        baseline_result = baseline['results'].get(name)
+        if baseline_result is None:
+            continue
+        if 'items_per_second' in current_result:
+            before, after = baseline_result['items_per_second'], current_result['items_per_second']
+            change = before / after - 1
+        else:
+            before, after = baseline_result['p50_ms'], current_result['p50_ms']
+            change = after / before - 1
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def print_comparison(rows):
+    for name, before, after, change, regression in rows:
+        flag = 'REGRESSION' if regression else ''
+        print(f'{name:<42} {before:12.3f} {after:12.3f} {change * 100:+8.1f}%  {flag}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark the license plate pipeline.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and write a JSON result file')
+    run_parser.add_argument('images', help='Directory of benchmark images')
+    run_parser.add_argument('--output', default='benchmark.json')
+    run_parser.add_argument('--model', default=None, help='Path to the license plate detection model')
+    run_parser.add_argument('--ocr-model', default=None, help='OCR backend spec, e.g. microsoft/trocr-small-printed')
+    run_parser.add_argument('--backend', default='auto')
+    run_parser.add_argument('--limit', type=int, default=32, help='Number of images used')
+    run_parser.add_argument('--batch-sizes', type=int, nargs='+', default=list(BATCH_SIZES))
+    run_parser.add_argument('--stub-latency', type=float, default=0.05, help='Seconds per SUMAL stub answer')
+    run_parser.add_argument('--baseline', default=None, help='Result file to compare with')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two result files')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        paths = sorted(os.path.join(args.images, filename) for filename in os.listdir(args.images)
+                       if filename.lower().endswith(('.jpg', '.jpeg', '.png')))[:args.limit]
+        suite = run_suite(paths, args.model, args.ocr_model, args.backend, args.batch_sizes, args.stub_latency)
+        with open(args.output, 'w') as file:
+            json.dump(suite, file, indent=2)
+        for name, result in suite['results'].items():
+            value = result.get('items_per_second')
+            print(f'{name:<42} ' + (f'{value:10.1f} items/s' if value else f'{result["p50_ms"]:10.3f} ms p50'))
+        baseline_path = args.baseline
+        threshold = REGRESSION_THRESHOLD
+    else:
+        with open(args.current, 'r') as file:
+            suite = json.load(file)
+        baseline_path = args.baseline
+        threshold = args.threshold
+
+    if baseline_path:
+        with open(baseline_path, 'r') as file:
+            rows = compare(json.load(file), suite, threshold)
+        print_comparison(rows)
+        sys.exit(1 if any(row[-1] for row in rows) else 0)
@@ -0,0 +1,98 @@
+"""
+Bounding box helpers shared by the evaluation scripts and the inference pipeline.
+"""
+
+
+def to_top_left(box):
+    """
+    Convert a (x, y, width, height) box given by its center into a top-left anchored box.
+
+    Parameters:
+        box (tuple): (x, y, w, h) with x, y being the center of the box.
+
+    Returns:
+        tuple: (x, y, w, h) with x, y being the top-left corner of the box.
+    """
+    x, y, w, h = box
+    return x - w // 2, y - h // 2, w, h
+
+
+def calculate_iou(box1, box2):
+    """
+    Calculate IoU between two bounding boxes.
+
+    Parameters:
+        box1 (tuple): (x, y, w, h) coordinates of the first bounding box, x, y being the top-left corner.
+        box2 (tuple): (x, y, w, h) coordinates of the second bounding box, x, y being the top-left corner.
+
+    Returns:
+        float: Intersection over Union (IoU) score.
+    """
+    x1, y1, w1, h1 = box1
+    x2, y2, w2, h2 = box2
+
+    # Calculate intersection coordinates
+    x_intersection = max(x1, x2)
+    y_intersection = max(y1, y2)
+    w_intersection = max(0, min(x1 + w1, x2 + w2) - x_intersection)
+    h_intersection = max(0, min(y1 + h1, y2 + h2) - y_intersection)
+
+    # Calculate area of intersection and union
+    area_intersection = w_intersection * h_intersection
+    area_union = w1 * h1 + w2 * h2 - area_intersection
+
+    # Calculate IoU
+    iou = area_intersection / (area_union + 1e-6)  # Adding a small epsilon to avoid division by zero
+
+    return iou
+
+
+def centered_boxes(detections):
+    """
+    Convert detector output into scored boxes given by their center.
+
+    Parameters:
+        detections (np.ndarray): N x 5+ array of (x1, y1, x2, y2, confidence, ...) rows, as
+            returned by the detector backends.
+
+    Returns:
+        list: N [x, y, w, h, confidence] boxes, the coordinates rounded down to pixels.
+    """
+    boxes = []
+    for x1, y1, x2, y2, confidence in detections[:, :5].tolist():
+        width, height = int(x2) - int(x1), int(y2) - int(y1)
+        boxes.append([int(x1) + width // 2, int(y1) + height // 2, width, height, confidence])
+    return boxes
+
+
+def most_confident(boxes):
+    """
+    Pick the plate among the boxes of an image: the most confident one.
+
+    Parameters:
+        boxes (list): (x, y, w, h, confidence) boxes.
+
+    Returns:
+        tuple: (x, y, w, h) of the most confident box, None when there is no box.
+    """
+    if not len(boxes):
+        return None
+    return tuple(max(boxes, key=lambda box: box[4])[:4])
+
+
+def plate_iou(boxes, ground_truth_boxes):
+    """
+    Score the detection of an image: the IoU of its most confident box against the first
+    ground truth box.
+
+    Parameters:
+        boxes (list): (x, y, w, h, confidence) predicted boxes, x, y being the center of the box.
+        ground_truth_boxes (list): (x, y, w, h) ground truth boxes, x, y being the center of the box.
+
+    Returns:
+        float: IoU score, 0 when there is no predicted or no ground truth box.
+    """
+    plate = most_confident(boxes)
+    if plate is None or not len(ground_truth_boxes):
+        return 0
+    return calculate_iou(to_top_left(plate), to_top_left(ground_truth_boxes[0]))
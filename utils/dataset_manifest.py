@@ -0,0 +1,368 @@
+"""
+Content-hash manifest of the image datasets, with duplicate and leakage checks.
+
+The datasets are merges (Roboflow plus the Romanian plate set, Roboflow plus
+HAWKWood for the logs), laid out as `<source>/<split>/images` with a sibling
+`labels` directory. Every image is hashed in parallel: a content hash gives
+it a stable id and finds exact copies, a 64-bit dHash finds near-duplicates
+(re-encoded, resized or lightly edited copies). Near-duplicates are searched
+with a band index on the hashes, so only images sharing a band are compared.
+Groups spanning several sources or several splits are reported, the latter
+being train/test leakage.
+
+The manifest is a JSON file at the dataset root. Re-runs only hash the files
+whose size or modification time changed. Renaming images and labels to their
+stable id goes through a journal, so an interrupted rename is completed by
+the next run instead of leaving the dataset half renamed.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from ocr_backends import dhash
+
+MANIFEST_NAME = 'manifest.json'
+
+JOURNAL_NAME = '_rename_journal.json'
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+SPLITS = ('train', 'valid', 'val', 'test')
+
+# Largest dHash Hamming distance (out of 64 bits) still reported as a near-duplicate
+MAX_DISTANCE = 6
+
+# Hex digits of the content hash used as the stable id of an image
+ID_LENGTH = 16
+
+
+def _hash_file(path):
+    # Content hash and dHash from a single read. JPEGs are decoded at 1/4 scale in grayscale,
+    # plenty for a 9x8 dHash and several times faster than a full decode.
+    with open(path, 'rb') as file:
+        data = file.read()
+    content_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+    gray = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    perceptual_hash = f'{int(dhash([gray])[0]):016x}' if gray is not None else None
+    return content_hash, perceptual_hash
+
+
+def find_images(root):
+    """
+    List the images of a dataset.
+
+    Every `images` directory under `root` is a (source, split): its parent is the split when
+    named like one of `SPLITS`, and the remaining path is the source.
+
+    Returns:
+        list: (relative image path, relative label path or None, source, split) tuples.
+    """
+    found = []
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        if os.path.basename(directory) != 'images':
+            continue
+        parts = os.path.relpath(os.path.dirname(directory), root).split(os.sep)
+        parts = [part for part in parts if part != '.']
+        split = parts.pop() if parts and parts[-1].lower() in SPLITS else ''
+        source = '/'.join(parts) or os.path.basename(os.path.abspath(root))
+        labels_directory = os.path.join(os.path.dirname(directory), 'labels')
+        for filename in sorted(filenames):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            label_path = os.path.join(labels_directory, os.path.splitext(filename)[0] + '.txt')
+            found.append((os.path.relpath(os.path.join(directory, filename), root),
+                          os.path.relpath(label_path, root) if os.path.exists(label_path) else None,
+                          source, split))
+    return found
+
+
+def load_manifest(root):
+    path = os.path.join(root, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return json.load(file)['images']
+
+
+def save_manifest(root, entries):
+    """
+    Write the manifest, atomically replacing the previous one.
+    """
+    path = os.path.join(root, MANIFEST_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'version': 1, 'images': dict(sorted(entries.items()))}, file, indent=1)
+    os.replace(tmp_path, path)
+
+
+def build_manifest(root, workers: int = None):
+    """
+    Hash the images of a dataset, reusing the entries of the previous manifest whose file
+    size and modification time did not change.
+
+    Parameters:
+        root (str): Dataset root.
+        workers (int): Hashing threads, file reads, decoding and hashing release the GIL.
+
+    Returns:
+        dict: Relative image path -> {'id', 'sha', 'dhash', 'size', 'mtime_ns', 'label',
+        'source', 'split'}.
+    """
+    complete_renames(root)
+    previous = load_manifest(root)
+    entries = {}
+    pending = []
+    for image_path, label_path, source, split in find_images(root):
+        stat = os.stat(os.path.join(root, image_path))
+        entry = previous.get(image_path)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            pending.append(image_path)
+        entries[image_path] = {**entry, 'label': label_path, 'source': source, 'split': split}
+
+    with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as executor:
+        hashes = executor.map(_hash_file, [os.path.join(root, path) for path in pending], chunksize=16)
+        for image_path, (content_hash, perceptual_hash) in zip(pending, hashes):
+            entries[image_path].update(id=content_hash[:ID_LENGTH], sha=content_hash, dhash=perceptual_hash)
+    save_manifest(root, entries)
+    return entries
+
+
+class HammingIndex:
+    """
+    Finds the pairs of 64-bit hashes within a Hamming distance.
+
+    The hashes are cut into `max_distance + 1` bands. Two hashes within `max_distance` bits
+    agree on at least one whole band (pigeonhole), so only hashes sharing a band value are
+    compared, with vectorized popcounts.
+
+    Parameters:
+        hashes (np.ndarray): uint64 hashes.
+        max_distance (int): Largest Hamming distance of a reported pair.
+    """
+
+    def __init__(self, hashes, max_distance: int = MAX_DISTANCE):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        edges = np.linspace(0, 64, bands + 1).astype(np.uint64)
+        # (shift, mask) of every band
+        self.bands = [(start, (np.uint64(1) << (end - start)) - np.uint64(1))
+                      for start, end in zip(edges[:-1], edges[1:])]
+
+    def _band_keys(self, hashes, band):
+        start, mask = self.bands[band]
+        return (hashes >> start) & mask
+
+    def pairs(self):
+        """
+        Returns:
+            np.ndarray: (first index, second index, distance) rows with first < second.
+        """
+        found = []
+        for band in range(len(self.bands)):
+            keys = self._band_keys(self.hashes, band)
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            # Runs of equal keys are the buckets, pair every member with the later ones
+            starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            sizes = np.diff(np.r_[starts, len(keys)])
+            for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+                members = np.sort(order[start:start + size])
+                first, second = np.triu_indices(size, k=1)
+                found.append(np.stack([members[first], members[second]], axis=1))
+        if not found:
+            return np.zeros((0, 3), dtype=np.int64)
+        candidates = np.unique(np.concatenate(found), axis=0)
+        distances = _popcount(self.hashes[candidates[:, 0]] ^ self.hashes[candidates[:, 1]])
+        keep = distances <= self.max_distance
+        return np.column_stack([candidates[keep], distances[keep]])
+
+    def query(self, value):
+        """
+        Indices and distances of the hashes within `max_distance` of `value`.
+        """
+        value = np.uint64(value)
+        candidates = np.zeros(len(self.hashes), dtype=bool)
+        for band in range(len(self.bands)):
+            candidates |= self._band_keys(self.hashes, band) == self._band_keys(value, band)
+        indices = np.flatnonzero(candidates)
+        distances = _popcount(self.hashes[indices] ^ value)
+        keep = distances <= self.max_distance
+        return indices[keep], distances[keep]
+
+
+def _popcount(values):
+    return np.unpackbits(np.ascontiguousarray(values, dtype=np.uint64).view(np.uint8).reshape(-1, 8),
+                         axis=1).sum(axis=1, dtype=np.int64)
+
+
+def find_duplicates(entries, max_distance: int = MAX_DISTANCE):
+    """
+    Group exact and near-duplicate images.
+
+    Parameters:
+        entries (dict): Manifest entries, see `build_manifest`.
+        max_distance (int): Largest dHash Hamming distance of near-duplicates.
+
+    Returns:
+        list: One dict per group of two or more images: 'paths', 'exact' (every image has the
+        same content), 'sources', 'splits' and 'leak' (the group spans several splits).
+    """
+    paths = [path for path, entry in entries.items() if entry.get('sha')]
+    parent = list(range(len(paths)))
+
+    def find(index):
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(first, second):
+        first, second = find(first), find(second)
+        if first != second:
+            parent[max(first, second)] = min(first, second)
+
+    by_content = {}
+    for index, path in enumerate(paths):
+        union(index, by_content.setdefault(entries[path]['sha'], index))
+    hashed = [index for index, path in enumerate(paths) if entries[path]['dhash']]
+    hashes = np.array([int(entries[paths[index]]['dhash'], 16) for index in hashed], dtype=np.uint64)
+    for first, second, _ in HammingIndex(hashes, max_distance).pairs():
+        union(hashed[first], hashed[second])
+
+    groups = {}
+    for index in range(len(paths)):
+        groups.setdefault(find(index), []).append(paths[index])
+    report = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        splits = sorted({entries[path]['split'] for path in members})
+        report.append({'paths': members, 'exact': len({entries[path]['sha'] for path in members}) == 1,
+                       'sources': sorted({entries[path]['source'] for path in members}),
+                       'splits': splits, 'leak': len(splits) > 1})
+    return sorted(report, key=lambda group: (not group['leak'], group['paths'][0]))
+
+
+def plan_renames(entries):
+    """
+    Plan the renames of every image (and its label) to its stable id, in its own directory.
+    An exact copy in the same directory would get the same name, it is left untouched and
+    should be removed after reviewing `find_duplicates`.
+
+    Returns:
+        list: (old relative path, new relative path) pairs.
+    """
+    moves = []
+    taken = {}
+    for image_path, entry in sorted(entries.items()):
+        directory, filename = os.path.split(image_path)
+        new_image_path = os.path.join(directory, entry['id'] + os.path.splitext(filename)[1].lower())
+        if taken.setdefault(new_image_path, image_path) != image_path:
+            continue
+        if new_image_path != image_path:
+            moves.append((image_path, new_image_path))
+        if entry['label']:
+            new_label_path = os.path.join(os.path.dirname(entry['label']), entry['id'] + '.txt')
+            if new_label_path != entry['label']:
+                moves.append((entry['label'], new_label_path))
+    return moves
+
+
+def complete_renames(root):
+    """
+    Finish the renames of an interrupted `apply_renames`, if any.
+
+    Every file is first moved to a temporary name and then to its final one, so a new
+    name never overwrites a file that has yet to be moved. The journal records which of
+    the two phases is running, and both are replayed safely.
+    """
+    journal_path = os.path.join(root, JOURNAL_NAME)
+    if not os.path.exists(journal_path):
+        return False
+    with open(journal_path, 'r') as file:
+        journal = json.load(file)
+    moves = journal['moves']
+    if journal['phase'] == 1:
+        for old_path, new_path in moves:
+            source = os.path.join(root, old_path)
+            if os.path.exists(source):
+                os.replace(source, os.path.join(root, _temporary_path(new_path)))
+        _write_journal(root, {**journal, 'phase': 2})
+    for _, new_path in moves:
+        temporary = os.path.join(root, _temporary_path(new_path))
+        if os.path.exists(temporary):
+            os.replace(temporary, os.path.join(root, new_path))
+    save_manifest(root, journal['entries'])
+    os.remove(journal_path)
+    return True
+
+
+def _temporary_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, f'.{filename}.renaming')
+
+
+def _write_journal(root, journal):
+    path = os.path.join(root, JOURNAL_NAME)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(journal, file)
+    os.replace(tmp_path, path)
+
+
+def apply_renames(root, entries):
+    """
+    Rename the images and labels of a dataset to their stable ids and update the manifest.
+
+    Returns:
+        dict: The updated manifest entries.
+    """
+    moves = plan_renames(entries)
+    renamed = dict(moves)
+    updated = {}
+    for image_path, entry in entries.items():
+        label = entry['label']
+        updated[renamed.get(image_path, image_path)] = {**entry, 'label': renamed.get(label, label)}
+    _write_journal(root, {'phase': 1, 'moves': moves, 'entries': updated})
+    complete_renames(root)
+    return updated
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Build the content-hash manifest of a dataset and report duplicates.')
+    parser.add_argument('root', help='Dataset root, e.g. the DVC data directory')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-distance', type=int, default=MAX_DISTANCE,
+                        help='Largest dHash Hamming distance of near-duplicates')
+    parser.add_argument('--report', default=None, help='JSON file receiving the duplicate groups')
+    parser.add_argument('--rename', action='store_true', help='Rename images and labels to their stable id')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    manifest = build_manifest(args.root, args.workers)
+    duplicates = find_duplicates(manifest, args.max_distance)
+    print(f'{len(manifest)} images hashed in {time.perf_counter() - start_time:.2f}s')
+    print(f'{sum(group["exact"] for group in duplicates)} exact and '
+          f'{sum(not group["exact"] for group in duplicates)} near-duplicate groups, '
+          f'{sum(len(group["sources"]) > 1 for group in duplicates)} across sources, '
+          f'{sum(group["leak"] for group in duplicates)} across splits')
+    for group in duplicates:
+        if group['leak']:
+            print('LEAK', ' '.join(group['paths']))
+    if args.report:
+        with open(args.report, 'w') as file:
+            json.dump(duplicates, file, indent=2)
+    if args.rename:
+        apply_renames(args.root, manifest)
+        print('Renamed images and labels to their stable ids')
@@ -0,0 +1,417 @@
+"""
+Runtime backends for the YOLOv8 detectors (license plate and log models).
+
+Every backend takes decoded BGR frames and returns one N x 6 float32 array per
+frame with (x1, y1, x2, y2, confidence, class) rows in frame pixels. The
+TFLite and ONNX Runtime backends run the exported models directly: NumPy
+letterboxing into a preallocated input tensor, a single interpreter call and
+NumPy NMS, without importing torch or ultralytics. Ultralytics stays available
+as the fallback backend.
+"""
+
+import os
+import re
+
+import cv2
+import numpy as np
+
+from matching import iou_matrix
+
+# Precisions a `.tflite` model may be exported in, named `<stem>_<variant>.tflite` like the
+# `best_float32.tflite` exports; see `quantization` to build the int8 and dynamic variants
+MODEL_VARIANTS = ('float32', 'float16', 'int8', 'dynamic')
+
+_VARIANT_SUFFIX = re.compile(r'_(?:' + '|'.join(MODEL_VARIANTS) + r')(?=\.tflite$)')
+
+# Offset added per class so a single NMS pass never suppresses boxes of different classes
+_CLASS_OFFSET = 4096
+
+
+def default_num_threads():
+    """
+    Threads a model runtime may use when not given explicitly: `OMP_NUM_THREADS` when it is
+    set, as the inference server does for every worker process, None otherwise.
+    """
+    value = os.environ.get('OMP_NUM_THREADS', '')
+    return int(value) if value.isdigit() and int(value) > 0 else None
+
+
+def limit_threads(threads):
+    """
+    Limit the model runtimes of the current process to `threads` threads, so N worker
+    processes each using all CPUs do not oversubscribe the machine N times. The runtimes read
+    OMP_NUM_THREADS when loading a model (see `default_num_threads`), torch is limited
+    explicitly.
+    """
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+def letterbox(image, size=640, out=None, color=114):
+    """
+    Resize an image to fit a square of `size` pixels keeping its aspect ratio, padding the rest.
+
+    Parameters:
+        image (np.ndarray): H x W x 3 image.
+        size (int): Side of the square output.
+        out (np.ndarray): Optional size x size x 3 uint8 buffer to write into.
+        color (int): Value of the padding.
+
+    Returns:
+        tuple: Letterboxed image, scale factor and (left, top) padding in pixels.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_height, new_width = int(round(height * scale)), int(round(width * scale))
+    top, left = (size - new_height) // 2, (size - new_width) // 2
+
+    if out is None:
+        out = np.empty((size, size, 3), dtype=np.uint8)
+    out.fill(color)
+    if (new_height, new_width) != (height, width):
+        image = cv2.resize(image, (new_width, new_height), interpolation=cv2.INTER_LINEAR)
+    out[top:top + new_height, left:left + new_width] = image
+
+    return out, scale, (left, top)
+
+
+def nms(boxes, scores, iou_threshold=0.45, max_det=300):
+    """
+    Greedy non-maximum suppression.
+
+    Parameters:
+        boxes (np.ndarray): N x 4 (x1, y1, x2, y2) boxes.
+        scores (np.ndarray): N scores.
+        iou_threshold (float): Boxes overlapping a kept box more than this are dropped.
+        max_det (int): Maximum number of boxes kept.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, by decreasing score.
+    """
+    order = np.argsort(-scores, kind='stable')
+    keep = []
+    while order.size and len(keep) < max_det:
+        best = order[0]
+        keep.append(best)
+        if order.size == 1:
+            break
+        ious = iou_matrix(boxes[best:best + 1], boxes[order[1:]])[0]
+        order = order[1:][ious <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def postprocess(output, conf, iou, input_size, scale, pad, shape, max_det=300):
+    """
+    Turn the raw YOLOv8 output of one image into detections in frame pixels.
+
+    Parameters:
+        output (np.ndarray): (4 + classes) x anchors (or anchors x (4 + classes)) predictions.
+        conf (float): Minimum confidence.
+        iou (float): NMS IoU threshold.
+        input_size (int): Side of the model input.
+        scale (float): Scale factor returned by `letterbox`.
+        pad (tuple): (left, top) padding returned by `letterbox`.
+        shape (tuple): Height and width of the original frame.
+        max_det (int): Maximum number of detections.
+
+    Returns:
+        np.ndarray: N x 6 (x1, y1, x2, y2, confidence, class) float32 array.
+    """
+    if output.shape[0] < output.shape[1]:
+        output = output.T
+    scores_all = output[:, 4:]
+    classes = scores_all.argmax(axis=1)
+    scores = scores_all[np.arange(len(classes)), classes]
+    mask = scores > conf
+    if not mask.any():
+        return np.zeros((0, 6), dtype=np.float32)
+
+    xywh = output[mask, :4].astype(np.float32)
+    scores, classes = scores[mask], classes[mask]
+    # TFLite exports predict coordinates normalized to the input size
+    if xywh.max() <= 2.0:
+        xywh *= input_size
+    boxes = np.concatenate([xywh[:, :2] - xywh[:, 2:] / 2, xywh[:, :2] + xywh[:, 2:] / 2], axis=1)
+
+    keep = nms(boxes + classes[:, None] * _CLASS_OFFSET, scores, iou, max_det)
+    boxes, scores, classes = boxes[keep], scores[keep], classes[keep]
+
+    boxes[:, [0, 2]] = np.clip((boxes[:, [0, 2]] - pad[0]) / scale, 0, shape[1])
+    boxes[:, [1, 3]] = np.clip((boxes[:, [1, 3]] - pad[1]) / scale, 0, shape[0])
+    return np.concatenate([boxes, scores[:, None], classes[:, None]], axis=1).astype(np.float32)
+
+
+class DetectorBackend:
+    """
+    Interface of the detector backends.
+
+    Parameters:
+        model_path (str): Path of the exported model.
+        imgsz (int): Side of the square model input.
+    """
+
+    name = 'base'
+
+    def __init__(self, model_path, imgsz=640):
+        self.model_path = model_path
+        self.imgsz = imgsz
+
+    def predict(self, images, conf=0.4, iou=0.45):
+        """
+        Detect objects on decoded frames.
+
+        Parameters:
+            images (list): BGR frames, or a single frame.
+            conf (float): Minimum confidence.
+            iou (float): NMS IoU threshold.
+
+        Returns:
+            list: One N x 6 (x1, y1, x2, y2, confidence, class) array per frame.
+        """
+        raise NotImplementedError
+
+
+class _ArrayBackend(DetectorBackend):
+    # Shared letterbox -> run -> NMS loop of the TFLite and ONNX backends
+
+    def __init__(self, model_path, imgsz=640):
+        super().__init__(model_path, imgsz)
+        self._letterboxed = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+
+    def _batch_size(self, count):
+        return 1
+
+    def _input_buffer(self, batch_size):
+        raise NotImplementedError
+
+    def _run(self, batch_size):
+        raise NotImplementedError
+
+    def _fill(self, buffer, index, image):
+        letterboxed, scale, pad = letterbox(image, self.imgsz, out=self._letterboxed)
+        # BGR -> RGB and scaling to [0, 1] in a single pass into the preallocated input
+        np.multiply(letterboxed[..., ::-1], 1 / 255, out=buffer[index], casting='unsafe')
+        return scale, pad
+
+    def predict(self, images, conf=0.4, iou=0.45):
+        if isinstance(images, np.ndarray):
+            images = [images]
+        detections = []
+        start = 0
+        while start < len(images):
+            batch_size = self._batch_size(len(images) - start)
+            chunk = images[start:start + batch_size]
+            buffer = self._input_buffer(batch_size)
+            transforms = [self._fill(buffer, index, image) for index, image in enumerate(chunk)]
+            outputs = self._run(batch_size)
+            for output, image, (scale, pad) in zip(outputs, chunk, transforms):
+                detections.append(postprocess(output, conf, iou, self.imgsz, scale, pad, image.shape[:2]))
+            start += batch_size
+        return detections
+
+
+class TFLiteBackend(_ArrayBackend):
+    """
+    Runs a `.tflite` export with the TFLite interpreter (tflite_runtime, ai_edge_litert or
+    tensorflow, whichever is installed). Float32 and int8 quantized models are supported.
+
+    Parameters:
+        model_path (str): Path of the `.tflite` model.
+        imgsz (int): Side of the square model input.
+        num_threads (int): Interpreter threads, `default_num_threads` or all CPUs when omitted.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, model_path, imgsz=640, num_threads=None):
+        super().__init__(model_path, imgsz)
+        self.num_threads = num_threads or default_num_threads() or os.cpu_count()
+        # One interpreter per batch size, all sizes being powers of two: resizing a single
+        # interpreter would reallocate its tensors on every change of chunk size, and a single
+        # frame would still run the whole batch
+        self._interpreters = {}
+        self._model_batch = self._load(None)
+        # Cleared the first time the input of the model cannot be resized (a fixed batch export)
+        self._resizable = True
+        self._current = self._interpreters[self._model_batch]
+
+    def _load(self, batch_size):
+        # Load an interpreter for `batch_size` frames (the exported batch when None) and return its batch
+        interpreter = _tflite_interpreter(self.model_path, self.num_threads)
+        input_details = interpreter.get_input_details()[0]
+        if batch_size is not None and batch_size != input_details['shape'][0]:
+            interpreter.resize_tensor_input(input_details['index'], [batch_size, self.imgsz, self.imgsz, 3])
+        interpreter.allocate_tensors()
+        input_details = interpreter.get_input_details()[0]
+        batch_size = int(input_details['shape'][0])
+        self._interpreters[batch_size] = (interpreter, input_details, interpreter.get_output_details()[0],
+                                          np.zeros(input_details['shape'], dtype=np.float32))
+        return batch_size
+
+    def _batch_size(self, count):
+        # Largest power of two fitting the frames, e.g. 7 frames run as 4 + 2 + 1
+        batch_size = 1 << (count.bit_length() - 1)
+        if batch_size not in self._interpreters and self._resizable:
+            try:
+                self._load(batch_size)
+            except (RuntimeError, ValueError):
+                self._resizable = False
+        if batch_size not in self._interpreters:
+            # Fixed batch model: frames run in its batch, padded
+            batch_size = self._model_batch
+        self._current = self._interpreters[batch_size]
+        return min(count, batch_size)
+
+    def _input_buffer(self, batch_size):
+        return self._current[3]
+
+    def _run(self, batch_size):
+        interpreter, details, output_details, tensor = self._current
+        if details['dtype'] != np.float32:
+            # Quantized input: q = x / scale + zero_point
+            input_scale, zero_point = details['quantization']
+            tensor = np.round(tensor / input_scale + zero_point).astype(details['dtype'])
+        interpreter.set_tensor(details['index'], tensor)
+        interpreter.invoke()
+
+        output = interpreter.get_tensor(output_details['index'])
+        if output_details['dtype'] != np.float32:
+            output_scale, zero_point = output_details['quantization']
+            output = (output.astype(np.float32) - zero_point) * output_scale
+        return output[:batch_size]
+
+
+def _tflite_interpreter(model_path, num_threads):
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter(model_path=model_path, num_threads=num_threads)
+
+
+class OnnxBackend(_ArrayBackend):
+    """
+    Runs an `.onnx` export with ONNX Runtime on the CPU.
+
+    Parameters:
+        model_path (str): Path of the `.onnx` model.
+        imgsz (int): Side of the square model input.
+        num_threads (int): Intra-op threads, `default_num_threads` or ONNX Runtime's default
+            when omitted.
+    """
+
+    name = 'onnx'
+
+    def __init__(self, model_path, imgsz=640, num_threads=None):
+        super().__init__(model_path, imgsz)
+        import onnxruntime as ort
+
+        num_threads = num_threads or default_num_threads()
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._dynamic_batch = not isinstance(model_input.shape[0], int)
+        self._nhwc = np.zeros((1, imgsz, imgsz, 3), dtype=np.float32)
+
+    def _batch_size(self, count):
+        return count if self._dynamic_batch else 1
+
+    def _input_buffer(self, batch_size):
+        if self._nhwc.shape[0] != batch_size:
+            self._nhwc = np.zeros((batch_size, self.imgsz, self.imgsz, 3), dtype=np.float32)
+        return self._nhwc
+
+    def _run(self, batch_size):
+        tensor = np.ascontiguousarray(self._nhwc.transpose(0, 3, 1, 2))
+        return self.session.run(None, {self._input_name: tensor})[0]
+
+
+class UltralyticsBackend(DetectorBackend):
+    """
+    Runs any model ultralytics can load (.pt, .tflite, .onnx, ...) through `ultralytics.YOLO`.
+    """
+
+    name = 'ultralytics'
+
+    def __init__(self, model_path, imgsz=640):
+        super().__init__(model_path, imgsz)
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+
+    def predict(self, images, conf=0.4, iou=0.45):
+        if isinstance(images, np.ndarray):
+            images = [images]
+        results = self.model.predict(list(images), imgsz=self.imgsz, conf=conf, iou=iou, verbose=False)
+        return [result.boxes.data.cpu().numpy().astype(np.float32) for result in results]
+
+
+BACKENDS = {
+    'tflite': TFLiteBackend,
+    'onnx': OnnxBackend,
+    'ultralytics': UltralyticsBackend,
+}
+
+
+def variant_path(model_path, variant):
+    """
+    Path of another precision of a `.tflite` model, e.g. `best_float32.tflite` ->
+    `best_int8.tflite`.
+
+    Raises:
+        ValueError: For an unknown variant or a model that is not a `.tflite` file.
+        FileNotFoundError: When the variant was not built.
+    """
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown model variant '{variant}', expected one of {', '.join(MODEL_VARIANTS)}")
+    if not model_path.endswith('.tflite'):
+        raise ValueError(f'Model variants are .tflite files, got {model_path}')
+    if _VARIANT_SUFFIX.search(model_path):
+        path = _VARIANT_SUFFIX.sub(f'_{variant}', model_path)
+    else:
+        path = f'{model_path[:-len(".tflite")]}_{variant}.tflite'
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'No {variant} variant of {model_path}, build it with quantization.py')
+    return path
+
+
+def load_detector(model_path, backend='auto', imgsz=640, variant=None):
+    """
+    Load a detector with the requested backend.
+
+    Parameters:
+        model_path (str): Path of the model.
+        backend (str): 'tflite', 'onnx', 'ultralytics' or 'auto'. 'auto' runs `.tflite` and
+            `.onnx` files directly when their runtime is installed and uses ultralytics otherwise.
+        imgsz (int): Side of the square model input.
+        variant (str): Precision of a `.tflite` model to load instead of `model_path` itself,
+            one of `MODEL_VARIANTS`, see `variant_path`.
+
+    Returns:
+        DetectorBackend: The loaded detector.
+    """
+    if variant:
+        model_path = variant_path(model_path, variant)
+    if backend != 'auto':
+        return BACKENDS[backend](model_path, imgsz=imgsz)
+
+    extension = os.path.splitext(model_path)[1].lower()
+    direct = {'.tflite': TFLiteBackend, '.onnx': OnnxBackend}.get(extension)
+    if direct is not None:
+        try:
+            return direct(model_path, imgsz=imgsz)
+        except ImportError:
+            pass
+    return UltralyticsBackend(model_path, imgsz=imgsz)
@@ -0,0 +1,570 @@
+"""
+Parallel, resumable evaluation of the license plate detection and OCR models.
+
+The image set is split into shards that run on a process pool. Every worker
+runs on its share of the CPUs and loads its model once, and every prediction is cached on disk under the model
+id and the hash of the image, so a re-run only computes the images (or
+models) that changed. Plots are written after the metrics, never in between.
+
+The hosted Roboflow models are queried through `RoboflowClient`: a bounded
+thread pool, a request rate limit and retries with backoff, with the answers
+cached on disk the same way. Pointing it to a `roboflow_stub` server replays
+recorded predictions offline.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from boxes import centered_boxes, most_confident, plate_iou
+from detector_backends import limit_threads
+from evaluation import (CUSTOM_MODEL_PATH, IMG_DIRECTORY, LABELS_DIRECTORY, LICENSE_LINKS, LICENSE_MODELS,
+                        OCR_CROPPED_DIRECTORY, OCR_LINKS, OCR_MODELS, clean_license_plate, load_model,
+                        process_ground_truth_labels)
+from label_index import LabelIndex
+from matching import evaluate_dataset, xywh_to_xyxy
+
+CACHE_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.eval_cache')
+
+# Hosted inference API behind `roboflow.Roboflow().workspace().project(...).version(...).model`
+ROBOFLOW_URL = 'https://detect.roboflow.com'
+
+# Model loaded by the current worker process, keyed by model id
+_WORKER_MODELS = {}
+
+
+def image_hash(image_path):
+    """
+    Hash the content of an image (or of any file), so renamed or copied files keep their
+    cached predictions.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(image_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_hash(data):
+    """
+    Same hash as `image_hash`, of an image already read into memory.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class PredictionCache:
+    """
+    On-disk cache of per-image predictions, one JSON file per (model, image hash).
+
+    Parameters:
+        root (str): Directory holding the caches of all models.
+        model_id (str): Path or name of the model the predictions belong to. The content of
+            a model file is part of the key, so a model rebuilt in place (e.g. a quantized
+            variant) does not reuse the predictions of the previous build.
+    """
+
+    def __init__(self, root, model_id):
+        key = model_id
+        # A model path, or the model of an OCR spec such as 'ctc:<path>'
+        model_path = model_id if os.path.isfile(model_id) else model_id.partition(':')[2]
+        if os.path.isfile(model_path):
+            key = f'{model_id}:{image_hash(model_path)}'
+        safe_id = hashlib.blake2b(key.encode(), digest_size=8).hexdigest()
+        self.directory = os.path.join(root, f'{os.path.basename(model_id)}-{safe_id}')
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'r') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(value, file)
+        os.replace(tmp_path, path)
+
+
+class RateLimiter:
+    """
+    Token bucket shared by threads: at most `rate` calls per second, in bursts of `burst`.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # Negative tokens are the calls queued ahead of this one
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+
+class RoboflowClient:
+    """
+    Concurrent, rate-limited and cached client of the Roboflow hosted inference API.
+
+    Parameters:
+        api_key (str): Roboflow API key, ROBOFLOW_API_KEY from the environment (or .env file)
+            by default.
+        base_url (str): Root of the inference API, point it to a `roboflow_stub` server to
+            replay recorded predictions.
+        max_workers (int): Concurrent requests.
+        rate (float): Maximum requests per second, 0 for no limit.
+        retries (int): Retries of failed connections, 429 and 5xx answers, with exponential
+            backoff (and the Retry-After header when the API sends one).
+        timeout (float): Timeout in seconds of every request.
+        cache_root (str): Directory of the prediction cache, None disables it. The answers
+            are cached per API, so a stub never answers for the hosted models.
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = ROBOFLOW_URL, max_workers: int = 8, rate: float = 10.0,
+                 retries: int = 5, timeout: float = 30, cache_root: str = CACHE_DIRECTORY):
+        if api_key is None and base_url == ROBOFLOW_URL:
+            from dotenv import load_dotenv
+
+            load_dotenv()
+            api_key = os.getenv('ROBOFLOW_API_KEY')
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache_root = cache_root
+        self.limiter = RateLimiter(rate, burst=max_workers)
+        self.stats = {'requests': 0, 'cached': 0, 'retries': 0}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers,
+                              max_retries=Retry(total=retries, backoff_factor=0.5, allowed_methods=None,
+                                                status_forcelist=(429, 500, 502, 503, 504)))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _cache(self, model, version):
+        if self.cache_root is None:
+            return None
+        with self._lock:
+            cache = self._caches.get((model, version))
+            if cache is None:
+                cache = self._caches[(model, version)] = PredictionCache(
+                    self.cache_root, f'{self.base_url}/roboflow-{model}-{version}')
+            return cache
+
+    def predict(self, model, version, image_path, confidence=50, overlap=50):
+        """
+        Get the predictions of a hosted model for an image.
+
+        Parameters:
+            model (str): Roboflow project id, e.g. one of `evaluation.LICENSE_MODELS`.
+            version (int): Model version.
+            image_path (str): Path to the image.
+            confidence (int): Minimum confidence in percent.
+            overlap (int): NMS overlap threshold in percent.
+
+        Returns:
+            dict: JSON answer of the API, with its 'predictions' list.
+        """
+        with open(image_path, 'rb') as file:
+            data = file.read()
+        key = f'{bytes_hash(data)}-c{confidence}-o{overlap}'
+        cache = self._cache(model, version)
+        answer = cache.get(key) if cache is not None else None
+        if answer is not None:
+            with self._lock:
+                self.stats['cached'] += 1
+            return answer
+
+        self.limiter.acquire()
+        params = {'confidence': confidence, 'overlap': overlap}
+        if self.api_key:
+            params['api_key'] = self.api_key
+        response = self.session.post(f'{self.base_url}/{model}/{version}', params=params,
+                                     data=base64.b64encode(data),
+                                     headers={'Content-Type': 'application/x-www-form-urlencoded'},
+                                     timeout=self.timeout)
+        retries = getattr(response.raw, 'retries', None)
+        with self._lock:
+            self.stats['requests'] += 1
+            if retries is not None and retries.history:
+                self.stats['retries'] += len(retries.history)
+        response.raise_for_status()
+        answer = response.json()
+        if cache is not None:
+            cache.set(key, answer)
+        return answer
+
+    def predict_many(self, model, version, image_paths, confidence=50, overlap=50):
+        """
+        Get the predictions of a hosted model for many images, `max_workers` at a time.
+
+        Returns:
+            list: One answer per image, in order.
+        """
+        return list(self._executor.map(lambda path: self.predict(model, version, path, confidence, overlap),
+                                       image_paths))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def list_images(directory, extension='.jpg'):
+    return sorted(filename for filename in os.listdir(directory) if filename.endswith(extension))
+
+
+def shard(items, count):
+    """
+    Split `items` into at most `count` interleaved shards of similar size.
+    """
+    count = max(1, min(count, len(items)))
+    return [items[index::count] for index in range(count)]
+
+
+def load_ground_truth(labels_directory):
+    """
+    Read the YOLO label files, keyed by file name without extension.
+
+    Returns:
+        tuple: Dictionaries of bounding boxes and cleaned license plate numbers.
+    """
+    bounding_boxes_dict, license_number_dict = process_ground_truth_labels(labels_directory)
+    return bounding_boxes_dict, {os.path.splitext(filename)[0]: plate for filename, plate in license_number_dict.items()}
+
+
+def _worker_model(model_id, loader):
+    # A worker keeps only the model of its current shard, so the pool never holds every
+    # model (e.g. several TrOCR-large copies) in every process
+    if model_id not in _WORKER_MODELS:
+        _WORKER_MODELS.clear()
+        _WORKER_MODELS[model_id] = loader(model_id)
+    return _WORKER_MODELS[model_id]
+
+
+def _detect_shard(model_path, directory, filenames, cache_root):
+    # Runs in a worker process: returns {filename: boxes} and the time spent in the model
+    cache = PredictionCache(cache_root, model_path)
+    predictions = {}
+    compute_time = 0.0
+    for filename in filenames:
+        img_path = os.path.join(directory, filename)
+        key = image_hash(img_path)
+        boxes = cache.get(key)
+        if boxes is None:
+            import cv2
+
+            model = _worker_model(model_path, load_model)
+            start_time = time.time()
+            detections = model.predict(cv2.imread(img_path), conf=0.4, iou=0.45)[0]
+            compute_time += time.time() - start_time
+            boxes = centered_boxes(detections)
+            cache.set(key, boxes)
+        predictions[filename] = boxes
+    return predictions, compute_time
+
+
+def _ocr_shard(model_name, directory, filenames, cache_root):
+    # Runs in a worker process: returns {filename: cleaned text} and the time spent in the model
+    cache = PredictionCache(cache_root, model_name)
+    predictions = {}
+    compute_time = 0.0
+    for filename in filenames:
+        image_path = os.path.join(directory, filename)
+        key = image_hash(image_path)
+        text = cache.get(key)
+        if text is None:
+            from ocr_backends import load_ocr
+
+            model = _worker_model(model_name, load_ocr)
+            start_time = time.time()
+            text = clean_license_plate(model.read([image_path])[0])
+            compute_time += time.time() - start_time
+            cache.set(key, text)
+        predictions[filename] = text
+    return predictions, compute_time
+
+
+def _run_sharded(task, models, directory, filenames, workers, cache_root):
+    # Fan the (model, shard) tasks out over the pool and merge the results per model. Every
+    # worker runs its models on its share of the CPUs
+    shards_per_model = max(1, workers // len(models))
+    predictions = {model: {} for model in models}
+    compute_time = {model: 0.0 for model in models}
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=limit_threads, initargs=(threads,)) as executor:
+        futures = {executor.submit(task, model, directory, part, cache_root): model
+                   for model in models for part in shard(filenames, shards_per_model)}
+        for future in as_completed(futures):
+            model = futures[future]
+            shard_predictions, shard_time = future.result()
+            predictions[model].update(shard_predictions)
+            compute_time[model] += shard_time
+    return predictions, compute_time
+
+
+def load_ground_truth_boxes(labels_directory):
+    """
+    Read every box of the YOLO label files, keyed by file name without extension.
+
+    Returns:
+        dict: M x 4 (x1, y1, x2, y2) boxes per image.
+    """
+    index = LabelIndex.build(labels_directory)
+    return {name: index.boxes_xyxy(name) for name in index.names}
+
+
+def detection_metrics(predictions, ground_truth_boxes):
+    """
+    Precision, recall and mAP of the cached predictions of one model over all boxes,
+    see `matching.evaluate_dataset`.
+
+    Parameters:
+        predictions (dict): File name -> [x, y, w, h, confidence] boxes, as returned by
+            `evaluate_detection`.
+        ground_truth_boxes (dict): See `load_ground_truth_boxes`.
+    """
+    arrays = {}
+    for filename, boxes in predictions.items():
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 5)
+        arrays[os.path.splitext(filename)[0]] = (xywh_to_xyxy(boxes[:, :4]), boxes[:, 4])
+    return evaluate_dataset(arrays, ground_truth_boxes)
+
+
+def evaluate_detection(directory, ground_truth_data, model_paths, workers=None, cache_root=CACHE_DIRECTORY,
+                       ground_truth_boxes=None):
+    """
+    Evaluate local license plate detection models in parallel.
+
+    Parameters:
+        directory (str): Path to the directory containing test images.
+        ground_truth_data (dict): Ground truth boxes keyed by file name without extension,
+            see `load_ground_truth`.
+        model_paths (list): Paths of the detection models.
+        workers (int): Number of worker processes, all CPUs by default.
+        cache_root (str): Directory of the prediction cache.
+        ground_truth_boxes (dict): Every ground truth box per image, see `load_ground_truth_boxes`.
+            When given, the dataset-level metrics of `detection_metrics` are added.
+
+    Returns:
+        tuple: Per-model evaluation tuples (model, mean IoU, number detected, total time,
+        model compute time, dataset metrics or None) and the raw predictions, keyed by model
+        and file name.
+    """
+    workers = workers or os.cpu_count()
+    filenames = list_images(directory)
+    start_time = time.time()
+    predictions, compute_time = _run_sharded(_detect_shard, model_paths, directory, filenames, workers, cache_root)
+    total_time = time.time() - start_time
+
+    performance = []
+    for model_path in model_paths:
+        iou_list = [plate_iou(predictions[model_path][filename], ground_truth_data[os.path.splitext(filename)[0]])
+                    for filename in filenames]
+        mean_iou = sum(iou_list) / len(iou_list) if iou_list else 0
+        nr_detected = sum(1 for value in iou_list if value != 0)
+        metrics = detection_metrics(predictions[model_path], ground_truth_boxes) if ground_truth_boxes else None
+        performance.append((model_path, mean_iou, nr_detected, total_time, compute_time[model_path], metrics))
+
+    return performance, predictions
+
+
+def evaluate_roboflow(directory, ground_truth_data, models=LICENSE_MODELS, version: int = 1, confidence: int = 50,
+                      overlap: int = 50, client: RoboflowClient = None):
+    """
+    Evaluate hosted Roboflow license plate models, with the metrics of the Roboflow mode of
+    `evaluation.license_plate_bbox_evaluation`.
+
+    Parameters:
+        directory (str): Path to the directory containing test images.
+        ground_truth_data (dict): Ground truth boxes keyed by file name without extension.
+        models (list): Roboflow project ids.
+        version (int): Version of every model.
+        confidence (int): Minimum confidence in percent.
+        overlap (int): NMS overlap threshold in percent.
+        client (RoboflowClient): Client of the API (or of a stub), a default one when omitted.
+
+    Returns:
+        list: (model, mean IoU, number detected, total time, link) per model.
+    """
+    own_client = client is None
+    client = client or RoboflowClient()
+    filenames = list_images(directory)
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    performance = []
+    try:
+        for model in models:
+            start_time = time.time()
+            answers = client.predict_many(model, version, paths, confidence, overlap)
+            total_time = time.time() - start_time
+
+            iou_list = []
+            for filename, answer in zip(filenames, answers):
+                # Roboflow boxes are centered like the labels
+                boxes = [(int(prediction['x']), int(prediction['y']), int(prediction['width']),
+                          int(prediction['height']), prediction.get('confidence', 0))
+                         for prediction in answer['predictions']]
+                iou_list.append(plate_iou(boxes, ground_truth_data[os.path.splitext(filename)[0]]))
+            mean_iou = sum(iou_list) / len(iou_list) if iou_list else 0
+            nr_detected = sum(1 for value in iou_list if value != 0)
+            link = LICENSE_LINKS[LICENSE_MODELS.index(model)] if model in LICENSE_MODELS else ''
+            performance.append((model, mean_iou, nr_detected, total_time, link))
+    finally:
+        if own_client:
+            client.close()
+    return performance
+
+
+def evaluate_ocr(evaluation_directory, ground_truth_dict, models, workers=None, cache_root=CACHE_DIRECTORY):
+    """
+    Evaluate OCR models in parallel, with the metrics of `evaluation.ocr_evaluation`.
+
+    Parameters:
+        evaluation_directory (str): Path to the directory containing the cropped plates.
+        ground_truth_dict (dict): Cleaned license plate numbers keyed by file name without
+            extension, see `load_ground_truth`.
+        models (list): List of OCR model names.
+        workers (int): Number of worker processes, all CPUs by default.
+        cache_root (str): Directory of the prediction cache.
+
+    Returns:
+        list: [model, link, accuracy, fully correct, total time, model compute time] per model.
+    """
+    workers = workers or os.cpu_count()
+    filenames = list_images(evaluation_directory)
+    start_time = time.time()
+    predictions, compute_time = _run_sharded(_ocr_shard, models, evaluation_directory, filenames, workers, cache_root)
+    total_time = time.time() - start_time
+
+    performance = []
+    for model in models:
+        correct_predictions = 0
+        total_predictions = 0
+        full_correct = 0
+        for filename in filenames:
+            ground_truth = ground_truth_dict[filename.split('.')[0].zfill(3)]
+            cleaned_prediction = predictions[model][filename]
+            total_predictions += len(ground_truth)
+            if cleaned_prediction == ground_truth:
+                full_correct += 1
+            correct_predictions += sum(1 for pred_char, gt_char in zip(cleaned_prediction, ground_truth)
+                                       if pred_char == gt_char)
+        accuracy = correct_predictions / total_predictions if total_predictions > 0 else 0
+        link = OCR_LINKS[OCR_MODELS.index(model)] if model in OCR_MODELS else ''
+        performance.append([model, link, accuracy, full_correct, total_time, compute_time[model]])
+
+    return performance
+
+
+def save_detection_plots(directory, ground_truth_data, predictions, output_directory):
+    """
+    Draw the predicted (red) and ground truth (green) boxes of every image into PNG files.
+    Runs after the evaluation so plotting never slows the models down.
+    """
+    import cv2
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.patches as patches
+    import matplotlib.pyplot as plt
+
+    os.makedirs(output_directory, exist_ok=True)
+    for filename, boxes in predictions.items():
+        image = cv2.imread(os.path.join(directory, filename))
+        fig, ax = plt.subplots(1)
+        ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+        ground_truth = ground_truth_data[os.path.splitext(filename)[0]]
+        # The box scored by the evaluation
+        for bbox, color, label in ((most_confident(boxes), 'r', 'Predicted'),
+                                   (ground_truth[0] if ground_truth else None, 'g', 'Ground Truth')):
+            if bbox is not None:
+                ax.add_patch(patches.Rectangle((bbox[0] - bbox[2] // 2, bbox[1] - bbox[3] // 2), bbox[2], bbox[3],
+                                               linewidth=2, edgecolor=color, facecolor='none', label=label))
+        plt.legend()
+        fig.savefig(os.path.join(output_directory, f'{os.path.splitext(filename)[0]}.png'))
+        plt.close(fig)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Parallel, cached evaluation of the detection and OCR models.')
+    parser.add_argument('evaluation_type', choices=['license_plate', 'roboflow', 'ocr'])
+    parser.add_argument('--models', nargs='+', help='Detection model paths, Roboflow projects or OCR model names')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--roboflow-url', default=ROBOFLOW_URL,
+                        help='Roboflow inference API, e.g. a roboflow_stub server')
+    parser.add_argument('--rate', type=float, default=10.0, help='Maximum Roboflow requests per second')
+    parser.add_argument('--plots', default=None, help='Directory to write the detection plots to')
+    args = parser.parse_args()
+
+    bounding_box_dict, license_plate_numbers_dict = load_ground_truth(LABELS_DIRECTORY)
+    if args.evaluation_type == 'license_plate':
+        model_paths = args.models or [CUSTOM_MODEL_PATH]
+        performance, raw_predictions = evaluate_detection(IMG_DIRECTORY, bounding_box_dict, model_paths, args.workers,
+                                                          ground_truth_boxes=load_ground_truth_boxes(LABELS_DIRECTORY))
+        for evaluation in performance:
+            print(f"Model Name: {evaluation[0]}")
+            print(f"IoU performance: {evaluation[1]}")
+            print(f"Detected {evaluation[2]}/{len(bounding_box_dict)}")
+            print(f"Time: {evaluation[3]} (model: {evaluation[4]})")
+            print(f"mAP@.5: {evaluation[5]['mAP50']} | mAP@[.5:.95]: {evaluation[5]['mAP50_95']}")
+            print(f"Precision@.5: {evaluation[5]['precision'][0]} | Recall@.5: {evaluation[5]['recall'][0]}")
+        if args.plots:
+            for model_path in model_paths:
+                save_detection_plots(IMG_DIRECTORY, bounding_box_dict, raw_predictions[model_path],
+                                     os.path.join(args.plots, os.path.basename(model_path)))
+    elif args.evaluation_type == 'roboflow':
+        # A stub answers from its recordings, caching them would only benchmark the cache
+        cache_root = CACHE_DIRECTORY if args.roboflow_url == ROBOFLOW_URL else None
+        with RoboflowClient(base_url=args.roboflow_url, max_workers=args.workers or 8, rate=args.rate,
+                            cache_root=cache_root) as client:
+            performance = evaluate_roboflow(IMG_DIRECTORY, bounding_box_dict, args.models or LICENSE_MODELS,
+                                            client=client)
+            print(f"Requests: {client.stats['requests']} | Cached: {client.stats['cached']} | "
+                  f"Retries: {client.stats['retries']}")
+        for evaluation in performance:
+            print(f"Model Name: {evaluation[0]} | Link: {evaluation[4]}")
+            print(f"IoU performance: {evaluation[1]}")
+            print(f"Detected {evaluation[2]}/{len(bounding_box_dict)}")
+            print(f"Time: {evaluation[3]}")
+    else:
+        performance = evaluate_ocr(OCR_CROPPED_DIRECTORY, license_plate_numbers_dict, args.models or OCR_MODELS,
+                                   args.workers)
+        for evaluation in performance:
+            print(f"Model Name: {evaluation[0]} | Link: {evaluation[1]}")
+            print(f"Accuracy: {evaluation[2]}")
+            print(f"Fully Detected {evaluation[3]}/{len(license_plate_numbers_dict)}")
+            print(f"Time: {evaluation[4]} (model: {evaluation[5]})")
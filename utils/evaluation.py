@@ -1,23 +1,18 @@
 """
 Script for evaluating license plate detection and OCR text recognition models.
+
+Heavy dependencies (Roboflow, DagsHub/MLflow, transformers, matplotlib) and the
+remote initializations are deferred until the evaluation that needs them runs,
+so importing this module for its helpers stays cheap.
 """
 
 import os
-from dotenv import load_dotenv
-from roboflow import Roboflow
 import time
-import dagshub
-import mlflow
 import re
-from ultralytics import YOLO
-import matplotlib.patches as patches
 import cv2
-import matplotlib.pyplot as plt
-from transformers import pipeline
-
-dagshub.init(repo_owner='Omdena', repo_name='RomaniaChapter_IllegalDeforestation', mlflow=True)
-
-load_dotenv()
+from boxes import centered_boxes, most_confident, plate_iou
+from label_index import LabelIndex
+from detector_backends import load_detector
 
 # List of models and corresponding links
 LICENSE_MODELS = [
@@ -38,29 +33,60 @@ LICENSE_LINKS = [
     'https://universe.roboflow.com/wood-guard/license_plate_dataset/model/1'
 ]
 
+# OCR backend specs of `ocr_backends.load_ocr`: bare names are TrOCR models,
+# a CTC recognizer is selected with 'ctc:<path to the .onnx model>'
 OCR_MODELS = [
     'microsoft/trocr-base-printed',
     'microsoft/trocr-large-printed',
     'microsoft/trocr-small-printed'
 ]
 
+# Small model first, the larger ones only for the crops it is unsure about
+OCR_CASCADE = 'cascade:' + ','.join([OCR_MODELS[2], OCR_MODELS[0], OCR_MODELS[1]])
+
 OCR_LINKS = [
     'https://huggingface.co/microsoft/trocr-base-printed',
     'https://huggingface.co/microsoft/trocr-large-printed',
     'https://huggingface.co/microsoft/trocr-small-printed'
 ]
 
-# Roboflow initialization
-roboflow_api_key = os.getenv("ROBOFLOW_API_KEY")
-rf = Roboflow(api_key=roboflow_api_key)  # Add Roboflow API key
+_roboflow = None
+
+
+def get_roboflow():
+    """
+    Roboflow client, created on first use from the ROBOFLOW_API_KEY environment variable (or .env file).
+    """
+    global _roboflow
+    if _roboflow is None:
+        from dotenv import load_dotenv
+        from roboflow import Roboflow
+
+        load_dotenv()
+        roboflow_api_key = os.getenv("ROBOFLOW_API_KEY")
+        _roboflow = Roboflow(api_key=roboflow_api_key)  # Add Roboflow API key
+    return _roboflow
+
+
+def init_tracking():
+    """
+    Connect MLflow to the DagsHub repository and return the mlflow module.
+    """
+    import dagshub
+    import mlflow
+
+    dagshub.init(repo_owner='Omdena', repo_name='RomaniaChapter_IllegalDeforestation', mlflow=True)
+    return mlflow
 
-def load_model(model_path):
-    model=YOLO(model_path)
+
+def load_model(model_path, backend='auto'):
+    model=load_detector(model_path, backend=backend)
     return model
 # Directories
 IMG_DIRECTORY = r'RomaniaChapter_IllegalDeforestation\backend\src\evaluation\License Plate Evaluation System Data\test\images'
 LABELS_DIRECTORY = r'RomaniaChapter_IllegalDeforestation\backend\src\evaluation\License Plate Evaluation System Data\test\labels'
 OCR_CROPPED_DIRECTORY = r'RomaniaChapter_IllegalDeforestation\backend\src\evaluation\License Plate Evaluation System Data\cropped_ocr'
+CUSTOM_MODEL_PATH = r"RomaniaChapter_IllegalDeforestation\backend\src\license_plate_detection\final_model\best_float32.tflite"
 
 
 def clean_license_plate(license_plate):
@@ -107,60 +133,31 @@ def process_ground_truth_labels(labels_directory):
     """
     Process ground truth labels for all files in the given directory.
 
+    The labels are read through the label index, so only files changed since the
+    previous run are parsed again.
+
     Parameters:
         labels_directory (str): Path to the directory containing label files.
 
     Returns:
-        tuple: Tuple containing dictionaries of bounding box coordinates and license plate numbers.
+        tuple: Tuple containing dictionaries of bounding box coordinates, keyed by file name
+        without extension, and license plate numbers, keyed by label file name.
     """
     bounding_boxes_dict = {}
     license_number_dict = {}
-    i = 0
-    for filename in os.listdir(labels_directory):
-        if filename.endswith('.txt'):
-            label_file_path = os.path.join(labels_directory, filename)
-            image_filename, _ = os.path.splitext(filename)
-
-            # Read label file and extract bounding box coordinates
-            bounding_boxes, license_plate_number = read_label_file(label_file_path)
-            # Store bounding boxes in the dictionary
-            bounding_boxes_dict[i] = bounding_boxes
-            license_number_dict[filename] = clean_license_plate(license_plate_number.strip())
-            i += 1
+    index = LabelIndex.build(labels_directory)
+    for name in index.names:
+        # Same as read_label_file: the first box of the file, in pixels of the 640x640 image
+        bounding_boxes_dict[name] = [tuple(int(value) for value in box) for box in index.boxes_xywh(name)[:1]]
+        license_number_dict[f'{name}.txt'] = clean_license_plate(index.text(name))
 
     return bounding_boxes_dict, license_number_dict
 
 
-def calculate_iou(box1, box2):
-    """
-    Calculate IoU between two bounding boxes.
-
-    Parameters:
-        box1 (tuple): (x1, y1, x2, y2) coordinates of the first bounding box.
-        box2 (tuple): (x1, y1, x2, y2) coordinates of the second bounding box.
-
-    Returns:
-        float: Intersection over Union (IoU) score.
-    """
-    x1, y1, w1, h1 = box1
-    x2, y2, w2, h2 = box2
-
-    # Calculate intersection coordinates
-    x_intersection = max(x1, x2)
-    y_intersection = max(y1, y2)
-    w_intersection = max(0, min(x1 + w1, x2 + w2) - x_intersection)
-    h_intersection = max(0, min(y1 + h1, y2 + h2) - y_intersection)
-
-    # Calculate area of intersection and union
-    area_intersection = w_intersection * h_intersection
-    area_union = w1 * h1 + w2 * h2 - area_intersection
-
-    # Calculate IoU
-    iou = area_intersection / (area_union + 1e-6)  # Adding a small epsilon to avoid division by zero
-
-    return iou
-
 def visualize_bounding_boxes(image, bbox1, bbox2):
+    import matplotlib.patches as patches
+    import matplotlib.pyplot as plt
+
     fig, ax = plt.subplots(1)
     ax.imshow(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
 
@@ -179,51 +176,54 @@ def visualize_bounding_boxes(image, bbox1, bbox2):
 
     plt.show()
 
-def license_plate_bbox_evaluation(directory, ground_truth_data, models, mode):
+def license_plate_bbox_evaluation(directory, ground_truth_data, models, mode, visualize=False):
     """
     Evaluate license plate detection performance for multiple models.
 
     Parameters:
         directory (str): Path to the directory containing test images.
-        ground_truth_data (dict): Dictionary with ground truth bounding box coordinates.
-        models (list): List of Roboflow model names.
+        ground_truth_data (dict): Dictionary with ground truth bounding box coordinates, keyed by
+            file name without extension.
+        models (list): Roboflow model names, or paths of local models in Custom mode.
+        mode (str): 'Roboflow' for the hosted models or 'Custom' for the local model.
+        visualize (bool): Show the predicted and ground truth boxes of every image (Custom mode only).
+            Blocks on every image, keep it off when timing the model.
 
     Returns:
         list: List of tuples containing model evaluation results.
     """
     if mode=='Roboflow':
-        stop = len(models)
-        k = 0
+        # Concurrent, rate-limited and cached, see `eval_harness.RoboflowClient`
+        from eval_harness import evaluate_roboflow
+
+        return evaluate_roboflow(directory, ground_truth_data, models)
+    if mode =='Custom':
+        # `models` lists the local models (e.g. the float32 and int8 variants), the
+        # production model when it is not a list of paths
+        model_paths = models if isinstance(models, (list, tuple)) else [CUSTOM_MODEL_PATH]
         performance = []
-        while k < stop:
-            i = 0
+        for model_path in model_paths:
             iou_list = []
-            project = rf.workspace().project(models[k])
-            model = project.version(1).model
-
+            latencies = []
             start_time = time.time()
+            model = load_model(model_path)
 
             for filename in os.listdir(directory):
                 if filename.endswith('.jpg'):
                     img_path = os.path.join(directory, filename)
+                    image=cv2.imread(img_path)
+                    predict_start = time.perf_counter()
+                    detections = model.predict(image,conf=0.4,iou=0.45)[0]
+                    latencies.append(time.perf_counter() - predict_start)
 
-                    # Perform prediction
-                    json = model.predict(img_path, confidence=50, overlap=50).json()
-
-                    # Check if predictions are present
-                    if len(json['predictions']) > 0:
-                        # Extract bounding box coordinates
-                        x = int(json['predictions'][0]['x'])
-                        y = int(json['predictions'][0]['y'])
-                        width = int(json['predictions'][0]['width'])
-                        height = int(json['predictions'][0]['height'])
+                    boxes = centered_boxes(detections)
+                    ground_truth = ground_truth_data[os.path.splitext(filename)[0]]
 
-                    bbox1 = (x, y, width, height)
-                    bbox2 = ground_truth_data[i][0]
+                    if visualize:
+                        visualize_bounding_boxes(image, most_confident(boxes) or (0, 0, 0, 0),
+                                                 ground_truth[0] if ground_truth else (0, 0, 0, 0))
 
-                    i += 1
-
-                    iou = calculate_iou(bbox1, bbox2)
+                    iou = plate_iou(boxes, ground_truth)
 
                     iou_list.append(iou)
 
@@ -233,65 +233,15 @@ def license_plate_bbox_evaluation(directory, ground_truth_data, models, mode):
             mean_iou = sum(iou_list) / len(iou_list)
             zero_indices = [index + 1 for index, value in enumerate(iou_list) if value == 0]
             nr_detected = len(iou_list) - len(zero_indices)
+            # Per-image latency of the model alone, without loading and decoding
+            latency_ms = 1000 * sum(latencies) / len(latencies)
+            size_mb = os.path.getsize(model_path) / 2 ** 20
 
-            model_evaluation = (models[k], mean_iou, nr_detected, total_time, LICENSE_LINKS[k])
+            model_evaluation = (os.path.basename(model_path), mean_iou, nr_detected, total_time, latency_ms, size_mb)
 
             performance.append(model_evaluation)
-            k += 1
 
         return performance
-    if mode =='Custom':
-
-        performance = []
-        iou_list = []
-        start_time = time.time()
-        model_path = r"RomaniaChapter_IllegalDeforestation\backend\src\license_plate_detection\final_model\best_float32.tflite"
-        model = load_model(model_path)
-
-        for filename in os.listdir(directory):
-            if filename.endswith('.jpg'):
-                img_path = os.path.join(directory, filename)
-                image=cv2.imread(img_path)
-                results = model.predict(image,imgsz=640,conf=0.4,iou=0.45)
-                results = results[0]  
-
-                for i in range(len(results.boxes)):
-                    box = results.boxes[i]
-                    tensor = box.xyxy[0]
-                    x1 = int(tensor[0].item())
-                    y1 = int(tensor[1].item())
-                    x2 = int(tensor[2].item())
-                    y2 = int(tensor[3].item())
-                    width=x2-x1
-                    height=y2-y1
-                    x=x1+width//2
-                    y=y1+height//2
-
-                bbox1 = (x, y, width, height)
-                bbox2 = ground_truth_data[i][0]
-
-                visualize_bounding_boxes(image , bbox1 , bbox2)
-
-                i += 1
-
-                iou = calculate_iou(bbox1, bbox2)
-
-                iou_list.append(iou)
-
-        end_time = time.time()
-
-        total_time = end_time - start_time
-        mean_iou = sum(iou_list) / len(iou_list)
-        zero_indices = [index + 1 for index, value in enumerate(iou_list) if value == 0]
-        nr_detected = len(iou_list) - len(zero_indices)
-
-        model_evaluation = ("License Plate Custom", mean_iou, nr_detected, total_time)
-
-        performance.append(model_evaluation)
-       
-
-        return performance
-
 
 
 def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
@@ -301,11 +251,14 @@ def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
     Parameters:
         evaluation_directory (str): Path to the directory containing OCR evaluation images.
         ground_truth_dict (dict): Dictionary with ground truth license plate numbers.
-        models (list): List of OCR model names.
+        models (list): List of OCR backend specs (see `ocr_backends.load_ocr`).
 
     Returns:
-        list: List of tuples containing OCR model evaluation results.
+        list: List of tuples containing OCR model evaluation results. The last item is the
+            `stats` of a cascade (escalation rate, reads and time per tier), empty otherwise.
     """
+    from ocr_backends import load_ocr
+
     k = 0
     stop = len(models)
     performance = []
@@ -314,7 +267,7 @@ def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
         correct_predictions = 0
         total_predictions = 0
         full_correct = 0
-        ocr_pipeline = pipeline("image-to-text", model=models[k])
+        ocr_backend = load_ocr(models[k])
 
         start_time = time.time()
 
@@ -325,7 +278,7 @@ def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
                 # Modify the path to point to the ground truth label
                 gt_filename = f"{filename.split('.')[0].zfill(3)}.txt"  # Adjust if needed
 
-                prediction = ocr_pipeline(image_path)[0]['generated_text']
+                prediction = ocr_backend.read([image_path])[0]
 
                 cleaned_prediction = clean_license_plate(prediction)
 
@@ -345,7 +298,9 @@ def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
         total_time = end_time - start_time
         accuracy = correct_predictions / total_predictions if total_predictions > 0 else 0
 
-        current_performance = [models[k], OCR_LINKS[k], accuracy, full_correct, total_time]
+        link = OCR_LINKS[OCR_MODELS.index(models[k])] if models[k] in OCR_MODELS else ''
+        current_performance = [models[k], link, accuracy, full_correct, total_time,
+                               getattr(ocr_backend, 'stats', {})]
 
         performance.append(current_performance)
 
@@ -355,6 +310,8 @@ def ocr_evaluation(evaluation_directory, ground_truth_dict, models):
 
 
 def run(evaluation_type):
+    mlflow = init_tracking()
+
     if evaluation_type == 'license_plate':
         bounding_box_dict, _ = process_ground_truth_labels(LABELS_DIRECTORY)
         performance = license_plate_bbox_evaluation(IMG_DIRECTORY, bounding_box_dict, "A" ,"Custom")
@@ -364,22 +321,31 @@ def run(evaluation_type):
             print(f"IoU performance: {evaluation[1]}")
             print(f"Detected {evaluation[2]}\{len(bounding_box_dict)}")
             print(f"Time: {evaluation[3]}")
+            print(f"Latency per image (ms): {evaluation[4]:.1f} | Model size (MB): {evaluation[5]:.1f}")
 
             with mlflow.start_run():
                 mlflow.log_param('Project Name', evaluation[0])
                 mlflow.log_metric('IoU performance', evaluation[1])
                 mlflow.log_metric('Number of Detected', evaluation[2])
                 mlflow.log_metric('Time', evaluation[3])
+                mlflow.log_metric('Latency per image (ms)', evaluation[4])
+                mlflow.log_metric('Model size (MB)', evaluation[5])
 
     if evaluation_type == 'ocr':
         _, license_plate_numbers_dict = process_ground_truth_labels(LABELS_DIRECTORY)
-        performance = ocr_evaluation(OCR_CROPPED_DIRECTORY, license_plate_numbers_dict, OCR_MODELS)
+        performance = ocr_evaluation(OCR_CROPPED_DIRECTORY, license_plate_numbers_dict, OCR_MODELS + [OCR_CASCADE])
 
         for evaluation in performance:
             print(f"Model Name: {evaluation[0]} | Link: {evaluation[1]}")
             print(f"Accuracy: {evaluation[2]}")
             print(f"Fully Detected {evaluation[3]}\{len(license_plate_numbers_dict)}")
             print(f"Time: {evaluation[4]}")
+            cascade_stats = evaluation[5]
+            if cascade_stats:
+                print(f"Escalation rate: {cascade_stats['escalation_rate']:.1%}")
+                for tier, model in enumerate(evaluation[0].partition(':')[2].split(',')):
+                    print(f"  {model}: {cascade_stats[f'reads_{tier}']} reads, "
+                          f"{cascade_stats[f'time_{tier}']:.2f} s")
 
             with mlflow.start_run():
                 mlflow.log_param('Project Name', evaluation[0])
@@ -387,6 +353,8 @@ def run(evaluation_type):
                 mlflow.log_metric('Accuracy', evaluation[2])
                 mlflow.log_metric('Number of Fully-Detected', evaluation[3])
                 mlflow.log_metric('Time', evaluation[4])
+                for key, value in evaluation[5].items():
+                    mlflow.log_metric(f'Cascade {key}', value)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,175 @@
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+
 import cv2
 import numpy as np
 
+from detector_backends import letterbox as letterbox_square
+
+
+def standardize_normalize(image, **kwargs):
+    """
+    Scale the pixels of an image to [0, 1] in float32.
+
+    Standardizing with the mean and std before the min-max scaling does not change the
+    result (both are affine), so only the min and max are computed, on the uint8 data.
+
+    Parameters:
+    - image (np.ndarray): Image to normalize, it is not modified.
+
+    Returns:
+    np.ndarray: float32 image with values in [0, 1].
+    """
+    low, high = float(image.min()), float(image.max())
+    normalized = np.subtract(image, low, dtype=np.float32)
+    normalized *= 1.0 / (high - low) if high > low else 0.0
+    return normalized
+
+
+def resize(image, target_size=(416, 416), **kwargs):
+    """
+    Resize an image to target_size=(width, height), ignoring its aspect ratio.
+    """
+    return cv2.resize(image, tuple(target_size))
+
+
+def letterbox(image, target_size=(640, 640), **kwargs):
+    """
+    Resize an image into a square of target_size keeping its aspect ratio, padding the rest
+    the way the detector input is prepared.
+    """
+    size = target_size[0] if isinstance(target_size, (tuple, list)) else target_size
+    if image.dtype != np.uint8:
+        image = _to_uint8(image)
+    return letterbox_square(image, size)[0]
+
+
+def clahe(image, clip_limit=2.0, tile_grid_size=(8, 8), **kwargs):
+    """
+    Contrast Limited Adaptive Histogram Equalization on the lightness channel.
+    """
+    if image.dtype != np.uint8:
+        image = _to_uint8(image)
+    equalizer = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tuple(tile_grid_size))
+    if image.ndim == 2:
+        return equalizer.apply(image)
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    lab[..., 0] = equalizer.apply(lab[..., 0])
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR, dst=lab)
+
+
+def _to_uint8(image):
+    # float images are in [0, 1]
+    if image.dtype == np.uint8:
+        return image
+    scaled = np.multiply(image, 255, dtype=np.float32)
+    return np.clip(scaled, 0, 255, out=scaled).astype(np.uint8)
+
+
+STEPS = {
+    'standardize_normalize': standardize_normalize,
+    'normalize': standardize_normalize,
+    'resize': resize,
+    'letterbox': letterbox,
+    'clahe': clahe,
+}
+
+
+def preprocess_image(image, steps_to_apply=('standardize_normalize', 'resize'), **kwargs):
+    """
+    Apply a chain of preprocessing steps to a decoded image, without any display.
+
+    Parameters:
+    - image (np.ndarray): BGR image.
+    - steps_to_apply (tuple): Names of the steps in STEPS, applied in order.
+    - **kwargs: Options of the steps, e.g. target_size, clip_limit, tile_grid_size.
+
+    Returns:
+    np.ndarray: Processed image, float32 in [0, 1] after 'standardize_normalize', uint8 otherwise.
+    """
+    for step in steps_to_apply:
+        image = STEPS[step](image, **kwargs)
+    return image
+
+
+def _process_file(task):
+    # Worker: decode, process and either encode to the output folder or return the array
+    image_path, output_folder, steps_to_apply, kwargs = task
+    image = cv2.imread(image_path)
+    if image is None:
+        return image_path, None
+    processed = preprocess_image(image, steps_to_apply, **kwargs)
+    if output_folder is None:
+        return image_path, processed
+    output_path = os.path.join(output_folder, os.path.basename(image_path))
+    cv2.imwrite(output_path, _to_uint8(processed))
+    return image_path, output_path
+
+
+def preprocess_directory(input_folder, output_folder=None, steps_to_apply=('standardize_normalize', 'resize'),
+                         workers=None, extensions=('.jpg', '.jpeg', '.png'), **kwargs):
+    """
+    Stream every image of a folder through the preprocessing steps on a process pool.
+
+    Decoding, processing and encoding all happen in the workers. At most two tasks per
+    worker are in flight, so memory stays bounded however large the folder is.
+
+    Parameters:
+    - input_folder (str): Folder with the input images.
+    - output_folder (str): Folder the processed images are written to. With None nothing is
+      written and the processed arrays are yielded instead, e.g. to feed `Inference.predict_batch`
+      (leave out 'standardize_normalize' then, the detector expects uint8 BGR frames).
+    - steps_to_apply (tuple): Names of the steps in STEPS, applied in order.
+    - workers (int): Number of worker processes, all CPUs by default.
+    - extensions (tuple): File extensions of the images.
+    - **kwargs: Options of the steps, e.g. target_size.
+
+    Returns:
+    generator: (image path, output path or processed array) in file name order. Images that
+    cannot be decoded yield None.
+    """
+    if output_folder is not None:
+        os.makedirs(output_folder, exist_ok=True)
+    paths = [os.path.join(input_folder, filename) for filename in sorted(os.listdir(input_folder))
+             if filename.lower().endswith(extensions)]
+    workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for image_path in paths:
+            pending.append(executor.submit(_process_file, (image_path, output_folder, tuple(steps_to_apply), kwargs)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(input_folder, output_folder=None, steps_to_apply=('standardize_normalize', 'resize'), workers=None,
+              **kwargs):
+    """
+    Preprocess a whole folder and report the throughput.
+
+    Returns:
+    dict: Number of images, number of failures, elapsed seconds and images per second.
+    """
+    start_time = time.time()
+    count = 0
+    failed = 0
+    for _, result in preprocess_directory(input_folder, output_folder, steps_to_apply, workers, **kwargs):
+        count += 1
+        failed += result is None
+    elapsed = time.time() - start_time
+    stats = {'images': count, 'failed': failed, 'seconds': elapsed,
+             'images_per_second': count / elapsed if elapsed > 0 else 0.0}
+    print(f"Preprocessed {count} images ({failed} failed) in {elapsed:.2f}s: "
+          f"{stats['images_per_second']:.1f} images/s")
+    return stats
+
 
-def preprocess_and_visualize(image_path, output_folder, steps_to_apply=('standardize_normalize', 'resize'), **kwargs):
+def preprocess_and_visualize(image_path, output_folder, steps_to_apply=('standardize_normalize', 'resize'),
+                             visualize=True, **kwargs):
     """
     This function preprocesses an image with specified steps and visualizes the original and processed images.
 
@@ -11,6 +177,7 @@ def preprocess_and_visualize(image_path, output_folder, steps_to_apply=('standar
     - image_path (str): Path to the input image.
     - output_folder (str): Path to the folder where preprocessed images will be saved.
     - steps_to_apply (tuple): Tuple of strings specifying which steps to apply. Default is ('standardize_normalize', 'resize').
+    - visualize (bool): Show the original and processed images. Use `preprocess_directory` for batches.
     - **kwargs: Additional keyword arguments. For example, target_size=(height, width) for resizing the image.
 
     Returns:
@@ -42,13 +209,14 @@ def preprocess_and_visualize(image_path, output_folder, steps_to_apply=('standar
 
         # Add more processing steps if needed
 
-    # Display original image
-    cv2.imshow('Original Image', original_image)
-    cv2.waitKey(500)  # Adjust the delay time (in milliseconds) as needed
+    if visualize:
+        # Display original image
+        cv2.imshow('Original Image', original_image)
+        cv2.waitKey(500)  # Adjust the delay time (in milliseconds) as needed
 
-    # Display processed image
-    cv2.imshow('Processed Image', processed_image)
-    cv2.waitKey(500)
+        # Display processed image
+        cv2.imshow('Processed Image', processed_image)
+        cv2.waitKey(500)
 
     # Convert processed image data type to uint8 before saving
     processed_image_uint8 = (processed_image * 255).astype(np.uint8)
@@ -57,10 +225,14 @@ def preprocess_and_visualize(image_path, output_folder, steps_to_apply=('standar
     output_path = os.path.join(output_folder, os.path.basename(image_path))
     cv2.imwrite(output_path, processed_image_uint8)
     print(f'Preprocessed image saved to output folder.')
-    cv2.destroyAllWindows()
+    if visualize:
+        cv2.destroyAllWindows()
 
-image_path = "/path_to_image/image.jpg"
-output_folder_path = "/output_folder_path"
-# Example usage:
-preprocess_and_visualize(image_path, output_folder_path, target_size=(224, 224))
+if __name__ == '__main__':
+    image_path = "/path_to_image/image.jpg"
+    output_folder_path = "/output_folder_path"
+    # Example usage:
+    preprocess_and_visualize(image_path, output_folder_path, target_size=(224, 224))
+    # Batch usage:
+    # run_batch("/path_to_images", output_folder_path, steps_to_apply=('clahe', 'letterbox'), target_size=(640, 640))
 
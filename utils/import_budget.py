@@ -0,0 +1,92 @@
+"""
+Import-time budget check for the utils modules.
+
+Every module is imported in a fresh interpreter with `-X importtime`, so the
+numbers match a cold container start. Exits with status 1 when a module
+exceeds the budget and lists the slowest imports it pulled in.
+"""
+
+import os
+import subprocess
+import sys
+
+UTILS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+
+def discover_modules(directory=UTILS_DIRECTORY):
+    """
+    Every module of the utils directory, so new modules are measured without being listed.
+    This script and the tests are left out.
+    """
+    return sorted(filename[:-len('.py')] for filename in os.listdir(directory)
+                  if filename.endswith('.py') and filename not in ('import_budget.py', 'conftest.py')
+                  and not filename.startswith('test_'))
+
+
+MODULES = discover_modules()
+
+# Seconds a module may take to import
+BUDGET = 0.5
+
+
+def measure_import(module, python=sys.executable):
+    """
+    Import `module` in a fresh interpreter.
+
+    Parameters:
+        module (str): Name of the module, importable from the utils directory.
+        python (str): Interpreter to use.
+
+    Returns:
+        tuple: Cumulative import time of the module in seconds and the (seconds, name)
+        of every import it triggered, slowest first. The time is None if the import failed.
+    """
+    completed = subprocess.run([python, '-X', 'importtime', '-c', f'import {module}'],
+                               cwd=UTILS_DIRECTORY, capture_output=True, text=True)
+    imports = []
+    total = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        seconds = int(cumulative) / 1e6
+        imports.append((seconds, name.strip()))
+        if name.strip() == module:
+            total = seconds
+    if completed.returncode != 0:
+        total = None
+    return total, sorted(imports, reverse=True)
+
+
+def check(modules=MODULES, budget=BUDGET, top=5):
+    """
+    Measure every module against the budget and print a report.
+
+    Returns:
+        bool: True when every module imported within the budget.
+    """
+    ok = True
+    for module in modules:
+        total, imports = measure_import(module)
+        if total is None:
+            print(f'{module:<22} FAILED (missing dependency?)')
+            ok = False
+            continue
+        status = 'ok' if total <= budget else 'OVER BUDGET'
+        print(f'{module:<22} {total * 1000:8.1f} ms  {status}')
+        if total > budget:
+            ok = False
+            for seconds, name in [item for item in imports if item[1] != module][:top]:
+                print(f'    {seconds * 1000:8.1f} ms  {name}')
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Check the import time of the utils modules.')
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--budget', type=float, default=BUDGET, help='Budget per module in seconds')
+    args = parser.parse_args()
+
+    sys.exit(0 if check(args.modules, args.budget) else 1)
@@ -1,122 +1,317 @@
 import os
-import re
-from ultralytics import YOLO
 import cv2
-from roboflow import Roboflow
-from transformers import pipeline
-from dotenv import load_dotenv
-from PIL import Image
-from datetime import datetime
-import requests
-from bs4 import BeautifulSoup
-
-def load_model(model_path):
-    model=YOLO(model_path)
+import numpy as np
+from sumal_client import SumalClient
+from detector_backends import load_detector
+from ocr_backends import load_ocr
+from instrumentation import NULL_METRICS, BATCH_BUCKETS
+
+def load_model(model_path, backend='auto', variant=None):
+    model=load_detector(model_path, backend=backend, variant=variant)
     return model
 
-def get_date(val):
-  timestamp = val / 1000  + 7200 # converting milliseconds to seconds
-  date = datetime.utcfromtimestamp(timestamp)
-  return date.strftime('%d/%m/%Y %H:%M:%S')
+def load_image(image):
+    """
+    Decode an image once so it can be shared between detection and cropping
+    Args:
+        image: Path to the image, encoded image bytes (JPEG, PNG...) or an already decoded BGR array
+
+    Returns: BGR image array
+
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        decoded = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if decoded is None:
+            raise ValueError('The bytes are not a decodable image')
+        return decoded
+    decoded = cv2.imread(image)
+    if decoded is None:
+        raise FileNotFoundError(f'Could not read the image {image}')
+    return decoded
+
+def extract_boxes(detections):
+    """
+    Convert the detections of a frame into the (x, y, width, height) boxes of every detected license plate
+    Args:
+        detections: N x 6 (x1, y1, x2, y2, confidence, class) array returned by the detector backend
+
+    Returns: List with the center coordinates, width and height of each box
+
+    """
+    boxes = []
+    for x1, y1, x2, y2 in detections[:, :4].astype(int).tolist():
+        width=x2-x1
+        height=y2-y1
+        boxes.append((x1+width//2, y1+height//2, width, height))
+
+    return boxes
+
+def best_detection(detections):
+    """
+    Pick the most confident license plate of a frame
+    Args:
+        detections: N x 6 array returned by the detector backend
+
+    Returns: (x, y, width, height) box and confidence of the detection, (None, 0.0) when nothing was detected
+
+    """
+    if not len(detections):
+        return None, 0.0
+    best = detections[int(detections[:, 4].argmax())]
+    return extract_boxes(best[None])[0], float(best[4])
+
+def extract_box(detections):
+    """
+    Convert the detections of a frame into the (x, y, width, height) box of the license plate
+    Args:
+        detections: N x 6 array returned by the detector backend
+
+    Returns: Center coordinates, width and height of the most confident box, or None when nothing was detected
+
+    """
+    return best_detection(detections)[0]
+
+def crop_plate(image, box):
+    """
+    Crop the license plate out of a decoded BGR image without copying any pixel
+    Args:
+        image: BGR image array
+        box: (x, y, width, height) of the license plate
+
+    Returns: RGB view of the license plate, sharing the memory of `image`
+
+    """
+    x, y, width, height = box
+    left = max(int(x - (width / 2)), 0)
+    right = int(x + (width / 2))
+    top = max(int(y - (height / 2)), 0)
+    bottom = int(y + (height / 2))
+
+    # Reversing the channel axis is a view too, the OCR backends only copy when resizing
+    return image[top:bottom, left:right, ::-1]
 
 
 class Inference:
-    def __init__(self, rf_bb_model: str, ocr_model: str):
-        
-        self.BB_MODEL = load_model(rf_bb_model)
-        self.ocr_pipeline = pipeline("image-to-text", model=ocr_model)
+    def __init__(self, rf_bb_model: str, ocr_model: str, sumal_client: SumalClient = None,
+                 backend: str = 'auto', ocr_cache_size: int = 0, metrics=None, quality_gate=None,
+                 plate_index=None, model_variant: str = None):
+        """
+        Args:
+            rf_bb_model: Path to the license plate detection model
+            ocr_model: OCR backend spec, a TrOCR model name, 'ctc:<path to the .onnx model>' or
+                'cascade:<tier specs>' (small to large TrOCR with 'cascade:')
+            sumal_client: Client used for the SUMAL lookups
+            backend: Detector backend
+            ocr_cache_size: Number of recent plate crops remembered, so identical crops seen again
+                within a few seconds skip OCR. 0 (the default) disables the cache
+            metrics: `instrumentation.Metrics` receiving the per-stage timings, batch sizes,
+                cache hits and HTTP retries. Nothing is recorded when omitted
+            quality_gate: `plate_quality.PlateQualityGate` dropping blurred, tiny, flat or
+                low-confidence crops before OCR. Every crop is read when omitted
+            plate_index: `plate_index.PlateIndex` of known plates, OCR reads are resolved to
+                their canonical plate before the SUMAL lookup and looked-up plates are added
+            model_variant: Precision of the detection model to run ('int8', 'dynamic'...),
+                see `detector_backends.MODEL_VARIANTS`. `rf_bb_model` itself when omitted
+
+        """
+        self.BB_MODEL = load_model(rf_bb_model, backend=backend, variant=model_variant)
+        # transformers (and torch) are only imported once a TrOCR backend is loaded
+        self.ocr = load_ocr(ocr_model, cache_size=ocr_cache_size)
+        self.sumal_client = sumal_client or SumalClient(metrics=metrics)
+        self.metrics = metrics or NULL_METRICS
+        self.quality_gate = quality_gate
+        self.plate_index = plate_index
+        if metrics is not None:
+            if self.sumal_client.metrics is NULL_METRICS:
+                self.sumal_client.metrics = metrics
+            metrics.gauge('sumal_cache', lambda: self.sumal_client.cache.stats)
+            if hasattr(self.ocr, 'cache'):
+                metrics.gauge('ocr_cache', lambda: self.ocr.cache.stats)
+            cascade = getattr(self.ocr, 'backend', self.ocr)
+            if hasattr(cascade, 'tiers'):
+                metrics.gauge('ocr_cascade', lambda: cascade.stats)
 
 
-    def bounding_box_prediction(self, image_path: str):
+    def bounding_box_prediction(self, image):
         """
         Predict the bounding box coords of a license plate for the given input image
         Args:
-            img_path: Path to the image
+            image: Path to the image, encoded image bytes or decoded BGR array
 
         Returns: Coordinates of the bounding box of the license plate
 
         """
 
-        image=cv2.imread(image_path)
-        results =self.BB_MODEL.predict(image,imgsz=640,conf=0.4,iou=0.45)
-        results = results[0]  
+        with self.metrics.stage('decode'):
+            image=load_image(image)
 
-        for i in range(len(results.boxes)):
-            box = results.boxes[i]
-            tensor = box.xyxy[0]
-            x1 = int(tensor[0].item())
-            y1 = int(tensor[1].item())
-            x2 = int(tensor[2].item())
-            y2 = int(tensor[3].item())
-            width=x2-x1
-            height=y2-y1
-            x=x1+width//2
-            y=y1+height//2
+        return self._detect_box(image)[0]
 
-        return x, y, width, height
+    def _detect_box(self, image):
+        with self.metrics.stage('detect'):
+            detections =self.BB_MODEL.predict(image,conf=0.4,iou=0.45)
+
+        return best_detection(detections[0])
+
+    def gate_crops(self, crops, confidences):
+        """
+        Selects the plate crops worth sending to OCR with the quality gate
+        Args:
+            crops: Plate crops, as RGB arrays
+            confidences: Detection confidence of every crop
+
+        Returns: Indices of the kept crops, all of them without a quality gate
+
+        """
+        if self.quality_gate is None:
+            return range(len(crops))
+        with self.metrics.stage('quality'):
+            keep, _ = self.quality_gate.evaluate(crops, confidences)
+        self.metrics.increment('quality_rejected_total', int(len(keep) - keep.sum()))
+        return keep.nonzero()[0].tolist()
 
     def ocr_prediction(self, image):
         """
         Predicts text on the license plate
         Args:
-            image: License plate image
+            image: License plate crop, as an RGB array (view), PIL image or path
 
         Returns: Text of the license plate
 
         """
-        prediction = self.ocr_pipeline(image)[0]['generated_text']
-        license_plate = re.sub(r'[^a-zA-Z0-9]', '', prediction).upper()
+        with self.metrics.stage('ocr'):
+            license_plate = self.ocr.read([image])[0]
 
         return license_plate
 
+    def predict_batch(self, images, batch_size: int = 8):
+        """
+        Predicts the license plate text for many images at once. Each image is decoded a
+        single time, YOLO runs on batches of `batch_size` frames and every plate crop is
+        sent to the OCR backend in one batched call.
+        Args:
+            images: Image paths, encoded image bytes or decoded BGR arrays
+            batch_size: Number of frames per detector (and OCR) batch
+
+        Returns: License plate texts in input order, None for images without a detected (or readable) plate
+
+        """
+        images = list(images)
+        plates = [None] * len(images)
+        crops = []
+        owners = []
+        confidences = []
+
+        metrics = self.metrics
+        for start in range(0, len(images), batch_size):
+            with metrics.stage('decode'):
+                chunk = [load_image(image) for image in images[start:start + batch_size]]
+            metrics.observe('detector_batch_size', len(chunk), buckets=BATCH_BUCKETS)
+            with metrics.stage('detect'):
+                detections = self.BB_MODEL.predict(chunk, conf=0.4, iou=0.45)
+
+            with metrics.stage('crop'):
+                for offset, (image, frame_detections) in enumerate(zip(chunk, detections)):
+                    box, confidence = best_detection(frame_detections)
+                    if box is None:
+                        continue
+                    # A view would keep the whole decoded frame alive until the OCR call,
+                    # the small copy keeps memory bounded by `batch_size` frames
+                    crops.append(np.ascontiguousarray(crop_plate(image, box)))
+                    owners.append(start + offset)
+                    confidences.append(confidence)
+
+        kept = self.gate_crops(crops, confidences)
+        crops = [crops[index] for index in kept]
+        owners = [owners[index] for index in kept]
+        if crops:
+            metrics.observe('ocr_batch_size', len(crops), buckets=BATCH_BUCKETS)
+            with metrics.stage('ocr'):
+                license_plates = self.ocr.read(crops)
+            for index, license_plate in zip(owners, license_plates):
+                plates[index] = license_plate
+
+        return plates
+
+    def resolve_plate(self, license_plate_number):
+        """
+        Resolve an OCR read to its canonical plate with the plate index, when there is one
+        Args:
+            license_plate_number: Text of the license plate
+
+        Returns: Canonical text of the license plate
+
+        """
+        if self.plate_index is None or not license_plate_number:
+            return license_plate_number
+        return self.plate_index.resolve(license_plate_number)
+
+    def record_lookup(self, license_plate_number, notices):
+        """
+        Post-lookup hook shared by `scrape` and `async_inference.AsyncInference`: adds the plate
+        to the plate index, marked valid when it has legal notices, and counts the lookup
+        Args:
+            license_plate_number: Text of the license plate
+            notices: Legal notices found for it
+
+        """
+        if self.plate_index is not None:
+            self.plate_index.add(license_plate_number, valid=bool(notices))
+        self.metrics.increment('sumal_lookups_total', labels={'found': 'true' if notices else 'false'})
+
     def scrape(self, license_plate_number):
-        base_url = 'https://inspectorulpadurii.ro/api/aviz'
+        """
+        Looks up the SUMAL legal notices of a license plate
+        Args:
+            license_plate_number: Text of the license plate
 
-        mock_number="BV20XKR" ## to modify with license_plate_number
+        Returns: List with the code, volume and validity of every legal notice
 
+        """
         print(license_plate_number)
 
-        response = requests.get(f'{base_url}/locations?nr={license_plate_number}').json()
-        codes = response['codAviz']
-        if not codes:
+        with self.metrics.stage('sumal'):
+            notices = self.sumal_client.lookup(license_plate_number)
+        self.record_lookup(license_plate_number, notices)
+        if not notices:
             print("Legal Notice not found")
-        for code in codes:
-            resp_2 = requests.get(f'{base_url}/{code}').json()
-            # getting volume
-            volume = resp_2['volum']['total']
+        for notice in notices:
+            print({'Code': notice['Code'], 'Volume': notice['Volume'], 'Validity': notice['Validity']})
 
-            # getting valdity
-            valid_from = get_date(resp_2['valabilitate']['emitere'])
-            valid_to = get_date(resp_2['valabilitate']['finalizare'])
-            print({'Code': code, 'Volume': volume, 'Validity': f'{valid_from} - {valid_to}'})
-        
+        return notices
 
-    def predict(self, image_path: str):
+    def predict(self, image):
         """
-        Predicts text on the license plate from the given image of a car
+        Predicts text on the license plate from the given image of a car. The image is
+        decoded once and the plate is read from a view of the decoded array.
         Args:
-            image_path: Path to the image of the car
+            image: Path to the image of the car, encoded image bytes or decoded BGR array
 
-        Returns: Text of the license plate
+        Returns: Text of the license plate, None when no plate was detected or the crop failed the quality gate
 
         """
-        x, y, width, height = self.bounding_box_prediction(image_path)
-
-        left = int(x - (width / 2))
-        right = int(x + (width / 2))
-        top = int(y - (height / 2))
-        bottom = int(y + (height / 2))
-
-        im = Image.open(image_path)
-        im_cropped = im.crop((left, top, right, bottom))
+        with self.metrics.stage('decode'):
+            image = load_image(image)
+        box, confidence = self._detect_box(image)
+        if box is None:
+            return None
 
-        result = self.ocr_prediction(im_cropped)
+        with self.metrics.stage('crop'):
+            crop = crop_plate(image, box)
+        if not self.gate_crops([crop], [confidence]):
+            return None
+        result = self.ocr_prediction(crop)
 
         return result
     
-    def inference(self, image_path: str):
-        license_plate_number=self.predict(image_path)
-        legal_document=self.scrape(license_plate_number)
+    def inference(self, image):
+        with self.metrics.request():
+            license_plate_number=self.resolve_plate(self.predict(image))
+            # No lookup for frames without a readable plate
+            legal_document=self.scrape(license_plate_number) if license_plate_number else None
+        return license_plate_number, legal_document
 
 
 if __name__ == '__main__':
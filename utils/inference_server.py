@@ -0,0 +1,352 @@
+"""
+Multi-process license plate reading server.
+
+N worker processes each load the detection and OCR models once. Frames are
+handed to them through a shared-memory ring of fixed-size slots, so only the
+slot number and frame shape cross the process boundary instead of pickled
+pixels. A dispatcher thread groups incoming frames into batches, sending a
+batch as soon as it is full or its oldest frame reached the latency deadline.
+The server is exposed as a small HTTP API on localhost.
+"""
+
+import functools
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context, shared_memory
+
+import cv2
+import numpy as np
+
+from detector_backends import limit_threads
+
+
+def _attach(name):
+    # Only the server unlinks the ring. Spawned workers share its resource tracker, so on
+    # Python < 3.13 (no `track` argument) attaching just re-registers the same name.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+def _frame_view(memory, slot, slot_bytes, shape):
+    return np.ndarray(shape, dtype=np.uint8, buffer=memory.buf, offset=slot * slot_bytes)
+
+
+def _worker_main(inference_factory, ring_name, slot_bytes, threads, tasks, results):
+    # Worker process: load the models once, then read batches of frames straight from the ring
+    limit_threads(threads)
+    memory = _attach(ring_name)
+    inference = inference_factory()
+    try:
+        while True:
+            batch = tasks.get()
+            if batch is None:
+                break
+            frames = [_frame_view(memory, slot, slot_bytes, shape) for _, slot, shape in batch]
+            try:
+                plates = inference.predict_batch(frames, batch_size=len(frames))
+                answers = [(request_id, slot, plate, None) for (request_id, slot, _), plate in zip(batch, plates)]
+            except Exception as error:
+                answers = [(request_id, slot, None, repr(error)) for request_id, slot, _ in batch]
+            del frames
+            results.put(answers)
+    finally:
+        memory.close()
+
+
+class InferenceServer:
+    """
+    Pool of inference worker processes fed through shared memory with dynamic batching.
+
+    Parameters:
+        inference_factory (callable): Picklable callable building the object used by the
+            workers, anything with `predict_batch(frames, batch_size)` (an `Inference`).
+        workers (int): Number of worker processes.
+        slots (int): Number of frames that can be in flight at once.
+        max_frame_shape (tuple): Largest (height, width, channels) frame accepted.
+        max_batch (int): Largest batch sent to a worker.
+        max_latency (float): Seconds the first frame of a batch may wait for more frames.
+    """
+
+    def __init__(self, inference_factory, workers: int = None, slots: int = None,
+                 max_frame_shape=(1080, 1920, 3), max_batch: int = 8, max_latency: float = 0.01):
+        self.workers = workers or os.cpu_count()
+        self.threads_per_worker = max(1, (os.cpu_count() or 1) // self.workers)
+        self.slots = slots or 4 * self.workers * max_batch
+        self.slot_bytes = int(np.prod(max_frame_shape))
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+
+        context = get_context('spawn')
+        self._ring = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._processes = [context.Process(target=_worker_main, daemon=True,
+                                           args=(inference_factory, self._ring.name, self.slot_bytes,
+                                                 self.threads_per_worker, self._tasks, self._results))
+                           for _ in range(self.workers)]
+
+        self._free_slots = queue.Queue()
+        for slot in range(self.slots):
+            self._free_slots.put(slot)
+        self._incoming = queue.Queue()
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._closed = False
+        # Set when a worker died: new frames are refused, `close` still cleans up
+        self._failed = False
+        self.stats = {'requests': 0, 'batches': 0}
+
+        for process in self._processes:
+            process.start()
+        self._threads = [threading.Thread(target=self._dispatch, daemon=True),
+                         threading.Thread(target=self._collect, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, frame):
+        """
+        Queue a decoded frame, blocking while every slot of the ring is in use.
+
+        Parameters:
+            frame (np.ndarray): BGR uint8 frame.
+
+        Returns:
+            Future: Resolves to the license plate text (None when no plate was detected).
+        """
+        if self._closed or self._failed:
+            raise RuntimeError('The inference server is closed' if self._closed else 'An inference worker died')
+        if frame.dtype != np.uint8 or frame.nbytes > self.slot_bytes:
+            raise ValueError(f'Frames must be uint8 and at most {self.slot_bytes} bytes')
+
+        slot = self._free_slots.get()
+        _frame_view(self._ring, slot, self.slot_bytes, frame.shape)[...] = frame
+        future = Future()
+        request_id = next(self._request_ids)
+        self._pending[request_id] = future
+        self._incoming.put((request_id, slot, frame.shape))
+        return future
+
+    def predict(self, frame, timeout: float = None):
+        return self.submit(frame).result(timeout)
+
+    def _dispatch(self):
+        while True:
+            first = self._incoming.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._incoming.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            self.stats['requests'] += len(batch)
+            self.stats['batches'] += 1
+            self._tasks.put(batch)
+            if stop:
+                return
+
+    def _collect(self):
+        while True:
+            try:
+                answers = self._results.get(timeout=0.1)
+            except queue.Empty:
+                answers = ()
+            if answers is None:
+                return
+            for request_id, slot, plate, error in answers:
+                self._free_slots.put(slot)
+                future = self._pending.pop(request_id)
+                if error is None:
+                    future.set_result(plate)
+                else:
+                    future.set_exception(RuntimeError(error))
+            # Checked on every iteration: under steady load the other workers keep the result
+            # queue busy, and the batch of a dead worker (e.g. out of memory) would never be answered
+            if not self._closed and any(process.exitcode is not None for process in self._processes):
+                self._failed = True
+                for request_id in list(self._pending):
+                    self._pending.pop(request_id).set_exception(RuntimeError('An inference worker died'))
+                return
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._incoming.put(None)
+        self._threads[0].join()
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            # After a worker died the others may be stuck on results nobody collects
+            process.join(None if not self._failed else 5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._results.put(None)
+        self._threads[1].join()
+        self._ring.close()
+        self._ring.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Many clients connect at once under load, the default backlog of 5 resets them
+    request_queue_size = 256
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/health':
+            return self._send(404, {'error': 'not found'})
+        server = self.server.inference_server
+        self._send(200, {'workers': server.workers, **server.stats})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            return self._send(404, {'error': 'not found'})
+        length = self.headers.get('Content-Length', '')
+        if not length.isdigit() or int(length) == 0:
+            return self._send(400, {'error': 'the body must be an image with its Content-Length'})
+        body = self.rfile.read(int(length))
+        try:
+            frame = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        except cv2.error:
+            frame = None
+        if frame is None:
+            return self._send(400, {'error': 'the body is not a decodable image'})
+        try:
+            license_plate = self.server.inference_server.predict(frame, timeout=self.server.request_timeout)
+        except FutureTimeoutError:
+            return self._send(504, {'error': f'no answer within {self.server.request_timeout} seconds'})
+        except ValueError as error:
+            return self._send(413, {'error': str(error)})
+        except RuntimeError as error:
+            return self._send(500, {'error': str(error)})
+
+        answer = {'license_plate': license_plate}
+        if self.server.sumal_client is not None and license_plate:
+            answer['legal_notices'] = self.server.sumal_client.lookup(license_plate)
+        self._send(200, answer)
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_http(inference_server, port: int = 8080, sumal_client=None, timeout: float = 30.0):
+    """
+    Expose an `InferenceServer` on http://127.0.0.1:<port>.
+
+    `POST /predict` takes an encoded image as body and answers {"license_plate": ...}
+    (plus "legal_notices" when a `SumalClient` is given), 400 when the body is not an
+    image and 504 when the frame is not read within `timeout` seconds. `GET /health`
+    answers the worker count and batching statistics.
+
+    Returns:
+        ThreadingHTTPServer: The started server, stop it with `shutdown()`.
+    """
+    http_server = _HTTPServer(('127.0.0.1', port), _Handler)
+    http_server.inference_server = inference_server
+    http_server.sumal_client = sumal_client
+    http_server.request_timeout = timeout
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    return http_server
+
+
+def load_test(url, image_paths, requests: int = 200, concurrency: int = 16):
+    """
+    Send `requests` images to a running server from `concurrency` threads.
+
+    Returns:
+        dict: Throughput in requests per second and p50/p95/p99 latency in milliseconds.
+    """
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+
+    bodies = []
+    for image_path in image_paths:
+        with open(image_path, 'rb') as file:
+            bodies.append(file.read())
+
+    def send(index):
+        request = urllib.request.Request(f'{url}/predict', data=bodies[index % len(bodies)], method='POST')
+        start_time = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            response.read()
+        return time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = np.array(list(executor.map(send, range(requests))))
+    elapsed = time.perf_counter() - start_time
+    p50, p95, p99 = np.percentile(latencies * 1000, [50, 95, 99])
+    return {'requests': requests, 'seconds': elapsed, 'requests_per_second': requests / elapsed,
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99)}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from detector_backends import MODEL_VARIANTS
+    from inference import Inference
+
+    parser = argparse.ArgumentParser(description='Serve license plate reading on localhost.')
+    parser.add_argument('--model', required=True, help='Path to the license plate detection model')
+    parser.add_argument('--ocr-model', default='microsoft/trocr-base-printed')
+    parser.add_argument('--backend', default='auto')
+    parser.add_argument('--variant', default=None, choices=MODEL_VARIANTS,
+                        help='Precision of the detection models, e.g. int8 (see quantization.py)')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--max-latency', type=float, default=0.01)
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--load-test', nargs='*', default=None, help='Images to load-test the server with')
+    args = parser.parse_args()
+
+    factory = functools.partial(Inference, rf_bb_model=args.model, ocr_model=args.ocr_model, backend=args.backend,
+                                model_variant=args.variant)
+    with InferenceServer(factory, workers=args.workers, max_batch=args.max_batch,
+                         max_latency=args.max_latency) as server:
+        http_server = serve_http(server, args.port)
+        print(f'Serving on http://127.0.0.1:{args.port} with {server.workers} workers')
+        try:
+            if args.load_test:
+                print(load_test(f'http://127.0.0.1:{args.port}', args.load_test))
+            else:
+                threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            http_server.shutdown()
@@ -0,0 +1,384 @@
+"""
+Per-stage timers, counters and histograms for the inference hot path.
+
+`Inference` and `SumalClient` record into a `Metrics` object: stage latencies
+(decode, detect, crop, OCR, SUMAL), batch sizes, cache hits and HTTP
+retries. Sinks export them as Prometheus text or to MLflow. The default
+`NULL_METRICS` records nothing, its timers are a shared no-op context manager
+so the disabled cost is one method call per stage.
+
+A `SamplingProfiler` can be attached to capture the Python stacks of slow
+requests as collapsed stacks, ready for flamegraph tools.
+"""
+
+import bisect
+import contextlib
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Upper bounds in seconds of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class NullMetrics:
+    """
+    Metrics that record nothing, used when instrumentation is disabled.
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return _NULL_CONTEXT
+
+    def request(self):
+        return _NULL_CONTEXT
+
+    def observe(self, name, value, labels=None, buckets=None):
+        pass
+
+    def increment(self, name, value=1, labels=None):
+        pass
+
+    def gauge(self, name, function):
+        pass
+
+    def flush(self):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+class _Timer:
+    __slots__ = ('metrics', 'labels', 'start_time')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.labels = (('stage', name),)
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics._observe('stage_seconds', time.perf_counter() - self.start_time, self.labels, LATENCY_BUCKETS)
+
+
+class _Request:
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        profiler = self.metrics.profiler
+        self.token = profiler.start() if profiler is not None else None
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.start_time
+        self.metrics._observe('request_seconds', duration, (), LATENCY_BUCKETS)
+        if self.token is not None and self.metrics.profiler.stop(self.token, duration):
+            self.metrics.increment('slow_requests_total')
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters, histograms and gauges.
+
+    Parameters:
+        sink: Where `flush` exports the metrics (`PrometheusSink`, `MLflowSink`, `NullSink`).
+        profiler (SamplingProfiler): Optional profiler of slow requests.
+        namespace (str): Prefix of the exported metric names.
+    """
+
+    enabled = True
+
+    def __init__(self, sink=None, profiler=None, namespace: str = 'plate'):
+        self.sink = sink or NullSink()
+        self.profiler = profiler
+        self.namespace = namespace
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """
+        Context manager timing a pipeline stage into the `stage_seconds` histogram.
+        """
+        return _Timer(self, name)
+
+    def request(self):
+        """
+        Context manager timing a whole request, profiled when a profiler is attached.
+        """
+        return _Request(self)
+
+    def observe(self, name, value, labels=None, buckets=None):
+        """
+        Add a value to a histogram, created with `buckets` (latency buckets by default).
+        """
+        self._observe(name, value, tuple(sorted(labels.items())) if labels else (), buckets or LATENCY_BUCKETS)
+
+    def _observe(self, name, value, labels, buckets):
+        key = (name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': buckets, 'counts': [0] * (len(buckets) + 1),
+                                                    'sum': 0.0, 'count': 0}
+            histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def increment(self, name, value=1, labels=None):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name, function):
+        """
+        Register a gauge read at export time. `function` returns a number, or a dict of
+        numbers exported with a `key` label (e.g. the `stats` of a cache).
+        """
+        self.gauges[name] = function
+
+    def read_gauges(self):
+        values = {}
+        for name, function in self.gauges.items():
+            value = function()
+            if isinstance(value, dict):
+                for key, item in value.items():
+                    values[(name, (('key', key),))] = item
+            else:
+                values[(name, ())] = value
+        return values
+
+    def flush(self):
+        self.sink.export(self)
+
+
+def histogram_quantile(histogram, quantile):
+    """
+    Estimate a quantile from the buckets of a histogram, interpolating like Prometheus.
+    """
+    if not histogram['count']:
+        return 0.0
+    rank = quantile * histogram['count']
+    cumulative = 0
+    lower = 0.0
+    for upper, count in zip(histogram['buckets'], histogram['counts']):
+        if cumulative + count >= rank:
+            return lower + (upper - lower) * (rank - cumulative) / count if count else upper
+        cumulative += count
+        lower = upper
+    return histogram['buckets'][-1]
+
+
+def _format_labels(labels, extra=()):
+    labels = tuple(labels) + tuple(extra)
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+
+class NullSink:
+
+    def export(self, metrics):
+        pass
+
+
+class PrometheusSink:
+    """
+    Prometheus text exposition format.
+
+    Parameters:
+        path (str): Optional file rewritten on every `export`, e.g. for the node exporter
+            textfile collector. `serve` exposes the metrics over HTTP instead.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+
+    @staticmethod
+    def render(metrics):
+        lines = []
+        namespace = metrics.namespace
+        with metrics._lock:
+            counters = dict(metrics.counters)
+            histograms = {key: {**value, 'counts': list(value['counts'])} for key, value in metrics.histograms.items()}
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE {namespace}_{name} counter')
+            lines.extend(f'{namespace}_{name}{_format_labels(labels)} {value}'
+                         for (counter, labels), value in sorted(counters.items()) if counter == name)
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE {namespace}_{name} histogram')
+            for (histogram_name, labels), histogram in sorted(histograms.items()):
+                if histogram_name != name:
+                    continue
+                cumulative = 0
+                for upper, count in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+                    cumulative += count
+                    lines.append(f'{namespace}_{name}_bucket{_format_labels(labels, [("le", upper)])} {cumulative}')
+                lines.append(f'{namespace}_{name}_sum{_format_labels(labels)} {histogram["sum"]}')
+                lines.append(f'{namespace}_{name}_count{_format_labels(labels)} {histogram["count"]}')
+        gauges = metrics.read_gauges()
+        for name in sorted({name for name, _ in gauges}):
+            lines.append(f'# TYPE {namespace}_{name} gauge')
+            lines.extend(f'{namespace}_{name}{_format_labels(labels)} {value}'
+                         for (gauge, labels), value in sorted(gauges.items()) if gauge == name)
+        return '\n'.join(lines) + '\n'
+
+    def export(self, metrics):
+        if not self.path:
+            return
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            file.write(self.render(metrics))
+        os.replace(tmp_path, self.path)
+
+    def serve(self, metrics, port: int = 9100):
+        """
+        Serve the metrics on http://127.0.0.1:<port>/metrics from a daemon thread.
+
+        Returns:
+            ThreadingHTTPServer: The started server, stop it with `shutdown()`.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        render = self.render
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = render(metrics).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class MLflowSink:
+    """
+    Logs counters, gauges and the count, mean, p50 and p95 of every histogram to the active
+    MLflow run.
+
+    Parameters:
+        mlflow: The mlflow module, e.g. from `evaluation.init_tracking()`.
+    """
+
+    def __init__(self, mlflow=None):
+        if mlflow is None:
+            import mlflow
+        self.mlflow = mlflow
+        self.step = 0
+
+    def export(self, metrics):
+        values = {}
+        with metrics._lock:
+            counters = dict(metrics.counters)
+            histograms = {key: {**value, 'counts': list(value['counts'])} for key, value in metrics.histograms.items()}
+        for (name, labels), value in list(counters.items()) + list(metrics.read_gauges().items()):
+            values[_metric_key(name, labels)] = value
+        for (name, labels), histogram in histograms.items():
+            key = _metric_key(name, labels)
+            values[f'{key}.count'] = histogram['count']
+            values[f'{key}.mean'] = histogram['sum'] / histogram['count'] if histogram['count'] else 0.0
+            values[f'{key}.p50'] = histogram_quantile(histogram, 0.5)
+            values[f'{key}.p95'] = histogram_quantile(histogram, 0.95)
+        self.mlflow.log_metrics(values, step=self.step)
+        self.step += 1
+
+
+def _metric_key(name, labels):
+    return '.'.join([name] + [str(value) for _, value in labels])
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stack of in-flight requests and keeps the samples of slow ones.
+
+    A single daemon thread wakes up every `interval` seconds while requests are running,
+    so requests themselves only pay for registering their thread.
+
+    Parameters:
+        threshold (float): Requests slower than this many seconds are saved.
+        interval (float): Seconds between two samples.
+        output_directory (str): Directory of the `.folded` collapsed-stack files.
+    """
+
+    def __init__(self, threshold: float = 1.0, interval: float = 0.005, output_directory: str = 'slow_requests'):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_directory = output_directory
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        threading.Thread(target=self._sample, daemon=True).start()
+
+    def start(self):
+        token = (threading.get_ident(), object())
+        with self._lock:
+            self._active[token] = Counter()
+        self._wake.set()
+        return token
+
+    def stop(self, token, duration):
+        """
+        Stop sampling a request.
+
+        Returns:
+            bool: True when the request was slow and its stacks were saved.
+        """
+        with self._lock:
+            samples = self._active.pop(token)
+            if not self._active:
+                self._wake.clear()
+        if duration < self.threshold or not samples:
+            return False
+        os.makedirs(self.output_directory, exist_ok=True)
+        path = os.path.join(self.output_directory, f'slow-{time.strftime("%Y%m%d-%H%M%S")}-{int(duration * 1000)}ms.folded')
+        with open(path, 'w') as file:
+            file.writelines(f'{stack} {count}\n' for stack, count in samples.most_common())
+        return True
+
+    def _sample(self):
+        while True:
+            self._wake.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for (thread_id, _), samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_collapse(frame)] += 1
+
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
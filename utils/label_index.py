@@ -0,0 +1,206 @@
+"""
+Compact on-disk index of a YOLO label directory.
+
+The label files are parsed once into a memory-mapped store: one structured
+array holding the boxes of every image, an offset table giving the rows of
+each image and a string table with the license plate text. Later runs open
+the store with a single mmap and only re-parse the files whose modification
+time, size and content hash changed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+INDEX_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.label_index')
+
+BOX_DTYPE = np.dtype([('cls', '<i2'), ('x', '<f4'), ('y', '<f4'), ('w', '<f4'), ('h', '<f4')])
+
+
+def _file_hash(path):
+    with open(path, 'rb') as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+def parse_label_file(label_file_path):
+    """
+    Parse a YOLO format label file.
+
+    Parameters:
+        label_file_path (str): Path to the label file.
+
+    Returns:
+        tuple: Structured array of the normalized (class, x, y, w, h) boxes and the
+        text lines of the file (the license plate numbers).
+    """
+    rows = []
+    text = []
+    with open(label_file_path, 'r') as file:
+        for line in file:
+            tokens = line.split()
+            if not tokens:
+                continue
+            try:
+                values = [float(token) for token in tokens]
+            except ValueError:
+                values = None
+            if values is not None and len(values) == 5:
+                rows.append((int(values[0]), *values[1:]))
+            else:
+                text.append(line.strip())
+    return np.array(rows, dtype=BOX_DTYPE), text
+
+
+class LabelIndex:
+    """
+    Read-only view over a label index, see `LabelIndex.build` to create or refresh one.
+
+    Parameters:
+        index_path (str): Directory of the index.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        with open(os.path.join(index_path, 'files.json'), 'r') as file:
+            self.files = json.load(file)
+        self.names = [entry['name'] for entry in self.files]
+        self._positions = {name: position for position, name in enumerate(self.names)}
+        self.boxes = np.load(os.path.join(index_path, 'boxes.npy'), mmap_mode='r')
+        self.offsets = np.load(os.path.join(index_path, 'offsets.npy'), mmap_mode='r')
+        self._strings = np.load(os.path.join(index_path, 'strings.npy'), mmap_mode='r')
+        self._string_offsets = np.load(os.path.join(index_path, 'string_offsets.npy'), mmap_mode='r')
+
+    @staticmethod
+    def default_path(labels_directory):
+        """
+        Index location for a label directory, kept out of the (DVC tracked) data folder.
+        """
+        labels_directory = os.path.abspath(labels_directory)
+        key = hashlib.blake2b(labels_directory.encode(), digest_size=8).hexdigest()
+        return os.path.join(INDEX_ROOT, f'{os.path.basename(labels_directory)}-{key}')
+
+    @classmethod
+    def build(cls, labels_directory, index_path=None):
+        """
+        Create the index of a label directory, or refresh it incrementally.
+
+        A file is re-parsed only when its modification time or size changed and its
+        content hash differs from the indexed one.
+
+        Parameters:
+            labels_directory (str): Directory with the YOLO `.txt` label files.
+            index_path (str): Directory of the index, see `default_path`.
+
+        Returns:
+            LabelIndex: The up to date index.
+        """
+        index_path = index_path or cls.default_path(labels_directory)
+        previous = None
+        if os.path.exists(os.path.join(index_path, 'files.json')):
+            previous = cls(index_path)
+
+        entries = sorted((entry for entry in os.scandir(labels_directory)
+                          if entry.name.endswith('.txt') and entry.is_file()), key=lambda entry: entry.name)
+
+        files = []
+        box_parts = []
+        counts = []
+        texts = []
+        changed = previous is None or len(entries) != len(previous.files)
+        for entry in entries:
+            stat = entry.stat()
+            name = os.path.splitext(entry.name)[0]
+            record = {'name': name, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+            old = previous.files[previous._positions[name]] if previous and name in previous._positions else None
+
+            if old and old['mtime_ns'] == record['mtime_ns'] and old['size'] == record['size']:
+                record['hash'] = old['hash']
+            else:
+                record['hash'] = _file_hash(entry.path)
+
+            if old and old['hash'] == record['hash']:
+                changed = changed or old['mtime_ns'] != record['mtime_ns']
+                rows, text = np.array(previous.boxes_of(name)), previous.text(name)
+            else:
+                changed = True
+                rows, text = parse_label_file(entry.path)
+                text = text[0] if text else ''
+
+            files.append(record)
+            box_parts.append(np.asarray(rows, dtype=BOX_DTYPE))
+            counts.append(len(rows))
+            texts.append(text)
+
+        if previous is not None and not changed:
+            return previous
+
+        encoded = [text.encode('utf-8') for text in texts]
+        arrays = {
+            'boxes': np.concatenate(box_parts) if box_parts else np.zeros(0, dtype=BOX_DTYPE),
+            'offsets': np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64),
+            'strings': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+            'string_offsets': np.concatenate([[0], np.cumsum([len(text) for text in encoded], dtype=np.int64)])
+                                .astype(np.int64),
+        }
+        del previous
+        cls._write(index_path, files, arrays)
+        return cls(index_path)
+
+    @staticmethod
+    def _write(index_path, files, arrays):
+        # Write the new index next to the old one and swap the directories
+        tmp_path = f'{index_path}.tmp'
+        old_path = f'{index_path}.old'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+        with open(os.path.join(tmp_path, 'files.json'), 'w') as file:
+            json.dump(files, file)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(index_path):
+            os.replace(index_path, old_path)
+        os.replace(tmp_path, index_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._positions
+
+    def boxes_of(self, name):
+        """
+        Normalized (class, x, y, w, h) boxes of an image, as a view into the mmap.
+
+        Parameters:
+            name (str): File name of the image or label, without extension.
+        """
+        position = self._positions[name]
+        return self.boxes[self.offsets[position]:self.offsets[position + 1]]
+
+    def boxes_xywh(self, name, image_size=640):
+        """
+        N x 4 (x, y, w, h) boxes of an image in pixels, x, y being the center of the box.
+        """
+        rows = self.boxes_of(name)
+        return np.stack([rows['x'], rows['y'], rows['w'], rows['h']], axis=1) * image_size
+
+    def boxes_xyxy(self, name, image_size=640):
+        """
+        N x 4 (x1, y1, x2, y2) boxes of an image in pixels.
+        """
+        boxes = self.boxes_xywh(name, image_size)
+        return np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+
+    def text(self, name):
+        """
+        License plate text of an image, the first non-box line of its label file.
+        """
+        position = self._positions[name]
+        start, end = self._string_offsets[position], self._string_offsets[position + 1]
+        return bytes(self._strings[start:end]).decode('utf-8')
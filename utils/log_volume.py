@@ -0,0 +1,162 @@
+"""
+Estimation of the wood volume loaded on a truck, ported from the Flutter app
+(`GuessingPixels.calculatePixelToCmRatio` and `GuessingLog.getEstimatedVolume`).
+
+The license plate, 52 cm wide, gives the centimetres per pixel of the photo.
+Every log end detected by the log model is a circle whose diameter is the
+longest side of its box, and every log is a cylinder of the known length.
+All computations are array operations over the boxes of one or many frames.
+"""
+
+import os
+
+import numpy as np
+
+from detector_backends import load_detector
+
+LOG_MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              'assets', 'models', 'log_model', 'best_float32.tflite')
+
+# Width of a Romanian license plate
+LICENSE_PLATE_WIDTH_CM = 52
+
+# Log length used by the app when the driver does not enter one
+DEFAULT_LOG_LENGTH_CM = 800
+
+
+def load_log_model(model_path=LOG_MODEL_PATH, backend='auto', tile_size: int = None, overlap: float = 0.2,
+                   adaptive: bool = False, variant: str = None):
+    """
+    Load the log model.
+
+    Parameters:
+        model_path (str): Path of the exported model.
+        backend (str): Detector backend, see `detector_backends.load_detector`.
+        tile_size (int): When given, large photos are also detected tile by tile at this
+            size, so small log ends keep enough pixels, see `tiling.TiledDetector`.
+        overlap (float): Fraction of a tile shared with its neighbours.
+        adaptive (bool): Only run the tiles the full-frame pass finds dense.
+        variant (str): Precision of the model to run, see `detector_backends.MODEL_VARIANTS`.
+
+    Returns:
+        DetectorBackend: The loaded model.
+    """
+    detector = load_detector(model_path, backend=backend, variant=variant)
+    if tile_size:
+        from tiling import TiledDetector
+
+        detector = TiledDetector(detector, tile_size=tile_size, overlap=overlap, adaptive=adaptive)
+    return detector
+
+
+def pixel_to_cm_ratio(license_plate_width_px):
+    """
+    Centimetres per pixel, from the width in pixels of the license plate.
+
+    Parameters:
+        license_plate_width_px (float | np.ndarray): Plate width of one or many frames.
+
+    Returns:
+        float | np.ndarray: Ratio of every frame.
+    """
+    return LICENSE_PLATE_WIDTH_CM / np.asarray(license_plate_width_px, dtype=np.float64)
+
+
+def log_diameters_px(boxes):
+    """
+    Diameter in pixels of every detected log end, the longest side of its box.
+
+    Parameters:
+        boxes (np.ndarray): N x 4+ array of (x1, y1, x2, y2, ...) boxes, as returned by the
+            detector backends.
+
+    Returns:
+        np.ndarray: N diameters.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    if not boxes.size:
+        return np.zeros(0)
+    return np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+
+
+def log_volumes_m3(diameters_px, ratio, log_length_cm=DEFAULT_LOG_LENGTH_CM):
+    """
+    Volume in cubic metres of cylindrical logs.
+
+    Parameters:
+        diameters_px (np.ndarray): Diameter of every log in pixels.
+        ratio (float | np.ndarray): Centimetres per pixel (one per log, or shared).
+        log_length_cm (float | np.ndarray): Length of the logs in centimetres.
+
+    Returns:
+        np.ndarray: Volume of every log.
+    """
+    radius_cm = np.asarray(diameters_px) * ratio / 2
+    return np.pi * radius_cm ** 2 * log_length_cm / 1e6
+
+
+def estimate_volume(boxes, ratio, log_length_cm=DEFAULT_LOG_LENGTH_CM):
+    """
+    Estimated wood volume of one photo, as computed by the app.
+
+    Parameters:
+        boxes (np.ndarray): N x 4+ log detections of the photo.
+        ratio (float): Centimetres per pixel, see `pixel_to_cm_ratio`.
+        log_length_cm (float): Length of the logs in centimetres.
+
+    Returns:
+        float: Total volume in cubic metres.
+
+    Raises:
+        ValueError: When no volume could be estimated (no logs detected).
+    """
+    total_volume = float(log_volumes_m3(log_diameters_px(boxes), ratio, log_length_cm).sum())
+    if total_volume == 0:
+        raise ValueError('Failed to get estimated volume')
+    return total_volume
+
+
+def estimate_volumes(frames_boxes, license_plate_widths_px, log_length_cm=DEFAULT_LOG_LENGTH_CM):
+    """
+    Estimated wood volume of many photos in one pass.
+
+    The boxes of all frames are concatenated, so the diameters and volumes are computed
+    by a handful of array operations whatever the number of frames and logs.
+
+    Parameters:
+        frames_boxes (list): N x 4+ log detections of every frame.
+        license_plate_widths_px (array-like): Plate width in pixels of every frame.
+        log_length_cm (float | array-like): Log length of all frames or of every frame.
+
+    Returns:
+        np.ndarray: Total volume of every frame in cubic metres, 0 for frames without logs
+        (where `estimate_volume` would raise).
+    """
+    counts = np.array([len(boxes) for boxes in frames_boxes], dtype=np.int64)
+    ratios = pixel_to_cm_ratio(license_plate_widths_px).reshape(-1)
+    lengths = np.broadcast_to(np.asarray(log_length_cm, dtype=np.float64), counts.shape)
+    if not counts.sum():
+        return np.zeros(len(counts))
+
+    boxes = np.concatenate([np.asarray(boxes, dtype=np.float64)[:, :4] for boxes in frames_boxes if len(boxes)])
+    frame_of_log = np.repeat(np.arange(len(counts)), counts)
+    volumes = log_volumes_m3(log_diameters_px(boxes), ratios[frame_of_log], lengths[frame_of_log])
+    return np.bincount(frame_of_log, weights=volumes, minlength=len(counts))
+
+
+def detect_and_estimate(log_model, images, license_plate_widths_px, log_length_cm=DEFAULT_LOG_LENGTH_CM,
+                        conf: float = 0.4, iou: float = 0.45):
+    """
+    Detect the logs of a batch of photos and estimate their wood volume.
+
+    Parameters:
+        log_model (DetectorBackend): Loaded log model, see `load_log_model`.
+        images (list): Decoded BGR photos.
+        license_plate_widths_px (array-like): Plate width in pixels of every photo.
+
+    Returns:
+        tuple: (volumes in cubic metres, number of logs) of every photo.
+    """
+    detections = log_model.predict(images, conf=conf, iou=iou)
+    volumes = estimate_volumes(detections, license_plate_widths_px, log_length_cm)
+    return volumes, np.array([len(frame_detections) for frame_detections in detections])
@@ -0,0 +1,222 @@
+"""
+Vectorized box matching and dataset-level detection metrics.
+
+Every prediction of an image is compared against every ground truth box of
+that image through one N x M IoU matrix, and precision, recall and
+mAP@[.5:.95] are computed over the whole dataset with array operations.
+"""
+
+import numpy as np
+
+IOU_THRESHOLDS = np.round(np.arange(0.5, 0.96, 0.05), 2)
+
+
+def xywh_to_xyxy(boxes):
+    """
+    Convert (x, y, w, h) boxes given by their center into (x1, y1, x2, y2) corners.
+
+    Parameters:
+        boxes (array-like): N x 4 boxes.
+
+    Returns:
+        np.ndarray: N x 4 float32 array.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    half = boxes[:, 2:] / 2
+    return np.concatenate([boxes[:, :2] - half, boxes[:, :2] + half], axis=1)
+
+
+def iou_matrix(boxes1, boxes2):
+    """
+    Calculate the IoU of every box of `boxes1` against every box of `boxes2`.
+
+    Parameters:
+        boxes1 (np.ndarray): N x 4 (x1, y1, x2, y2) boxes.
+        boxes2 (np.ndarray): M x 4 (x1, y1, x2, y2) boxes.
+
+    Returns:
+        np.ndarray: N x M IoU matrix.
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float32).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float32).reshape(-1, 4)
+
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    union = area1[:, None] + area2[None, :] - intersection
+
+    return intersection / (union + 1e-6)  # Adding a small epsilon to avoid division by zero
+
+
+def read_label_boxes(label_file_path, image_size=640):
+    """
+    Read every box of a YOLO format label file, unlike `evaluation.read_label_file`
+    which only keeps the first one.
+
+    Parameters:
+        label_file_path (str): Path to the YOLO format label file.
+        image_size (int): Size of the (square) images the labels are normalized against.
+
+    Returns:
+        tuple: M x 4 (x1, y1, x2, y2) boxes in pixels, M class ids and the text lines
+        of the file (the license plate numbers).
+    """
+    boxes = []
+    classes = []
+    text = []
+    with open(label_file_path, 'r') as file:
+        for line in file:
+            tokens = line.split()
+            if not tokens:
+                continue
+            try:
+                values = [float(token) for token in tokens]
+            except ValueError:
+                values = None
+            if values is not None and len(values) == 5:
+                classes.append(int(values[0]))
+                boxes.append(values[1:])
+            else:
+                text.append(line.strip())
+
+    boxes = xywh_to_xyxy(np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * image_size)
+    return boxes, np.asarray(classes, dtype=np.int32), text
+
+
+def greedy_match(ious, scores, thresholds=IOU_THRESHOLDS):
+    """
+    Match predictions to ground truth boxes the way COCO does: by decreasing score,
+    every prediction takes the unmatched ground truth box it overlaps most.
+
+    Parameters:
+        ious (np.ndarray): N x M IoU matrix of the predictions against the ground truth.
+        scores (np.ndarray): N confidence scores of the predictions.
+        thresholds (np.ndarray): T IoU thresholds, all matched at once.
+
+    Returns:
+        np.ndarray: N x T boolean array, True where the prediction is a true positive.
+    """
+    count, gt_count = ious.shape
+    true_positives = np.zeros((count, len(thresholds)), dtype=bool)
+    if count == 0 or gt_count == 0:
+        return true_positives
+
+    taken = np.zeros((len(thresholds), gt_count), dtype=bool)
+    thresholds = np.asarray(thresholds)[:, None]
+    columns = np.arange(len(thresholds))
+    # The order of predictions matters, the thresholds and ground truth boxes are vectorized
+    for index in np.argsort(-scores, kind='stable'):
+        candidates = np.where(taken | (ious[index][None, :] < thresholds), -1.0, ious[index][None, :])
+        best = candidates.argmax(axis=1)
+        matched = candidates[columns, best] >= 0
+        taken[columns[matched], best[matched]] = True
+        true_positives[index] = matched
+    return true_positives
+
+
+def hungarian_match(ious, scores, thresholds=IOU_THRESHOLDS):
+    """
+    Match predictions to ground truth boxes with the assignment maximizing the total IoU.
+
+    Parameters:
+        ious (np.ndarray): N x M IoU matrix of the predictions against the ground truth.
+        scores (np.ndarray): N confidence scores of the predictions (unused, kept for
+            the signature of `greedy_match`).
+        thresholds (np.ndarray): T IoU thresholds.
+
+    Returns:
+        np.ndarray: N x T boolean array, True where the prediction is a true positive.
+    """
+    from scipy.optimize import linear_sum_assignment
+
+    true_positives = np.zeros((ious.shape[0], len(thresholds)), dtype=bool)
+    if ious.size == 0:
+        return true_positives
+    for column, threshold in enumerate(thresholds):
+        gated = np.where(ious >= threshold, ious, 0.0)
+        rows, cols = linear_sum_assignment(gated, maximize=True)
+        true_positives[rows, column] = gated[rows, cols] > 0
+    return true_positives
+
+
+def average_precision(precision, recall):
+    """
+    COCO style 101-point interpolated average precision, for every column at once.
+
+    Parameters:
+        precision (np.ndarray): K x T precision curve, predictions sorted by decreasing score.
+        recall (np.ndarray): K x T recall curve.
+
+    Returns:
+        np.ndarray: T average precisions.
+    """
+    if precision.shape[0] == 0:
+        return np.zeros(precision.shape[1])
+    # Make the precision monotonically decreasing from right to left
+    envelope = np.flip(np.maximum.accumulate(np.flip(precision, axis=0), axis=0), axis=0)
+    points = np.linspace(0, 1, 101)
+    ap = np.empty(precision.shape[1])
+    for column in range(precision.shape[1]):
+        indices = np.searchsorted(recall[:, column], points, side='left')
+        valid = indices < len(envelope)
+        ap[column] = envelope[indices[valid], column].sum() / len(points)
+    return ap
+
+
+def evaluate_dataset(predictions, ground_truths, thresholds=IOU_THRESHOLDS, matcher=greedy_match):
+    """
+    Compute precision, recall and mAP over a whole dataset.
+
+    Parameters:
+        predictions (dict): Image id -> (N x 4 (x1, y1, x2, y2) boxes, N scores).
+        ground_truths (dict): Image id -> M x 4 (x1, y1, x2, y2) boxes. An image missing
+            from it has no ground truth box.
+        thresholds (np.ndarray): IoU thresholds, by default 0.5 to 0.95 in steps of 0.05.
+        matcher (callable): `greedy_match` or `hungarian_match`.
+
+    Returns:
+        dict: Per-threshold precision, recall and AP, plus mAP@.5 and mAP@[.5:.95].
+    """
+    thresholds = np.asarray(thresholds)
+    all_scores = []
+    all_true_positives = []
+    gt_total = 0
+
+    # Predictions on an image without ground truth entry are all false positives
+    image_ids = list(ground_truths) + [image_id for image_id in predictions if image_id not in ground_truths]
+    for image_id in image_ids:
+        gt_boxes = np.asarray(ground_truths.get(image_id, ()), dtype=np.float32).reshape(-1, 4)
+        gt_total += len(gt_boxes)
+        boxes, scores = predictions.get(image_id, (np.zeros((0, 4)), np.zeros(0)))
+        scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+        if len(scores) == 0:
+            continue
+        all_scores.append(scores)
+        all_true_positives.append(matcher(iou_matrix(boxes, gt_boxes), scores, thresholds))
+
+    if all_scores:
+        scores = np.concatenate(all_scores)
+        true_positives = np.concatenate(all_true_positives)[np.argsort(-scores, kind='stable')]
+    else:
+        true_positives = np.zeros((0, len(thresholds)), dtype=bool)
+
+    tp_cumulative = np.cumsum(true_positives, axis=0)
+    fp_cumulative = np.cumsum(~true_positives, axis=0)
+    recall_curve = tp_cumulative / max(gt_total, 1)
+    precision_curve = tp_cumulative / np.maximum(tp_cumulative + fp_cumulative, 1)
+    ap = average_precision(precision_curve, recall_curve)
+
+    tp_total = tp_cumulative[-1] if len(tp_cumulative) else np.zeros(len(thresholds))
+    return {
+        'thresholds': thresholds,
+        'precision': tp_total / max(len(true_positives), 1),
+        'recall': tp_total / max(gt_total, 1),
+        'ap': ap,
+        'mAP50': float(ap[np.isclose(thresholds, 0.5)].mean()) if np.isclose(thresholds, 0.5).any() else None,
+        'mAP50_95': float(ap.mean()),
+        'predictions': len(true_positives),
+        'ground_truths': gt_total,
+    }
@@ -0,0 +1,453 @@
+"""
+OCR backends for reading license plate crops.
+
+`TrOCRBackend` wraps the autoregressive transformers models of `OCR_MODELS`.
+`CTCBackend` runs a lightweight CRNN-style recognizer exported to ONNX with
+greedy CTC decoding, one forward pass per batch without any decoding loop.
+`CachedOCR` puts an opt-in cache of exact crop contents in front of any
+backend, so identical crops seen again within a few seconds are only read once.
+`CascadeOCR` reads every crop with a small model and only hands the crops it is
+unsure about, or that are not a valid plate, to larger ones.
+"""
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# Blank symbol first, as produced by the usual CTC training setups
+DEFAULT_ALPHABET = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+# Tiers of the default cascade, smallest first
+CASCADE_TIERS = (
+    'microsoft/trocr-small-printed',
+    'microsoft/trocr-base-printed',
+    'microsoft/trocr-large-printed',
+)
+
+
+def clean_text(text):
+    """
+    Remove non-alphanumeric characters and convert to uppercase.
+    """
+    return re.sub(r'[^a-zA-Z0-9]', '', text).upper()
+
+
+def to_rgb_array(image):
+    """
+    Convert a path, PIL image or RGB array into an RGB uint8 array.
+    """
+    if isinstance(image, str):
+        image = Image.open(image)
+    if isinstance(image, Image.Image):
+        return np.asarray(image.convert('RGB'))
+    return image
+
+
+def to_pil(image):
+    if isinstance(image, np.ndarray):
+        return Image.fromarray(image)
+    return image
+
+
+def _as_bgr(image):
+    # Crops from `inference.crop_plate` are RGB views over a BGR frame (reversed channel
+    # stride). OpenCV would copy them, so hand it the underlying BGR view instead.
+    if image.strides[-1] < 0:
+        return image[..., ::-1], True
+    return image, False
+
+
+def to_gray(image):
+    """
+    Convert a path, PIL image or RGB array into a grayscale array without copying RGB views.
+    """
+    image = to_rgb_array(image)
+    if image.ndim == 2:
+        return image
+    image, is_bgr = _as_bgr(image)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY if is_bgr else cv2.COLOR_RGB2GRAY)
+
+
+def resize_rgb(image, size, interpolation=cv2.INTER_LINEAR):
+    """
+    Resize an RGB array (or RGB view) to `size` (width, height), the only copy made of a crop.
+    """
+    image, is_bgr = _as_bgr(image)
+    resized = cv2.resize(image, size, interpolation=interpolation)
+    return resized[..., ::-1] if is_bgr else resized
+
+
+class OCRBackend:
+    """
+    Interface of the OCR backends: read a batch of plate crops.
+    """
+
+    name = 'base'
+
+    def read(self, images):
+        """
+        Read the text of license plate crops.
+
+        Parameters:
+            images (list): Paths, RGB PIL images or RGB arrays of the crops.
+
+        Returns:
+            list: Cleaned license plate text of every crop.
+        """
+        raise NotImplementedError
+
+    def read_scored(self, images):
+        """
+        Read crops along with the confidence of every read.
+
+        Returns:
+            tuple: Cleaned text and confidence in [0, 1] of every crop. Backends without
+                scores report a confidence of 1.
+        """
+        return self.read(images), [1.0] * len(images)
+
+
+class TrOCRBackend(OCRBackend):
+    """
+    Microsoft TrOCR through the transformers `image-to-text` pipeline.
+
+    Parameters:
+        model_name (str): Hugging Face model, e.g. 'microsoft/trocr-base-printed'.
+        batch_size (int): Batch size of the pipeline.
+    """
+
+    name = 'trocr'
+
+    def __init__(self, model_name, batch_size: int = 8):
+        from transformers import pipeline
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.pipeline = pipeline("image-to-text", model=model_name)
+
+    def read(self, images):
+        images = [to_pil(image) if not isinstance(image, str) else image for image in images]
+        predictions = self.pipeline(images, batch_size=self.batch_size)
+        return [clean_text(prediction[0]['generated_text']) for prediction in predictions]
+
+    def read_scored(self, images):
+        # The pipeline does not return scores, so the model generates directly (greedy, as
+        # with the default generation config of the printed models). The confidence of a
+        # read is the probability of its least likely token.
+        import torch
+
+        model = self.pipeline.model
+        pad_token_id = model.generation_config.pad_token_id
+        texts = []
+        confidences = []
+        for start in range(0, len(images), self.batch_size):
+            batch = [to_pil(to_rgb_array(image)) for image in images[start:start + self.batch_size]]
+            pixel_values = self.pipeline.image_processor(images=batch, return_tensors='pt').pixel_values
+            with torch.no_grad():
+                output = model.generate(pixel_values.to(model.device), num_beams=1, do_sample=False,
+                                        output_scores=True, return_dict_in_generate=True)
+            scores = model.compute_transition_scores(output.sequences, output.scores, normalize_logits=True)
+            # Sequences finished early are padded, their padding is not part of the read
+            generated = output.sequences[:, -scores.shape[1]:]
+            scores = scores.masked_fill(generated == pad_token_id, 0.0)
+            texts.extend(clean_text(text) for text in
+                         self.pipeline.tokenizer.batch_decode(output.sequences, skip_special_tokens=True))
+            confidences.extend(scores.min(dim=1).values.exp().tolist())
+        return texts, confidences
+
+
+def ctc_greedy_decode(logits, alphabet=DEFAULT_ALPHABET, blank=0):
+    """
+    Greedy (best path) CTC decoding of a batch.
+
+    Parameters:
+        logits (np.ndarray): N x T x C scores (log-probabilities or logits).
+        alphabet (str): Symbol of every class, the blank one included.
+        blank (int): Index of the blank class.
+
+    Returns:
+        list: Decoded text of every item.
+    """
+    best = logits.argmax(axis=2)
+    # Keep a symbol when it is not blank and differs from the previous time step
+    keep = best != blank
+    keep[:, 1:] &= best[:, 1:] != best[:, :-1]
+    symbols = np.array(list(alphabet))
+    return [''.join(symbols[row[mask]]) for row, mask in zip(best, keep)]
+
+
+class CTCBackend(OCRBackend):
+    """
+    CRNN-style recognizer exported to ONNX, decoded with greedy CTC.
+
+    Parameters:
+        model_path (str): Path of the `.onnx` model, taking N x 1 x H x W (or N x 3 x H x W)
+            images scaled to [-1, 1] and returning N x T x C (or T x N x C) scores.
+        alphabet (str): Symbol of every output class, the blank one first.
+        input_size (tuple): (height, width) of the model input.
+        num_threads (int): ONNX Runtime intra-op threads, see `detector_backends.default_num_threads`.
+    """
+
+    name = 'ctc'
+
+    def __init__(self, model_path, alphabet: str = DEFAULT_ALPHABET, input_size=(32, 128), num_threads: int = None):
+        import onnxruntime as ort
+
+        from detector_backends import default_num_threads
+
+        num_threads = num_threads or default_num_threads()
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._channels = model_input.shape[1] if isinstance(model_input.shape[1], int) else 1
+        self.alphabet = alphabet
+        self.input_size = input_size
+
+    def _prepare(self, images):
+        height, width = self.input_size
+        batch = np.empty((len(images), self._channels, height, width), dtype=np.float32)
+        for index, image in enumerate(images):
+            if self._channels == 1:
+                resized = cv2.resize(to_gray(image), (width, height), interpolation=cv2.INTER_LINEAR)
+            else:
+                resized = resize_rgb(to_rgb_array(image), (width, height))
+            resized = resized.reshape(height, width, self._channels)
+            np.multiply(resized.transpose(2, 0, 1), 1 / 127.5, out=batch[index], casting='unsafe')
+        batch -= 1.0
+        return batch
+
+    def _logits(self, images):
+        logits = self.session.run(None, {self._input_name: self._prepare(images)})[0]
+        if logits.shape[0] != len(images):
+            logits = logits.transpose(1, 0, 2)
+        return logits
+
+    def read(self, images):
+        if not images:
+            return []
+        return [clean_text(text) for text in ctc_greedy_decode(self._logits(images), self.alphabet)]
+
+    def read_scored(self, images):
+        if not images:
+            return [], []
+        logits = self._logits(images)
+        # Softmax of the best class of every time step, the least certain step is the confidence
+        best = logits.max(axis=2, keepdims=True)
+        probabilities = 1 / np.exp(logits - best).sum(axis=2)
+        texts = [clean_text(text) for text in ctc_greedy_decode(logits, self.alphabet)]
+        return texts, probabilities.min(axis=1).tolist()
+
+
+def dhash(images, hash_size: int = 8):
+    """
+    64-bit difference hashes of images, robust to small shifts, blur and exposure changes.
+
+    Parameters:
+        images (list): Paths, PIL images or RGB arrays.
+
+    Returns:
+        np.ndarray: One uint64 hash per image.
+    """
+    grays = np.empty((len(images), hash_size, hash_size + 1), dtype=np.int16)
+    for index, image in enumerate(images):
+        gray = to_gray(image)
+        grays[index] = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (grays[:, :, 1:] > grays[:, :, :-1]).reshape(len(images), -1)
+    return np.packbits(bits, axis=1).view('>u8').astype(np.uint64).reshape(-1)
+
+
+def crop_hash(image):
+    """
+    Content hash of a plate crop (path, PIL image or RGB array), equal only for crops of the
+    same shape and pixels.
+    """
+    image = to_rgb_array(image)
+    digest = hashlib.blake2b(str(image.shape).encode(), digest_size=16)
+    digest.update(np.ascontiguousarray(image).tobytes())
+    return digest.digest()
+
+
+class CropCache:
+    """
+    Recent crops and their text, matched by `crop_hash`.
+
+    Only crops with exactly the same pixels match, within a short time window: a re-sent
+    frame or a duplicated video frame skips OCR. Perceptual hashes are not used, crops of
+    plates one character apart can be as close as two captures of the same plate.
+
+    Parameters:
+        maxsize (int): Number of crops remembered.
+        max_age (float): Seconds a crop is remembered, None for no limit.
+    """
+
+    def __init__(self, maxsize: int = 256, max_age: float = 10.0):
+        self.maxsize = maxsize
+        self.max_age = max_age
+        # Crop hash -> (time added, text)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _expire(self):
+        if self.max_age is None:
+            return
+        deadline = time.monotonic() - self.max_age
+        for key in [key for key, (added, _) in self._entries.items() if added < deadline]:
+            del self._entries[key]
+
+    def get(self, key):
+        self._expire()
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key, text):
+        self._entries[key] = (time.monotonic(), text)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class CachedOCR(OCRBackend):
+    """
+    Wraps an OCR backend so crops identical to a recently read one skip the model.
+
+    Parameters:
+        backend (OCRBackend): Backend reading the crops missing from the cache.
+        cache (CropCache): Cache of recent crops.
+    """
+
+    def __init__(self, backend, cache: CropCache = None):
+        self.backend = backend
+        self.cache = cache or CropCache()
+        self.name = f'cached-{backend.name}'
+
+    def read(self, images):
+        if not images:
+            return []
+        keys = [crop_hash(image) for image in images]
+        texts = [self.cache.get(key) for key in keys]
+        # Identical crops within the batch are read once too
+        missing = {}
+        for index, (key, text) in enumerate(zip(keys, texts)):
+            if text is None:
+                missing.setdefault(key, index)
+        if missing:
+            read = dict(zip(missing, self.backend.read([images[index] for index in missing.values()])))
+            for key, text in read.items():
+                self.cache.set(key, text)
+            texts = [read[key] if text is None else text for key, text in zip(keys, texts)]
+        return texts
+
+
+class CascadeOCR(OCRBackend):
+    """
+    Confidence-gated cascade of OCR backends. Every crop is read by the first (smallest)
+    tier, and only the crops read with a low confidence, or not forming a valid Romanian
+    plate once look-alike characters are fixed, go on to the next tier, in one batch.
+    A larger tier never replaces a valid plate with an invalid one.
+
+    Parameters:
+        tiers (str | list): Comma-separated backend specs, smallest first, or a list of
+            specs or loaded backends. Every tier is loaded up front and kept resident.
+        min_confidence (float): Lowest confidence of a read accepted without escalating.
+        validate (bool): Also escalate the reads that are not a valid plate.
+    """
+
+    name = 'cascade'
+
+    def __init__(self, tiers=CASCADE_TIERS, min_confidence: float = 0.9, validate: bool = True):
+        if isinstance(tiers, str):
+            tiers = [tier for tier in tiers.split(',') if tier] or CASCADE_TIERS
+        self.tiers = [load_ocr(tier) if isinstance(tier, str) else tier for tier in tiers]
+        self.min_confidence = min_confidence
+        self.validate = validate
+        self.crops = 0
+        self.reads = [0] * len(self.tiers)
+        self.times = [0.0] * len(self.tiers)
+
+    def read(self, images):
+        # plate_index imports this module
+        from plate_index import is_valid_plate, normalize_plate
+
+        texts = [None] * len(images)
+        valid = [False] * len(images)
+        pending = list(range(len(images)))
+        for level, tier in enumerate(self.tiers):
+            if not pending:
+                break
+            start_time = time.perf_counter()
+            tier_texts, confidences = tier.read_scored([images[index] for index in pending])
+            self.times[level] += time.perf_counter() - start_time
+            self.reads[level] += len(pending)
+
+            escalated = []
+            for index, text, confidence in zip(pending, tier_texts, confidences):
+                plate = not self.validate or is_valid_plate(normalize_plate(text))
+                if plate or not valid[index]:
+                    texts[index], valid[index] = text, plate
+                if not plate or confidence < self.min_confidence:
+                    escalated.append(index)
+            pending = escalated
+        self.crops += len(images)
+        return texts
+
+    @property
+    def stats(self):
+        """
+        Crops read, crops escalated past the first tier, their rate, and the reads and
+        seconds spent in every tier (`reads_<tier>`, `time_<tier>`).
+        """
+        escalated = self.reads[1] if len(self.reads) > 1 else 0
+        stats = {'crops': self.crops, 'escalated': escalated,
+                 'escalation_rate': escalated / self.crops if self.crops else 0.0}
+        for level, (reads, seconds) in enumerate(zip(self.reads, self.times)):
+            stats[f'reads_{level}'] = reads
+            stats[f'time_{level}'] = seconds
+        return stats
+
+
+OCR_BACKENDS = {
+    'trocr': TrOCRBackend,
+    'ctc': CTCBackend,
+    'cascade': CascadeOCR,
+}
+
+
+def load_ocr(spec, cache_size: int = 0, **kwargs):
+    """
+    Load an OCR backend from its spec.
+
+    Parameters:
+        spec (str): '<backend>:<model>' (e.g. 'ctc:models/plate_crnn.onnx') or a bare Hugging Face
+            model name, which selects TrOCR (e.g. 'microsoft/trocr-base-printed'). A cascade
+            takes comma-separated tier specs, 'cascade:' alone being `CASCADE_TIERS`.
+        cache_size (int): Size of the `CropCache` put in front of the backend, 0 for none.
+        **kwargs: Options of the backend.
+
+    Returns:
+        OCRBackend: The loaded backend.
+    """
+    name, separator, model = spec.partition(':')
+    if not separator or name not in OCR_BACKENDS:
+        name, model = 'trocr', spec
+    backend = OCR_BACKENDS[name](model, **kwargs)
+    if cache_size:
+        backend = CachedOCR(backend, CropCache(cache_size))
+    return backend
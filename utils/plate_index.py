@@ -0,0 +1,268 @@
+"""
+Normalization of OCR'd Romanian license plates and a fuzzy index of known plates.
+
+OCR often swaps look-alike characters (O/0, I/1, B/8...). `normalize_plate`
+uses the Romanian plate format (county code, digits, three letters) to put
+letters and digits back where they belong. `PlateIndex` keeps the plates
+already seen, and those known to have legal notices, in a BK-tree under a
+confusion-aware edit distance. A read is then resolved to its canonical plate
+locally, before any SUMAL request is made. Only reads that are not a valid
+plate are matched, and by default only through look-alike swaps: a real edit
+turns one truck into another. Searches within one edit go through a deletion
+index of look-alike signatures, a few dict lookups, and only wider searches
+walk the BK-tree.
+"""
+
+import json
+import os
+import re
+import threading
+
+from ocr_backends import clean_text
+
+COUNTY_CODES = frozenset([
+    'AB', 'AG', 'AR', 'B', 'BC', 'BH', 'BN', 'BR', 'BT', 'BV', 'BZ', 'CJ', 'CL', 'CS', 'CT', 'CV', 'DB', 'DJ',
+    'GJ', 'GL', 'GR', 'HD', 'HR', 'IF', 'IL', 'IS', 'MH', 'MM', 'MS', 'NT', 'OT', 'PH', 'SB', 'SJ', 'SM', 'SV',
+    'TL', 'TM', 'TR', 'VL', 'VN', 'VS',
+])
+
+# County code, 2 digits (2 or 3 in Bucharest) and 3 letters. The letters never start
+# with I or O and never contain Q.
+PLATE_PATTERN = re.compile(r'^(?:B\d{2,3}|[A-Z]{2}\d{2})[A-HJ-NPR-Z][A-PR-Z]{2}$')
+
+# Characters OCR mistakes for one another; substitutions inside a group are cheap
+CONFUSION_GROUPS = ['O0DQ', 'I1L', 'B8', 'S5', 'Z2', 'G6', 'A4', 'T7']
+
+_GROUP_OF = {character: index for index, group in enumerate(CONFUSION_GROUPS) for character in group}
+_TO_DIGIT = {character: next(c for c in group if c.isdigit())
+             for group in CONFUSION_GROUPS for character in group if character.isalpha()}
+_TO_LETTER = {character: next(c for c in group if c.isalpha())
+              for group in CONFUSION_GROUPS for character in group if character.isdigit()}
+_SIGNATURE = str.maketrans({character: group[0] for group in CONFUSION_GROUPS for character in group})
+
+# Edit costs, in integer units so the BK-tree can key its children by distance
+CONFUSION_COST = 1
+EDIT_COST = 4
+
+# Default fuzzy-match threshold: look-alike swaps only, never a real edit
+MAX_LOOKALIKE_DISTANCE = EDIT_COST - 1
+
+
+def is_valid_plate(plate):
+    """
+    Check that a cleaned plate follows the Romanian format with an existing county code.
+    """
+    if not PLATE_PATTERN.match(plate):
+        return False
+    return plate[0] == 'B' and plate[1].isdigit() or plate[:2] in COUNTY_CODES
+
+
+def _coerce(text, layout):
+    # Force every position to the letter / digit the layout expects, counting the changes
+    characters = []
+    changes = 0
+    for character, kind in zip(text, layout):
+        if kind == 'L' and character.isdigit():
+            character = _TO_LETTER.get(character)
+            changes += 1
+        elif kind == 'D' and character.isalpha():
+            character = _TO_DIGIT.get(character)
+            changes += 1
+        if character is None:
+            return None, changes
+        characters.append(character)
+    return ''.join(characters), changes
+
+
+def normalize_plate(text):
+    """
+    Clean an OCR read and fix look-alike letters and digits using the plate format.
+
+    Parameters:
+        text (str): Raw or cleaned OCR text.
+
+    Returns:
+        str: The valid plate needing the fewest substitutions, or the cleaned text when no
+        valid plate can be formed.
+    """
+    plate = clean_text(text)
+    if is_valid_plate(plate):
+        return plate
+    layouts = {6: ['LDDLLL'], 7: ['LDDDLLL', 'LLDDLLL']}.get(len(plate), [])
+    best = None
+    for layout in layouts:
+        candidate, changes = _coerce(plate, layout)
+        if candidate is not None and is_valid_plate(candidate) and (best is None or changes < best[0]):
+            best = (changes, candidate)
+    return best[1] if best else plate
+
+
+def signature(plate):
+    """
+    Replace every look-alike character by the first one of its group: plates differing only
+    by look-alike swaps share a signature.
+    """
+    return plate.translate(_SIGNATURE)
+
+
+def _deletions(text):
+    return {text} | {text[:index] + text[index + 1:] for index in range(len(text))}
+
+
+def plate_distance(first, second):
+    """
+    Edit distance where swapping look-alike characters costs `CONFUSION_COST` and any other
+    substitution, insertion or deletion costs `EDIT_COST`. The look-alike groups are
+    disjoint, so this is a metric and can index a BK-tree.
+    """
+    if first == second:
+        return 0
+    previous = list(range(0, (len(second) + 1) * EDIT_COST, EDIT_COST))
+    for row, character in enumerate(first, 1):
+        current = [row * EDIT_COST]
+        group = _GROUP_OF.get(character)
+        for column, other in enumerate(second, 1):
+            if character == other:
+                substitution = 0
+            elif group is not None and group == _GROUP_OF.get(other):
+                substitution = CONFUSION_COST
+            else:
+                substitution = EDIT_COST
+            current.append(min(previous[column - 1] + substitution, previous[column] + EDIT_COST,
+                               current[column - 1] + EDIT_COST))
+        previous = current
+    return previous[-1]
+
+
+class PlateIndex:
+    """
+    BK-tree of known plates, resolving OCR reads to the closest known plate.
+
+    Parameters:
+        max_distance (int): Largest `plate_distance` accepted for a fuzzy match, by default
+            up to three look-alike swaps. Keep it under `EDIT_COST`: plates one real edit
+            apart are different trucks.
+        path (str): Optional JSON file the index is loaded from and saved to.
+    """
+
+    def __init__(self, max_distance: int = MAX_LOOKALIKE_DISTANCE, path: str = None):
+        self.max_distance = max_distance
+        self.path = path
+        # plate -> True when it is known to have legal notices
+        self.plates = {}
+        # Signature, and signature with one character deleted -> plates
+        self._neighbours = {}
+        # The BK-tree is only needed for wide searches, plates are inserted on the first one
+        self._root = None
+        self._unindexed = []
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.plates)
+
+    def __contains__(self, plate):
+        return plate in self.plates
+
+    def add(self, plate, valid: bool = False):
+        """
+        Add a plate, or mark it as having legal notices.
+        """
+        with self._lock:
+            if plate in self.plates:
+                self.plates[plate] = self.plates[plate] or valid
+                return
+            self.plates[plate] = valid
+            for key in _deletions(signature(plate)):
+                self._neighbours.setdefault(key, set()).add(plate)
+            self._unindexed.append(plate)
+
+    def _insert(self, plate):
+        if self._root is None:
+            self._root = (plate, {})
+            return
+        node = self._root
+        while True:
+            distance = plate_distance(plate, node[0])
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (plate, {})
+                return
+            node = child
+
+    def search(self, plate, max_distance=None):
+        """
+        Find the known plates within `max_distance` of `plate`.
+
+        Returns:
+            list: (distance, plate) pairs, closest first.
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        if max_distance <= EDIT_COST:
+            # Up to one real edit: the neighbours share a signature, or one with a deletion
+            with self._lock:
+                candidates = set().union(*(self._neighbours.get(key, ()) for key in _deletions(signature(plate))))
+            return sorted((distance, candidate) for distance, candidate in
+                          ((plate_distance(plate, candidate), candidate) for candidate in candidates)
+                          if distance <= max_distance)
+        matches = []
+        with self._lock:
+            for pending in self._unindexed:
+                self._insert(pending)
+            self._unindexed = []
+            stack = [self._root] if self._root is not None else []
+            while stack:
+                candidate, children = stack.pop()
+                distance = plate_distance(plate, candidate)
+                if distance <= max_distance:
+                    matches.append((distance, candidate))
+                for child_distance, child in children.items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        stack.append(child)
+        return sorted(matches)
+
+    def resolve(self, text):
+        """
+        Resolve an OCR read to its canonical plate.
+
+        The read is normalized, then matched exactly (a dict lookup) and only then fuzzily
+        against the known plates. A read forming a valid plate is never rewritten, it may be
+        a truck not seen yet. Among equally close plates, those with legal notices win; an
+        ambiguous fuzzy match is not trusted.
+
+        Returns:
+            str: The canonical plate, or the normalized read when no known plate is close.
+        """
+        plate = normalize_plate(text)
+        if plate in self.plates or not self.plates or is_valid_plate(plate):
+            return plate
+        matches = self.search(plate)
+        if not matches:
+            return plate
+        best_distance = matches[0][0]
+        closest = [candidate for distance, candidate in matches if distance == best_distance]
+        valid = [candidate for candidate in closest if self.plates.get(candidate)]
+        if len(valid) == 1:
+            return valid[0]
+        if len(closest) == 1:
+            return closest[0]
+        return plate
+
+    def load(self):
+        with open(self.path, 'r') as file:
+            for plate, valid in json.load(file).items():
+                self.add(plate, valid)
+
+    def save(self):
+        """
+        Write the index to `path`, atomically replacing the previous file.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            plates = dict(self.plates)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(plates, file)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,183 @@
+"""
+Quality gate run on license plate crops before OCR.
+
+Crops that are too small, blurred, flat or overexposed rarely give a correct
+read, so they are dropped before the expensive OCR call and the SUMAL lookup
+that would follow. All crops of a batch are resized to one small shape and
+measured together with array operations. On video, `BestCropSelector` keeps
+the best crop of every tracked vehicle and sends only that one to OCR.
+"""
+
+import cv2
+import numpy as np
+
+from inference import crop_plate
+from ocr_backends import to_gray
+
+# Every crop is measured at this (width, height), so sharpness is comparable across sizes
+MEASURE_SIZE = (128, 32)
+
+MIN_WIDTH = 40
+MIN_HEIGHT = 12
+# Variance of the Laplacian of the resized grayscale crop
+MIN_SHARPNESS = 60.0
+# Standard deviation of the grayscale crop
+MIN_CONTRAST = 20.0
+# Largest brightness of the darkest 5% of the pixels: above it the characters are washed
+# out by overexposure (plates are white, so saturated pixels alone are expected)
+MAX_BLACK_LEVEL = 170.0
+MIN_CONFIDENCE = 0.5
+
+
+def measure_crops(crops):
+    """
+    Measure the quality of license plate crops.
+
+    Parameters:
+        crops (list): RGB arrays (or views) of the crops.
+
+    Returns:
+        dict: Arrays of the width, height, sharpness, contrast and black level of every crop.
+    """
+    count = len(crops)
+    sizes = np.array([crop.shape[:2] for crop in crops], dtype=np.int64).reshape(count, 2)
+    stack = np.zeros((count, MEASURE_SIZE[1], MEASURE_SIZE[0]), dtype=np.float32)
+    for index, crop in enumerate(crops):
+        if crop.size:
+            stack[index] = cv2.resize(to_gray(crop), MEASURE_SIZE, interpolation=cv2.INTER_AREA)
+
+    laplacian = (stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:] + stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1]
+                 - 4 * stack[:, 1:-1, 1:-1])
+    return {'width': sizes[:, 1], 'height': sizes[:, 0],
+            'sharpness': laplacian.reshape(count, -1).var(axis=1),
+            'contrast': stack.reshape(count, -1).std(axis=1),
+            'black_level': np.percentile(stack.reshape(count, -1), 5, axis=1)}
+
+
+class PlateQualityGate:
+    """
+    Decides which crops are worth reading.
+
+    Parameters:
+        min_width (int): Minimum crop width in pixels.
+        min_height (int): Minimum crop height in pixels.
+        min_sharpness (float): Minimum Laplacian variance, lower means motion blur or defocus.
+        min_contrast (float): Minimum grayscale standard deviation.
+        max_black_level (float): Largest brightness of the darkest pixels, higher means overexposed.
+        min_confidence (float): Minimum detection confidence.
+    """
+
+    def __init__(self, min_width: int = MIN_WIDTH, min_height: int = MIN_HEIGHT,
+                 min_sharpness: float = MIN_SHARPNESS, min_contrast: float = MIN_CONTRAST,
+                 max_black_level: float = MAX_BLACK_LEVEL, min_confidence: float = MIN_CONFIDENCE):
+        self.min_width = min_width
+        self.min_height = min_height
+        self.min_sharpness = min_sharpness
+        self.min_contrast = min_contrast
+        self.max_black_level = max_black_level
+        self.min_confidence = min_confidence
+        self.passed = 0
+        self.rejected = 0
+
+    def evaluate(self, crops, confidences):
+        """
+        Check a batch of crops.
+
+        Parameters:
+            crops (list): RGB arrays (or views) of the crops.
+            confidences (array-like): Detection confidence of every crop.
+
+        Returns:
+            tuple: Boolean array, True for the crops worth reading, and the score of every
+            crop (detection confidence times the square root of the sharpness) used to
+            rank the crops of one vehicle.
+        """
+        if not len(crops):
+            return np.zeros(0, dtype=bool), np.zeros(0)
+        confidences = np.asarray(confidences, dtype=np.float64)
+        measures = measure_crops(crops)
+        keep = ((measures['width'] >= self.min_width) & (measures['height'] >= self.min_height)
+                & (measures['sharpness'] >= self.min_sharpness) & (measures['contrast'] >= self.min_contrast)
+                & (measures['black_level'] <= self.max_black_level) & (confidences >= self.min_confidence))
+        self.passed += int(keep.sum())
+        self.rejected += int(len(keep) - keep.sum())
+        return keep, confidences * np.sqrt(measures['sharpness'])
+
+    @property
+    def stats(self):
+        return {'passed': self.passed, 'rejected': self.rejected}
+
+
+class BestCropSelector:
+    """
+    Keeps the best crop of every tracked vehicle and releases it for OCR once the vehicle
+    was followed for `window` frames or left the scene. A vehicle without any crop passing
+    the gate keeps being observed until one does, and is never read otherwise.
+
+    Parameters:
+        gate (PlateQualityGate): Gate measuring the crops.
+        window (int): Number of frames a track is observed before its best crop is read.
+        min_hits (int): Number of detections a track needs before it is read at all.
+    """
+
+    def __init__(self, gate: PlateQualityGate = None, window: int = 5, min_hits: int = 2):
+        self.gate = gate or PlateQualityGate()
+        self.window = window
+        self.min_hits = min_hits
+        # track id -> [score, frame index, box, crop, frames observed, hits]
+        self._candidates = {}
+        self._done = set()
+
+    def update(self, frame, frame_index, matches, confidences, expired=()):
+        """
+        Consider the crops of the tracks matched on a frame.
+
+        Parameters:
+            frame (np.ndarray): BGR frame.
+            frame_index (int): Index of the frame.
+            matches (list): (track, box) pairs of the frame, see `PlateTracker.matches`.
+            confidences (list): Detection confidence of every match.
+            expired (list): Tracks that left the scene.
+
+        Returns:
+            list: (frame index, track id, box, crop) of the vehicles whose best crop is ready.
+        """
+        ready = []
+        pending = [(track, box, confidence) for (track, box), confidence in zip(matches, confidences)
+                   if track.track_id not in self._done]
+        if pending:
+            crops = [crop_plate(frame, box) for _, box, _ in pending]
+            keep, scores = self.gate.evaluate(crops, [confidence for _, _, confidence in pending])
+            for (track, box, _), crop, passed, score in zip(pending, crops, keep, scores):
+                candidate = self._candidates.setdefault(track.track_id, [-np.inf, None, None, None, 0, 0])
+                candidate[4] += 1
+                candidate[5] = track.hits
+                if passed and score > candidate[0]:
+                    # Copy the small crop so the frame itself can be released
+                    candidate[:4] = [score, frame_index, box, np.ascontiguousarray(crop)]
+                if candidate[4] >= self.window and candidate[5] >= self.min_hits and candidate[3] is not None:
+                    ready.extend(self._release(track.track_id))
+
+        for track in expired:
+            ready.extend(self._release(track.track_id))
+            self._done.discard(track.track_id)
+        return ready
+
+    def _release(self, track_id):
+        candidate = self._candidates.pop(track_id, None)
+        if candidate is None:
+            return []
+        self._done.add(track_id)
+        if candidate[3] is None or candidate[5] < self.min_hits:
+            return []
+        _, frame_index, box, crop, _, _ = candidate
+        return [(frame_index, track_id, box, crop)]
+
+    def flush(self):
+        """
+        Release the best crops of every vehicle still followed, at the end of a stream.
+        """
+        ready = []
+        for track_id in list(self._candidates):
+            ready.extend(self._release(track_id))
+        return ready
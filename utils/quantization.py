@@ -0,0 +1,203 @@
+"""
+INT8 and dynamic-range quantization of the YOLOv8 detectors.
+
+Float32 inference is the main CPU cost on the edge boxes. This script builds
+quantized `.tflite` variants of the license plate and log models next to
+their `best_float32.tflite` export, named so `detector_backends.variant_path`
+(and the `model_variant` / `--variant` options of the runtime) find them:
+
+- `int8`: weights and activations in int8, the activation ranges calibrated
+  on a representative sample of the DVC `data` set. Inputs and outputs stay
+  float32 unless asked otherwise, `TFLiteBackend` handles both.
+- `dynamic`: int8 weights, float activations, no calibration needed.
+
+A `.tflite` file cannot be re-quantized, the variants are converted from the
+training checkpoint (`best.pt`, exported to a SavedModel by ultralytics) or
+from an existing SavedModel directory. Every variant is then run through the
+Custom path of `evaluation.license_plate_bbox_evaluation` so the mean IoU and
+detected count sit next to the per-image latency and the model size. Track
+the new files with `dvc add` like the float32 models.
+"""
+
+import os
+
+import numpy as np
+
+from dataset_manifest import find_images
+from detector_backends import letterbox
+
+# Images the activation ranges are calibrated on
+CALIBRATION_COUNT = 200
+
+QUANTIZATION_MODES = ('int8', 'dynamic')
+
+
+def calibration_images(data_directory, count: int = CALIBRATION_COUNT, seed: int = 0):
+    """
+    Sample the calibration images from every (source, split) of a dataset, in proportion
+    to its size. Test splits are left out so the report is not measured on calibration data.
+
+    Returns:
+        list: Image paths.
+    """
+    groups = {}
+    for image_path, _, source, split in find_images(data_directory):
+        if split != 'test':
+            groups.setdefault((source, split), []).append(os.path.join(data_directory, image_path))
+    total = sum(len(paths) for paths in groups.values())
+    if not total:
+        raise FileNotFoundError(f'No training images found under {data_directory}')
+    rng = np.random.default_rng(seed)
+    sample = []
+    for _, paths in sorted(groups.items()):
+        share = min(len(paths), max(1, round(count * len(paths) / total)))
+        sample.extend(rng.choice(paths, size=share, replace=False).tolist())
+    return sample
+
+
+def representative_dataset(image_paths, imgsz: int = 640):
+    """
+    Generator of calibration inputs, preprocessed exactly like `TFLiteBackend` does
+    (letterbox, BGR to RGB, [0, 1] float32).
+    """
+    import cv2
+
+    buffer = np.empty((imgsz, imgsz, 3), dtype=np.uint8)
+
+    def generate():
+        for image_path in image_paths:
+            image = cv2.imread(image_path)
+            if image is None:
+                continue
+            letterboxed, _, _ = letterbox(image, imgsz, out=buffer)
+            yield [(letterboxed[None, ..., ::-1] / 255).astype(np.float32)]
+
+    return generate
+
+
+def export_saved_model(weights_path, imgsz: int = 640):
+    """
+    Export a `.pt` checkpoint to a TensorFlow SavedModel with ultralytics.
+
+    Returns:
+        str: Path of the SavedModel directory.
+    """
+    from ultralytics import YOLO
+
+    return YOLO(weights_path).export(format='saved_model', imgsz=imgsz)
+
+
+def quantize(source, output_path, mode: str = 'int8', calibration_paths=(), imgsz: int = 640,
+             integer_io: bool = False):
+    """
+    Convert a model to a quantized `.tflite` file.
+
+    Parameters:
+        source (str): `.pt` checkpoint or SavedModel directory.
+        output_path (str): `.tflite` file written, atomically replaced if it exists.
+        mode (str): 'int8' (calibrated full integer) or 'dynamic' (int8 weights only).
+        calibration_paths (list): Calibration images of the int8 mode, see `calibration_images`.
+        imgsz (int): Side of the square model input.
+        integer_io (bool): Also quantize the input and output tensors (int8 mode only).
+
+    Returns:
+        str: `output_path`.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode '{mode}', expected one of {', '.join(QUANTIZATION_MODES)}")
+    if mode == 'int8' and not len(calibration_paths):
+        raise ValueError('The int8 mode needs calibration images')
+    import tensorflow as tf
+
+    saved_model = export_saved_model(source, imgsz) if source.endswith('.pt') else source
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == 'int8':
+        converter.representative_dataset = representative_dataset(calibration_paths, imgsz)
+        # Ops without an int8 kernel fall back to float instead of failing the conversion
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+        if integer_io:
+            converter.inference_input_type = tf.int8
+            converter.inference_output_type = tf.int8
+    model = converter.convert()
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(model)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def build_variants(source, output_directory, data_directory, modes=QUANTIZATION_MODES, name: str = 'best',
+                   count: int = CALIBRATION_COUNT, imgsz: int = 640):
+    """
+    Build the quantized variants of a model as `<output_directory>/<name>_<mode>.tflite`.
+
+    Returns:
+        dict: Mode -> path of the variant.
+    """
+    calibration_paths = calibration_images(data_directory, count) if 'int8' in modes else []
+    return {mode: quantize(source, os.path.join(output_directory, f'{name}_{mode}.tflite'), mode,
+                           calibration_paths, imgsz)
+            for mode in modes}
+
+
+def compare_variants(model_path, variants, images_directory, labels_directory):
+    """
+    Evaluate variants of the license plate model with the Custom path of
+    `evaluation.license_plate_bbox_evaluation`.
+
+    Parameters:
+        model_path (str): Float32 `.tflite` model the variants were built from.
+        variants (list): Variants to compare, e.g. ['float32', 'int8', 'dynamic'].
+        images_directory (str): Test images.
+        labels_directory (str): Their YOLO labels.
+
+    Returns:
+        list: (variant, mean IoU, detected, total time, latency per image in ms, size in MB) rows.
+    """
+    from detector_backends import variant_path
+    from evaluation import license_plate_bbox_evaluation, process_ground_truth_labels
+
+    ground_truth, _ = process_ground_truth_labels(labels_directory)
+    paths = [variant_path(model_path, variant) for variant in variants]
+    performance = license_plate_bbox_evaluation(images_directory, ground_truth, paths, 'Custom')
+    return [(variant, *row[1:]) for variant, row in zip(variants, performance)]
+
+
+def print_report(rows, image_count=None):
+    print(f'{"variant":<10} {"mean IoU":>9} {"detected":>9} {"ms/image":>9} {"size MB":>8}')
+    for variant, mean_iou, detected, _, latency_ms, size_mb in rows:
+        detected = f'{detected}/{image_count}' if image_count else detected
+        print(f'{variant:<10} {mean_iou:9.3f} {detected:>9} {latency_ms:9.1f} {size_mb:8.1f}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Build and evaluate quantized variants of a detector.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Build the quantized variants')
+    build_parser.add_argument('source', help='best.pt checkpoint or SavedModel directory')
+    build_parser.add_argument('--output-directory', required=True,
+                              help='Directory of the float32 model, e.g. assets/models/license_plate')
+    build_parser.add_argument('--data', default='data', help='DVC dataset the int8 ranges are calibrated on')
+    build_parser.add_argument('--modes', nargs='+', default=list(QUANTIZATION_MODES), choices=QUANTIZATION_MODES)
+    build_parser.add_argument('--count', type=int, default=CALIBRATION_COUNT, help='Calibration images')
+    build_parser.add_argument('--imgsz', type=int, default=640)
+
+    report_parser = subparsers.add_parser('report', help='Compare the variants of the license plate model')
+    report_parser.add_argument('model', help='Float32 .tflite model, e.g. best_float32.tflite')
+    report_parser.add_argument('--images', required=True, help='Test images directory')
+    report_parser.add_argument('--labels', required=True, help='Test labels directory')
+    report_parser.add_argument('--variants', nargs='+', default=['float32', 'int8', 'dynamic'])
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        for mode, path in build_variants(args.source, args.output_directory, args.data, args.modes,
+                                         count=args.count, imgsz=args.imgsz).items():
+            print(f'{mode:<8} {path} ({os.path.getsize(path) / 2 ** 20:.1f} MB)')
+    else:
+        image_count = sum(1 for filename in os.listdir(args.images) if filename.endswith('.jpg'))
+        print_report(compare_variants(args.model, args.variants, args.images, args.labels), image_count)
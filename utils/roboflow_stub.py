@@ -0,0 +1,132 @@
+"""
+Local stand-in for the Roboflow hosted inference API, replaying recorded
+predictions so the Roboflow evaluation can be tested and benchmarked offline.
+
+The recordings are the prediction cache written by `eval_harness.RoboflowClient`
+during a run against the real API, see `load_recordings`.
+"""
+
+import base64
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from eval_harness import CACHE_DIRECTORY, PredictionCache, bytes_hash
+
+
+def load_recordings(models, version: int = 1, cache_root: str = CACHE_DIRECTORY):
+    """
+    Read the cached answers of hosted models.
+
+    Returns:
+        dict: (model, version) -> {cache key: answer}, see `RoboflowClient.predict`.
+    """
+    recordings = {}
+    for model in models:
+        directory = PredictionCache(cache_root, f'roboflow-{model}-{version}').directory
+        answers = recordings[(model, str(version))] = {}
+        for filename in os.listdir(directory):
+            if filename.endswith('.json'):
+                with open(os.path.join(directory, filename), 'r') as file:
+                    answers[filename[:-len('.json')]] = json.load(file)
+    return recordings
+
+
+class RoboflowStubServer(ThreadingHTTPServer):
+    """
+    HTTP server answering `POST /<model>/<version>?confidence=..&overlap=..` with a base64
+    image body, like the hosted API. Unknown images get an empty prediction list.
+
+    Parameters:
+        recordings (dict): (model, version) -> {cache key: answer}, see `load_recordings`.
+        latency (float): Seconds to sleep before every answer to mimic the remote API.
+        fail_every (int): Answer every n-th request with a 503, to exercise the retries.
+        port (int): Port to listen on, 0 picks a free one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, recordings, latency: float = 0.0, fail_every: int = 0, port: int = 0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.recordings = {(model, str(version)): answers for (model, version), answers in recordings.items()}
+        self.latency = latency
+        self.fail_every = fail_every
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        server = self.server
+        with server._count_lock:
+            server.request_count += 1
+            count = server.request_count
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_every and count % server.fail_every == 0:
+            return self._send(503, {'error': 'unavailable'})
+
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) != 2:
+            return self._send(404, {'error': 'not found'})
+        query = parse_qs(url.query)
+        key = (f'{bytes_hash(base64.b64decode(body))}'
+               f'-c{query.get("confidence", ["50"])[0]}-o{query.get("overlap", ["50"])[0]}')
+        answers = server.recordings.get((parts[0], parts[1]), {})
+        return self._send(200, answers.get(key, {'predictions': []}))
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from evaluation import LICENSE_MODELS
+
+    parser = argparse.ArgumentParser(description='Replay recorded Roboflow predictions on localhost.')
+    parser.add_argument('--models', nargs='+', default=LICENSE_MODELS)
+    parser.add_argument('--version', type=int, default=1)
+    parser.add_argument('--cache', default=CACHE_DIRECTORY, help='Prediction cache the recordings are read from')
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    stub = RoboflowStubServer(load_recordings(args.models, args.version, args.cache), latency=args.latency,
+                              port=args.port)
+    print(f'Serving Roboflow stub on {stub.base_url}')
+    stub.serve_forever()
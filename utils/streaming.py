@@ -0,0 +1,301 @@
+"""
+Streaming license plate recognition for video files and camera feeds.
+
+Frames flow through three overlapping stages connected by bounded queues:
+decoding, detection + tracking, and OCR + SUMAL lookup. An IoU tracker keeps
+the identity of every plate across frames so each vehicle is read and looked
+up once instead of on every frame.
+"""
+
+import queue
+import threading
+
+import cv2
+
+from boxes import calculate_iou, to_top_left
+from inference import crop_plate, extract_boxes
+
+_SENTINEL = object()
+
+
+def read_video_frames(source, frame_skip: int = 1):
+    """
+    Yield frames from a video file or a camera.
+
+    Parameters:
+        source (str | int): Path of the video file, stream URL or camera index.
+        frame_skip (int): Only every `frame_skip`-th frame is yielded.
+
+    Returns:
+        generator: (frame_index, frame) tuples, frame being a BGR array.
+    """
+    capture = cv2.VideoCapture(source)
+    index = 0
+    try:
+        while True:
+            # grab() avoids decoding the frames that are skipped
+            if not capture.grab():
+                break
+            if index % frame_skip == 0:
+                ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                yield index, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+class Track:
+    """
+    A license plate followed across consecutive frames.
+    """
+
+    def __init__(self, track_id, box, frame_index):
+        self.track_id = track_id
+        self.box = box
+        self.hits = 1
+        self.last_seen = frame_index
+        self.submitted = False
+
+
+class PlateTracker:
+    """
+    Greedy IoU tracker that assigns a stable id to every physical plate.
+
+    Parameters:
+        iou_threshold (float): Minimum IoU for a detection to continue a track.
+        max_age (int): Number of frames a track survives without a matching detection.
+        min_hits (int): Number of detections needed before a track is sent to OCR.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_age: int = 25, min_hits: int = 2):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.tracks = []
+        # (track, box) of every detection of the last frame, in detection order
+        self.matches = []
+        # Tracks dropped by the last update
+        self.expired = []
+        self._next_id = 0
+
+    def update(self, boxes, frame_index):
+        """
+        Match the detections of a frame against the live tracks.
+
+        Parameters:
+            boxes (list): (x, y, w, h) boxes of the frame, x, y being the center.
+            frame_index (int): Index of the frame in the stream.
+
+        Returns:
+            list: (track, box) pairs for tracks that just became ready for OCR.
+        """
+        self.expired = [track for track in self.tracks if frame_index - track.last_seen > self.max_age]
+        self.tracks = [track for track in self.tracks if frame_index - track.last_seen <= self.max_age]
+
+        ready = []
+        self.matches = []
+        unmatched = list(self.tracks)
+        for box in boxes:
+            best_track = None
+            best_iou = self.iou_threshold
+            for track in unmatched:
+                iou = calculate_iou(to_top_left(box), to_top_left(track.box))
+                if iou >= best_iou:
+                    best_track, best_iou = track, iou
+
+            if best_track is None:
+                best_track = Track(self._next_id, box, frame_index)
+                self._next_id += 1
+                self.tracks.append(best_track)
+            else:
+                unmatched.remove(best_track)
+                best_track.box = box
+                best_track.hits += 1
+                best_track.last_seen = frame_index
+            self.matches.append((best_track, box))
+
+            if not best_track.submitted and best_track.hits >= self.min_hits:
+                best_track.submitted = True
+                ready.append((best_track, box))
+
+        return ready
+
+
+def _put(target, item, stop):
+    # Blocking put that still notices when the consumer went away
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def stream_plates(inference, frames, batch_size: int = 4, queue_size: int = 8,
+                  drop_frames: bool = False, lookup: bool = True, tracker=None, selector=None):
+    """
+    Recognize license plates on a stream of frames, once per vehicle.
+
+    Parameters:
+        inference (Inference): Loaded detection and OCR models.
+        frames (iterable): (frame_index, frame) tuples, e.g. from `read_video_frames`.
+        batch_size (int): Maximum number of frames per detector call.
+        queue_size (int): Capacity of the queues between the stages.
+        drop_frames (bool): Drop incoming frames while the detector is busy instead of
+            waiting for it. Use it for live cameras so the stream never lags behind.
+        lookup (bool): Look up the SUMAL legal notices of every new plate.
+        tracker (PlateTracker): Tracker to use, a default one is created when omitted.
+        selector (BestCropSelector): When given, every vehicle is read once from its best
+            crop across frames, and vehicles without a crop passing the quality gate are not
+            read at all. Otherwise the crop of the frame where the track is confirmed is read.
+
+    Returns:
+        generator: One dict per vehicle with the frame index, track id, box, license plate
+        and legal notices.
+    """
+    tracker = tracker or PlateTracker()
+    frame_queue = queue.Queue(maxsize=queue_size)
+    crop_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def read():
+        try:
+            for item in frames:
+                if stop.is_set():
+                    break
+                if drop_frames:
+                    try:
+                        frame_queue.put_nowait(item)
+                    except queue.Full:
+                        pass
+                elif not _put(frame_queue, item, stop):
+                    break
+        except Exception as error:
+            _put(result_queue, error, stop)
+        finally:
+            _put(frame_queue, _SENTINEL, stop)
+
+    def detect():
+        try:
+            finished = False
+            while not finished and not stop.is_set():
+                batch = [frame_queue.get()]
+                while len(batch) < batch_size and batch[-1] is not _SENTINEL:
+                    try:
+                        batch.append(frame_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if batch[-1] is _SENTINEL:
+                    finished = True
+                    batch.pop()
+                if not batch:
+                    continue
+
+                images = [frame for _, frame in batch]
+                detections = inference.BB_MODEL.predict(images, conf=0.4, iou=0.45)
+                for (frame_index, frame), frame_detections in zip(batch, detections):
+                    ready = tracker.update(extract_boxes(frame_detections), frame_index)
+                    if selector is None:
+                        items = [(frame_index, track.track_id, box, crop_plate(frame, box)) for track, box in ready]
+                    else:
+                        items = selector.update(frame, frame_index, tracker.matches, frame_detections[:, 4].tolist(),
+                                                tracker.expired)
+                    for item in items:
+                        if not _put(crop_queue, item, stop):
+                            return
+            if selector is not None and not stop.is_set():
+                for item in selector.flush():
+                    if not _put(crop_queue, item, stop):
+                        return
+        except Exception as error:
+            _put(result_queue, error, stop)
+        finally:
+            _put(crop_queue, _SENTINEL, stop)
+
+    def recognize():
+        try:
+            finished = False
+            while not finished and not stop.is_set():
+                # Every crop waiting in the queue is read in a single OCR call
+                items = [crop_queue.get()]
+                while len(items) <= queue_size and items[-1] is not _SENTINEL:
+                    try:
+                        items.append(crop_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if items[-1] is _SENTINEL:
+                    finished = True
+                    items.pop()
+                if not items:
+                    continue
+
+                with inference.metrics.stage('ocr'):
+                    texts = inference.ocr.read([crop for _, _, _, crop in items])
+                for (frame_index, track_id, box, _), text in zip(items, texts):
+                    license_plate = inference.resolve_plate(text)
+                    legal_notices = inference.scrape(license_plate) if lookup and license_plate else None
+                    result = {'Frame': frame_index, 'Track': track_id, 'Box': box,
+                              'License Plate': license_plate, 'Legal Notices': legal_notices}
+                    if not _put(result_queue, result, stop):
+                        return
+        except Exception as error:
+            _put(result_queue, error, stop)
+        finally:
+            _put(result_queue, _SENTINEL, stop)
+
+    workers = [threading.Thread(target=target, daemon=True) for target in (read, detect, recognize)]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while True:
+            item = result_queue.get()
+            if item is _SENTINEL:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        for pending in (frame_queue, crop_queue):
+            # Unblock stages waiting on an empty queue so they can see the stop flag
+            try:
+                pending.put_nowait(_SENTINEL)
+            except queue.Full:
+                pass
+
+
+if __name__ == '__main__':
+    import argparse
+    from detector_backends import MODEL_VARIANTS
+    from inference import Inference
+
+    parser = argparse.ArgumentParser(description='Read license plates from a video file or camera.')
+    parser.add_argument('source', help='Video file, stream URL or camera index')
+    parser.add_argument('--model', required=True, help='Path to the license plate detection model')
+    parser.add_argument('--ocr-model', default='microsoft/trocr-base-printed')
+    parser.add_argument('--frame-skip', type=int, default=2)
+    parser.add_argument('--batch-size', type=int, default=4)
+    parser.add_argument('--backend', default='auto', choices=['auto', 'tflite', 'onnx', 'ultralytics'])
+    parser.add_argument('--variant', default=None, choices=MODEL_VARIANTS,
+                        help='Precision of the detection models, e.g. int8 (see quantization.py)')
+    parser.add_argument('--live', action='store_true', help='Drop frames instead of lagging behind')
+    parser.add_argument('--best-of', type=int, default=5,
+                        help='Frames a vehicle is followed to pick its sharpest crop, 0 reads the first one')
+    args = parser.parse_args()
+
+    source = int(args.source) if args.source.isdigit() else args.source
+    inf = Inference(rf_bb_model=args.model, ocr_model=args.ocr_model, backend=args.backend,
+                    model_variant=args.variant)
+    crop_selector = None
+    if args.best_of:
+        from plate_quality import BestCropSelector
+
+        crop_selector = BestCropSelector(window=args.best_of)
+    for vehicle in stream_plates(inf, read_video_frames(source, args.frame_skip),
+                                 batch_size=args.batch_size, drop_frames=args.live, selector=crop_selector):
+        print(vehicle)
@@ -0,0 +1,235 @@
+"""
+Client for the SUMAL 2.0 legal notice API (inspectorulpadurii.ro).
+
+Lookups go through a pooled `requests.Session`, the per-notice detail requests
+are fanned out concurrently and both hops are kept in a bounded LRU cache with
+a time-to-live, optionally persisted to disk so it survives restarts.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from instrumentation import NULL_METRICS
+
+BASE_URL = 'https://inspectorulpadurii.ro/api/aviz'
+
+# Answers retried with backoff, like failed connections
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_MISSING = object()
+
+
+def get_date(val):
+    timestamp = val / 1000 + 7200  # converting milliseconds to seconds
+    date = datetime.utcfromtimestamp(timestamp)
+    return date.strftime('%d/%m/%Y %H:%M:%S')
+
+
+def parse_notice(code, data):
+    """
+    Extract the volume and validity of a legal notice from its API answer.
+
+    Parameters:
+        code (str): Code of the legal notice.
+        data (dict): JSON answer of `<base_url>/<code>`.
+
+    Returns:
+        dict: Code, total volume, formatted validity and the raw validity timestamps in ms.
+    """
+    valid_from = data['valabilitate']['emitere']
+    valid_to = data['valabilitate']['finalizare']
+    return {'Code': code, 'Volume': data['volum']['total'],
+            'Validity': f'{get_date(valid_from)} - {get_date(valid_to)}',
+            'Valid From': valid_from, 'Valid To': valid_to}
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after `ttl` seconds.
+
+    Parameters:
+        maxsize (int): Maximum number of entries, the least recently used one is evicted first.
+        ttl (float): Default lifetime of an entry in seconds.
+        path (str): Optional JSON file the cache is loaded from and saved to.
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 6 * 3600, path: str = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > time.time():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not _MISSING:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
+
+    def load(self):
+        """
+        Load the non-expired entries of `path` into the cache.
+        """
+        with open(self.path, 'r') as file:
+            entries = json.load(file)
+        now = time.time()
+        with self._lock:
+            for key, expires, value in entries[-self.maxsize:]:
+                if expires > now:
+                    self._data[key] = (expires, value)
+
+    def save(self):
+        """
+        Write the cache to `path`, atomically replacing the previous file.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            entries = [[key, expires, value] for key, (expires, value) in self._data.items()]
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(entries, file)
+        os.replace(tmp_path, self.path)
+
+
+class SumalClient:
+    """
+    Looks up the legal notices (avize) of a license plate.
+
+    Parameters:
+        base_url (str): Root of the aviz API, point it to a local stub server for testing.
+        timeout (float): Timeout in seconds of every HTTP request.
+        max_workers (int): Number of concurrent detail requests and pooled connections.
+        cache (TTLCache): Cache shared by the plate and notice lookups.
+        retries (int): Number of retries for failed connections and 5xx responses.
+        negative_ttl (float): Lifetime of cached "no legal notice" answers, kept short
+            because a notice may be issued for the truck at any moment.
+        metrics (Metrics): Receives the HTTP latencies, request and retry counts, see
+            `instrumentation`.
+    """
+
+    def __init__(self, base_url: str = BASE_URL, timeout: float = 10, max_workers: int = 8,
+                 cache: TTLCache = None, retries: int = 2, negative_ttl: float = 300, metrics=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.cache = cache if cache is not None else TTLCache()
+        self.negative_ttl = negative_ttl
+        self.metrics = metrics or NULL_METRICS
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers,
+                              max_retries=Retry(total=retries, backoff_factor=0.3,
+                                                status_forcelist=RETRY_STATUSES))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _get_json(self, url, params=None):
+        start_time = time.perf_counter()
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        self.metrics.observe('sumal_http_seconds', time.perf_counter() - start_time)
+        self.metrics.increment('sumal_http_requests_total', labels={'status': response.status_code})
+        retries = getattr(response.raw, 'retries', None)
+        if retries is not None and retries.history:
+            self.metrics.increment('sumal_http_retries_total', len(retries.history))
+        response.raise_for_status()
+        return response.json()
+
+    def codes(self, license_plate):
+        """
+        Get the legal notice codes issued for a license plate.
+
+        Parameters:
+            license_plate (str): Cleaned license plate number.
+
+        Returns:
+            list: Codes of the legal notices (codAviz).
+        """
+        key = f'plate:{license_plate}'
+        codes = self.cache.get(key, _MISSING)
+        if codes is _MISSING:
+            codes = self._get_json(f'{self.base_url}/locations', params={'nr': license_plate})['codAviz'] or []
+            self.cache.set(key, codes, ttl=None if codes else self.negative_ttl)
+        return codes
+
+    def notice(self, code):
+        """
+        Get the volume and validity of a legal notice.
+
+        Parameters:
+            code (str): Code of the legal notice.
+
+        Returns:
+            dict: See `parse_notice`.
+        """
+        key = f'aviz:{code}'
+        notice = self.cache.get(key, _MISSING)
+        if notice is _MISSING:
+            notice = parse_notice(code, self._get_json(f'{self.base_url}/{code}'))
+            self.cache.set(key, notice)
+        return notice
+
+    def lookup(self, license_plate):
+        """
+        Get every legal notice of a license plate, fetching the notice details concurrently.
+
+        Parameters:
+            license_plate (str): Cleaned license plate number.
+
+        Returns:
+            list: One dict per legal notice, see `notice`.
+        """
+        return list(self._executor.map(self.notice, self.codes(license_plate)))
+
+    @property
+    def stats(self):
+        return self.cache.stats
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.session.close()
+        self.cache.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,110 @@
+"""
+Local stand-in for the SUMAL aviz API, used to test and benchmark the lookup
+client without network access.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+API_PREFIX = '/api/aviz'
+
+
+def make_notice(code, volume, valid_from_ms, valid_to_ms):
+    """
+    Build a legal notice in the shape returned by the SUMAL API.
+    """
+    return {'codAviz': code, 'volum': {'total': volume},
+            'valabilitate': {'emitere': valid_from_ms, 'finalizare': valid_to_ms}}
+
+
+class SumalStubServer(ThreadingHTTPServer):
+    """
+    HTTP server answering `/api/aviz/locations?nr=<plate>` and `/api/aviz/<code>`.
+
+    Parameters:
+        plates (dict): License plate -> list of legal notice codes.
+        notices (dict): Legal notice code -> notice, see `make_notice`.
+        latency (float): Seconds to sleep before every answer to mimic the remote API.
+        fail_every (int): Answer every n-th request with a 503, to exercise the retries.
+        port (int): Port to listen on, 0 picks a free one.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, plates, notices, latency: float = 0.0, fail_every: int = 0, port: int = 0):
+        super().__init__(('127.0.0.1', port), _Handler)
+        self.plates = plates
+        self.notices = notices
+        self.latency = latency
+        self.fail_every = fail_every
+        self.request_count = 0
+        self._count_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}{API_PREFIX}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        with server._count_lock:
+            server.request_count += 1
+            count = server.request_count
+        if server.latency:
+            time.sleep(server.latency)
+        if server.fail_every and count % server.fail_every == 0:
+            return self._send(503, {'error': 'unavailable'})
+
+        url = urlparse(self.path)
+        if not url.path.startswith(API_PREFIX + '/'):
+            return self._send(404, {'error': 'not found'})
+
+        resource = url.path[len(API_PREFIX) + 1:]
+        if resource == 'locations':
+            plate = parse_qs(url.query).get('nr', [''])[0]
+            return self._send(200, {'codAviz': server.plates.get(plate, [])})
+        if resource in server.notices:
+            return self._send(200, server.notices[resource])
+        return self._send(404, {'error': 'not found'})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    now = int(time.time() * 1000)
+    stub = SumalStubServer(plates={'SB40DAP': ['A1', 'A2']},
+                           notices={'A1': make_notice('A1', 24.5, now, now + 86400000),
+                                    'A2': make_notice('A2', 31.0, now, now + 86400000)},
+                           port=8765)
+    print(f'Serving SUMAL stub on {stub.base_url}')
+    stub.serve_forever()
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+from async_inference import AsyncInference, AsyncSumalClient
+from instrumentation import Metrics
+from sumal_stub import SumalStubServer, make_notice
+
+LATENCY = 0.2
+CODES = ['A1', 'A2', 'A3']
+
+
+def stub_server(**kwargs):
+    now = int(time.time() * 1000)
+    notices = {code: make_notice(code, 10.0 + index, now, now + 86400000) for index, code in enumerate(CODES)}
+    return SumalStubServer({'SB40DAP': CODES}, notices, **kwargs)
+
+
+def test_concurrent_lookups_of_a_plate_share_the_requests():
+    async def main(base_url):
+        client = AsyncSumalClient(base_url)
+        try:
+            return await asyncio.gather(client.lookup('SB40DAP'), client.lookup('SB40DAP'))
+        finally:
+            await client.close()
+
+    with stub_server(latency=LATENCY) as stub:
+        first, second = asyncio.run(main(stub.base_url))
+        assert first == second
+        assert [notice['Code'] for notice in first] == CODES
+        assert stub.request_count == 1 + len(CODES)
+
+
+def test_a_cancelled_waiter_does_not_start_a_second_fetch():
+    async def main(base_url):
+        client = AsyncSumalClient(base_url)
+        try:
+            cancelled = asyncio.ensure_future(client.codes('SB40DAP'))
+            await asyncio.sleep(LATENCY / 4)
+            cancelled.cancel()
+            await asyncio.sleep(0)
+            return await client.codes('SB40DAP')
+        finally:
+            await client.close()
+
+    with stub_server(latency=LATENCY) as stub:
+        assert asyncio.run(main(stub.base_url)) == CODES
+        assert stub.request_count == 1
+
+
+def test_failed_requests_are_retried_and_measured():
+    metrics = Metrics()
+
+    async def main(base_url):
+        client = AsyncSumalClient(base_url, backoff_factor=0.01, metrics=metrics)
+        try:
+            return await client.lookup('SB40DAP')
+        finally:
+            await client.close()
+
+    # Every second request reaching the stub gets a 503
+    with stub_server(fail_every=2) as stub:
+        notices = asyncio.run(main(stub.base_url))
+    assert [notice['Code'] for notice in notices] == CODES
+    assert metrics.counters[('sumal_http_requests_total', (('status', 200),))] == 1 + len(CODES)
+    assert metrics.counters[('sumal_http_retries_total', ())] == stub.request_count - 1 - len(CODES)
+    assert metrics.histograms[('sumal_http_seconds', ())]['count'] == 1 + len(CODES)
+
+
+def test_exhausted_retries_raise():
+    async def main(base_url):
+        client = AsyncSumalClient(base_url, retries=1, backoff_factor=0.01)
+        try:
+            return await client.codes('SB40DAP')
+        finally:
+            await client.close()
+
+    with stub_server(fail_every=1) as stub:
+        with pytest.raises(Exception, match='503'):
+            asyncio.run(main(stub.base_url))
+        assert stub.request_count == 2
+
+
+class FakeInference:
+    """
+    Reads the image itself as the plate text, recording the lookups like `Inference`.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.lookups = []
+
+    def predict_batch(self, images, batch_size):
+        return images
+
+    def resolve_plate(self, plate):
+        return plate
+
+    def record_lookup(self, license_plate, notices):
+        self.lookups.append((license_plate, len(notices)))
+
+
+def test_async_inference_looks_up_the_plate():
+    metrics = Metrics()
+    inference = FakeInference(metrics)
+
+    async def main(base_url):
+        async_inference = AsyncInference(inference, AsyncSumalClient(base_url, metrics=metrics))
+        try:
+            return await asyncio.gather(async_inference.inference('SB40DAP'), async_inference.inference(None))
+        finally:
+            await async_inference.close()
+
+    with stub_server() as stub:
+        (plate, notices), (no_plate, no_notices) = asyncio.run(main(stub.base_url))
+    assert plate == 'SB40DAP' and len(notices) == len(CODES)
+    assert no_plate is None and no_notices is None
+    assert inference.lookups == [('SB40DAP', len(CODES))]
+    assert metrics.histograms[('stage_seconds', (('stage', 'sumal'),))]['count'] == 1
+    assert metrics.histograms[('request_seconds', ())]['count'] == 2
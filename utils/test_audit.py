@@ -0,0 +1,43 @@
+import os
+
+import pyarrow.parquet as pq
+
+from audit import COLUMNS, run_audit
+
+
+class FakeAuditor:
+    """
+    Audits photos without models, every column but the path left empty.
+    """
+
+    def __init__(self):
+        self.audited = []
+
+    def audit(self, inputs):
+        self.audited.extend(path for path, _ in inputs)
+        columns = {name: [None] * len(inputs) for name in COLUMNS}
+        columns['path'] = [path for path, _ in inputs]
+        return columns
+
+
+def add_photos(directory, start, count):
+    for index in range(start, start + count):
+        (directory / f'{index:03d}.jpg').write_bytes(b'photo')
+
+
+def test_a_grown_source_resumes_with_the_new_photos(tmp_path):
+    source, output = tmp_path / 'photos', tmp_path / 'report'
+    source.mkdir()
+    add_photos(source, 0, 5)
+    first = FakeAuditor()
+    assert run_audit(str(source), str(output), first, chunk_size=2)['chunks'] == 3
+
+    add_photos(source, 5, 3)
+    second = FakeAuditor()
+    result = run_audit(str(source), str(output), second, chunk_size=2)
+    assert [os.path.basename(path) for path in second.audited] == ['005.jpg', '006.jpg', '007.jpg']
+    assert (result['audited'], result['skipped_photos'], result['chunks'], result['skipped_chunks']) == (3, 5, 2, 3)
+
+    paths = pq.read_table(str(output), columns=['path']).column('path').to_pylist()
+    assert sorted(paths) == sorted(str(path) for path in source.iterdir())
+    assert sorted(os.listdir(output)) == [f'part-{index:05d}.parquet' for index in range(5)]
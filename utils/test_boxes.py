@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from boxes import centered_boxes, most_confident, plate_iou
+
+
+def test_centered_boxes_of_detector_output():
+    detections = np.array([[90, 80, 130, 120, 0.9, 0], [10, 10, 20, 30, 0.2, 0]], dtype=np.float32)
+    assert centered_boxes(detections) == [[110, 100, 40, 40, pytest.approx(0.9)], [15, 20, 10, 20, pytest.approx(0.2)]]
+
+
+def test_plate_iou_scores_the_most_confident_box():
+    boxes = [(400, 400, 10, 10, 0.1), (110, 100, 40, 40, 0.9), (100, 100, 20, 20, 0.5)]
+    assert most_confident(boxes) == (110, 100, 40, 40)
+    assert plate_iou(boxes, [(100, 100, 20, 20)]) == pytest.approx(0.25, abs=1e-4)
+
+
+def test_plate_iou_of_empty_sides_is_zero():
+    assert most_confident([]) is None
+    assert plate_iou([], [(100, 100, 20, 20)]) == 0
+    assert plate_iou([(100, 100, 20, 20, 0.9)], []) == 0
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import detector_backends
+from detector_backends import TFLiteBackend
+
+
+class FakeInterpreter:
+    """
+    TFLite interpreter of a model without detections, recording the batch of every call.
+    """
+
+    def __init__(self, batch, resizable, calls):
+        self.shape = np.array([batch, 32, 32, 3])
+        self.resizable = resizable
+        self.calls = calls
+
+    def get_input_details(self):
+        return [{'index': 0, 'shape': self.shape, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def get_output_details(self):
+        return [{'index': 1, 'dtype': np.float32, 'quantization': (0.0, 0)}]
+
+    def resize_tensor_input(self, index, shape):
+        self.shape = np.array(shape)
+
+    def allocate_tensors(self):
+        if not self.resizable and self.shape[0] != self.calls['exported']:
+            raise RuntimeError('the model has a fixed batch')
+        self.calls['allocations'] += 1
+
+    def set_tensor(self, index, tensor):
+        assert tensor.shape[0] == self.shape[0]
+
+    def invoke(self):
+        self.calls['invoked'].append(int(self.shape[0]))
+
+    def get_tensor(self, index):
+        return np.zeros((self.shape[0], 5, 10), dtype=np.float32)
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    def make(batch=1, resizable=True):
+        calls = {'exported': batch, 'allocations': 0, 'invoked': [], 'loads': 0}
+
+        def interpreter(model_path, num_threads):
+            calls['loads'] += 1
+            return FakeInterpreter(batch, resizable, calls)
+
+        monkeypatch.setattr(detector_backends, '_tflite_interpreter', interpreter)
+        return TFLiteBackend('model.tflite', imgsz=32, num_threads=1), calls
+    return make
+
+
+def frames(count):
+    return [np.zeros((48, 64, 3), dtype=np.uint8)] * count
+
+
+def test_batches_run_on_one_interpreter_per_size(backend):
+    tflite, calls = backend()
+    assert len(tflite.predict(frames(8))) == 8
+    assert len(tflite.predict(frames(1))) == 1
+    assert len(tflite.predict(frames(7))) == 7
+    assert len(tflite.predict(frames(8))) == 8
+    # A single frame never runs the batch of 8, and sizes are loaded once
+    assert calls['invoked'] == [8, 1, 4, 2, 1, 8]
+    assert calls['loads'] == 4
+
+
+def test_a_fixed_batch_model_is_resized_once(backend):
+    tflite, calls = backend(batch=1, resizable=False)
+    tflite.predict(frames(4))
+    tflite.predict(frames(4))
+    assert calls['invoked'] == [1] * 8
+    assert calls['loads'] == 2
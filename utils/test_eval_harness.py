@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+from eval_harness import PredictionCache, RoboflowClient, _run_sharded, bytes_hash, evaluate_roboflow
+from roboflow_stub import RoboflowStubServer
+
+MODEL = 'license-plate'
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for index in range(4):
+        path = tmp_path / f'{index:03d}.jpg'
+        path.write_bytes(f'image {index}'.encode())
+        paths.append(str(path))
+    return paths
+
+
+def recordings(paths, prediction):
+    answers = {}
+    for path in paths:
+        with open(path, 'rb') as file:
+            answers[f'{bytes_hash(file.read())}-c50-o50'] = {'predictions': [prediction]}
+    return {(MODEL, 1): answers}
+
+
+def test_failed_requests_are_retried_and_answers_cached(images, tmp_path):
+    prediction = {'x': 110, 'y': 100, 'width': 40, 'height': 40, 'confidence': 0.9}
+    with RoboflowStubServer(recordings(images, prediction), fail_every=2) as stub:
+        with RoboflowClient(base_url=stub.base_url, max_workers=1, rate=0,
+                            cache_root=str(tmp_path / 'cache')) as client:
+            answers = client.predict_many(MODEL, 1, images)
+            assert answers == [{'predictions': [prediction]}] * len(images)
+            # Every second request reaching the stub gets a 503: the first image goes through,
+            # the three others are retried once each
+            assert client.stats['retries'] == 3
+            assert client.stats['requests'] == len(images)
+            assert stub.request_count == 7
+            requests = stub.request_count
+
+            assert client.predict_many(MODEL, 1, images) == answers
+            assert client.stats['cached'] == len(images)
+            assert stub.request_count == requests
+
+
+
+def test_answers_are_cached_per_api(images, tmp_path):
+    prediction = {'x': 110, 'y': 100, 'width': 40, 'height': 40, 'confidence': 0.9}
+    cache_root = str(tmp_path / 'cache')
+    with RoboflowStubServer(recordings(images, prediction)) as stub:
+        with RoboflowClient(base_url=stub.base_url, rate=0, cache_root=cache_root) as client:
+            client.predict_many(MODEL, 1, images)
+    # Another API (here an empty stub) must not be answered from the first one's cache
+    with RoboflowStubServer({}) as stub:
+        with RoboflowClient(base_url=stub.base_url, rate=0, cache_root=cache_root) as client:
+            assert client.predict_many(MODEL, 1, images) == [{'predictions': []}] * len(images)
+            assert client.stats['cached'] == 0
+
+def test_roboflow_iou_uses_centered_boxes_and_the_most_confident_prediction(images, tmp_path):
+    prediction = {'x': 110, 'y': 100, 'width': 40, 'height': 40, 'confidence': 0.9}
+    answers = recordings(images, prediction)
+    # A less confident prediction listed first must not be scored
+    for answer in answers[(MODEL, 1)].values():
+        answer['predictions'].insert(0, {'x': 400, 'y': 400, 'width': 10, 'height': 10, 'confidence': 0.1})
+    ground_truth = {os.path.splitext(os.path.basename(path))[0]: [(100, 100, 20, 20)] for path in images}
+
+    with RoboflowStubServer(answers) as stub:
+        with RoboflowClient(base_url=stub.base_url, rate=0, cache_root=None) as client:
+            (model, mean_iou, detected, _, _), = evaluate_roboflow(os.path.dirname(images[0]), ground_truth,
+                                                                   [MODEL], client=client)
+    assert model == MODEL
+    assert mean_iou == pytest.approx(0.25, abs=1e-4)
+    assert detected == len(images)
+
+
+def test_prediction_cache_follows_the_model_file(tmp_path):
+    model_path = tmp_path / 'best_int8.tflite'
+    model_path.write_bytes(b'first build')
+    first = PredictionCache(str(tmp_path), str(model_path))
+    first.set('image', [[1, 2, 3, 4, 0.5]])
+    assert PredictionCache(str(tmp_path), str(model_path)).get('image') == [[1, 2, 3, 4, 0.5]]
+
+    model_path.write_bytes(b'second build')
+    assert PredictionCache(str(tmp_path), str(model_path)).get('image') is None
+
+
+def threads_shard(model, directory, filenames, cache_root):
+    return {filename: os.environ['OMP_NUM_THREADS'] for filename in filenames}, 0.0
+
+
+def test_sharded_workers_split_the_cpus():
+    filenames = [f'{index:03d}.jpg' for index in range(8)]
+    predictions, _ = _run_sharded(threads_shard, ['a', 'b'], '', filenames, workers=2, cache_root=None)
+    threads = str(max(1, (os.cpu_count() or 1) // 2))
+    assert predictions == {model: dict.fromkeys(filenames, threads) for model in ('a', 'b')}
@@ -0,0 +1,99 @@
+import http.client
+import json
+import os
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+import pytest
+
+from inference_server import InferenceServer, serve_http
+
+
+class FakeInference:
+    """
+    Reads the first pixel of every frame, a frame starting with 255 kills the worker.
+    """
+
+    def predict_batch(self, frames, batch_size):
+        if any(frame[0, 0, 0] == 255 for frame in frames):
+            os._exit(1)
+        return [f"{os.environ['OMP_NUM_THREADS']}:{frame[0, 0, 0]}" for frame in frames]
+
+
+def frame(value):
+    return np.full((4, 4, 3), value, dtype=np.uint8)
+
+
+def test_frames_are_read_by_the_workers_with_their_share_of_threads():
+    with InferenceServer(FakeInference, workers=2, max_frame_shape=(4, 4, 3)) as server:
+        futures = [server.submit(frame(value)) for value in range(20)]
+        threads = max(1, (os.cpu_count() or 1) // 2)
+        assert [future.result(timeout=30) for future in futures] == [f'{threads}:{value}' for value in range(20)]
+        assert server.stats['requests'] == 20
+
+
+def test_a_dead_worker_fails_the_requests_and_the_ring_is_still_freed():
+    server = InferenceServer(FakeInference, workers=2, max_frame_shape=(4, 4, 3))
+    ring_name = server._ring.name
+    with pytest.raises(RuntimeError, match='worker died'):
+        server.predict(frame(255), timeout=30)
+    with pytest.raises(RuntimeError):
+        server.submit(frame(1))
+
+    server.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=ring_name)
+
+
+def test_a_dead_worker_is_noticed_under_steady_load():
+    with InferenceServer(FakeInference, workers=2, max_frame_shape=(4, 4, 3), max_batch=1) as server:
+        dead = server.submit(frame(255))
+        deadline = time.monotonic() + 5
+        # The other worker keeps answering, so the result queue is never idle
+        while not dead.done() and time.monotonic() < deadline:
+            try:
+                server.submit(frame(1))
+            except RuntimeError:
+                break
+            time.sleep(0.01)
+        assert dead.done()
+        with pytest.raises(RuntimeError, match='worker died'):
+            dead.result()
+
+
+class StuckServer:
+    """
+    Inference server whose frames are never read.
+    """
+
+    workers = 1
+    stats = {}
+
+    def predict(self, frame, timeout=None):
+        return Future().result(timeout)
+
+
+def post(http_server, body, headers=None):
+    connection = http.client.HTTPConnection(*http_server.server_address, timeout=10)
+    connection.request('POST', '/predict', body=body, headers=headers or {})
+    response = connection.getresponse()
+    answer = response.status, json.loads(response.read())
+    connection.close()
+    return answer
+
+
+def test_http_rejects_bad_bodies_and_times_out():
+    http_server = serve_http(StuckServer(), port=0, timeout=0.2)
+    try:
+        assert post(http_server, b'')[0] == 400
+        assert post(http_server, b'not an image')[0] == 400
+        _, image = cv2.imencode('.png', frame(1))
+        status, answer = post(http_server, image.tobytes())
+        assert status == 504
+        assert '0.2 seconds' in answer['error']
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
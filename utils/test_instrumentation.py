@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+from instrumentation import BATCH_BUCKETS, NULL_METRICS, Metrics, PrometheusSink, SamplingProfiler, histogram_quantile
+
+
+def test_histogram_buckets_are_upper_bounds():
+    metrics = Metrics()
+    for value in (1, 2, 3, 8, 500):
+        metrics.observe('batch_size', value, buckets=BATCH_BUCKETS)
+    histogram = metrics.histograms[('batch_size', ())]
+    # A value equal to a bound falls in that bucket, values over the last one in +Inf
+    assert histogram['counts'] == [1, 1, 1, 1, 0, 0, 0, 0, 1]
+    assert (histogram['count'], histogram['sum']) == (5, 514)
+
+    text = PrometheusSink.render(metrics)
+    assert 'plate_batch_size_bucket{le="4"} 3' in text
+    assert 'plate_batch_size_bucket{le="+Inf"} 5' in text
+    assert 'plate_batch_size_count 5' in text
+
+
+def test_histogram_quantile_interpolates_within_a_bucket():
+    metrics = Metrics()
+    for value in (0.5, 1.5, 1.5, 3.0):
+        metrics.observe('seconds', value, buckets=(1.0, 2.0, 4.0))
+    histogram = metrics.histograms[('seconds', ())]
+    assert histogram_quantile(histogram, 0.5) == pytest.approx(1.5)
+    assert histogram_quantile(histogram, 1.0) == pytest.approx(4.0)
+
+
+def test_stage_and_request_timers():
+    metrics = Metrics()
+    with metrics.request():
+        with metrics.stage('detect'):
+            time.sleep(0.02)
+        with metrics.stage('ocr'):
+            pass
+    detect = metrics.histograms[('stage_seconds', (('stage', 'detect'),))]
+    request = metrics.histograms[('request_seconds', ())]
+    assert detect['count'] == 1 and detect['sum'] >= 0.02
+    assert metrics.histograms[('stage_seconds', (('stage', 'ocr'),))]['count'] == 1
+    assert request['sum'] >= detect['sum']
+    # Without a profiler no request is counted as slow
+    assert ('slow_requests_total', ()) not in metrics.counters
+
+
+def test_counters_and_gauges():
+    metrics = Metrics()
+    metrics.increment('http_requests_total', labels={'status': 200})
+    metrics.increment('http_requests_total', 2, labels={'status': 200})
+    metrics.gauge('cache', lambda: {'hits': 3, 'misses': 1})
+    assert metrics.counters[('http_requests_total', (('status', 200),))] == 3
+    assert metrics.read_gauges() == {('cache', (('key', 'hits'),)): 3, ('cache', (('key', 'misses'),)): 1}
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def test_only_slow_requests_are_profiled(tmp_path):
+    directory = str(tmp_path / 'slow')
+    metrics = Metrics(profiler=SamplingProfiler(threshold=0.1, interval=0.002, output_directory=directory))
+    with metrics.request():
+        busy(0.01)
+    assert not os.path.exists(directory)
+
+    with metrics.request():
+        busy(0.2)
+    assert metrics.counters[('slow_requests_total', ())] == 1
+    filename, = os.listdir(directory)
+    with open(os.path.join(directory, filename)) as file:
+        stacks = file.read()
+    assert 'test_instrumentation.py:busy' in stacks
+
+
+def test_null_metrics_record_nothing():
+    with NULL_METRICS.stage('detect'), NULL_METRICS.request():
+        NULL_METRICS.observe('batch_size', 1)
+        NULL_METRICS.increment('requests_total')
+    assert NULL_METRICS.stage('ocr') is NULL_METRICS.request()
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from label_index import LabelIndex
+
+
+def write_label(directory, name, lines):
+    (directory / f'{name}.txt').write_text('\n'.join(lines) + '\n')
+
+
+@pytest.fixture
+def labels(tmp_path):
+    directory = tmp_path / 'labels'
+    directory.mkdir()
+    write_label(directory, '001', ['0 0.5 0.5 0.25 0.125', 'SB 40 DAP'])
+    write_label(directory, '002', ['0 0.25 0.25 0.1 0.1', '0 0.75 0.75 0.2 0.2', 'CJ12ABC'])
+    return directory
+
+
+def test_build_reads_boxes_and_text(labels, tmp_path):
+    index = LabelIndex.build(str(labels), str(tmp_path / 'index'))
+    assert index.names == ['001', '002']
+    assert index.boxes_xywh('001').tolist() == [[320, 320, 160, 80]]
+    assert len(index.boxes_of('002')) == 2
+    assert index.text('001') == 'SB 40 DAP'
+
+
+def test_refresh_only_rewrites_the_index_when_labels_change(labels, tmp_path):
+    index_path = str(tmp_path / 'index')
+    LabelIndex.build(str(labels), index_path)
+    files_json = os.path.join(index_path, 'files.json')
+    written = os.stat(files_json).st_mtime_ns
+
+    LabelIndex.build(str(labels), index_path)
+    assert os.stat(files_json).st_mtime_ns == written
+
+    write_label(labels, '002', ['1 0.5 0.5 0.5 0.5', 'CJ99XYZ'])
+    write_label(labels, '003', ['0 0.1 0.1 0.1 0.1', 'B123XYZ'])
+    os.remove(labels / '001.txt')
+    index = LabelIndex.build(str(labels), index_path)
+
+    assert index.names == ['002', '003']
+    assert index.text('002') == 'CJ99XYZ'
+    assert index.boxes_of('002')['cls'].tolist() == [1]
+    assert index.text('003') == 'B123XYZ'
+    assert '001' not in index
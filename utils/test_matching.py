@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from matching import evaluate_dataset, greedy_match, iou_matrix, xywh_to_xyxy
+
+
+def test_iou_matrix_of_centered_boxes():
+    boxes = xywh_to_xyxy([[100, 100, 20, 20]])
+    others = xywh_to_xyxy([[110, 100, 40, 40], [100, 100, 20, 20], [300, 300, 10, 10]])
+    assert iou_matrix(boxes, others)[0] == pytest.approx([0.25, 1.0, 0.0], abs=1e-4)
+
+
+def test_greedy_match_gives_each_ground_truth_box_once():
+    ious = np.array([[0.9], [0.8]])
+    true_positives = greedy_match(ious, np.array([0.5, 0.9]), thresholds=[0.5])
+    # The more confident prediction takes the box, the other one is a false positive
+    assert true_positives[:, 0].tolist() == [False, True]
+
+
+def test_perfect_predictions_score_one():
+    ground_truths = {'a': xywh_to_xyxy([[100, 100, 20, 20]]), 'b': xywh_to_xyxy([[50, 50, 30, 10]])}
+    predictions = {name: (boxes, np.array([0.9])) for name, boxes in ground_truths.items()}
+    metrics = evaluate_dataset(predictions, ground_truths)
+    assert metrics['mAP50'] == pytest.approx(1.0)
+    assert metrics['mAP50_95'] == pytest.approx(1.0)
+    assert metrics['recall'] == pytest.approx(np.ones(10))
+
+
+def test_ap_of_a_ranked_false_positive():
+    ground_truths = {'a': xywh_to_xyxy([[100, 100, 20, 20]]), 'b': xywh_to_xyxy([[50, 50, 30, 10]])}
+    predictions = {
+        'a': (xywh_to_xyxy([[100, 100, 20, 20], [400, 400, 20, 20]]), np.array([0.8, 0.95])),
+        'b': (np.zeros((0, 4)), np.zeros(0)),
+    }
+    metrics = evaluate_dataset(predictions, ground_truths, thresholds=[0.5])
+    # Ranked: FP (precision 0), TP (precision 1/2 at recall 1/2); the second box is never found
+    assert metrics['precision'][0] == pytest.approx(0.5)
+    assert metrics['recall'][0] == pytest.approx(0.5)
+    assert metrics['ap'][0] == pytest.approx(0.5 * 51 / 101)
+
+
+def test_predictions_on_images_without_ground_truth_are_false_positives():
+    ground_truths = {'a': xywh_to_xyxy([[100, 100, 20, 20]])}
+    predictions = {
+        'a': (xywh_to_xyxy([[100, 100, 20, 20]]), np.array([0.9])),
+        'b': (xywh_to_xyxy([[50, 50, 30, 10]]), np.array([0.95])),
+    }
+    metrics = evaluate_dataset(predictions, ground_truths, thresholds=[0.5])
+    assert metrics['predictions'] == 2
+    assert metrics['precision'][0] == pytest.approx(0.5)
+    assert metrics['recall'][0] == pytest.approx(1.0)
+    assert metrics['ap'][0] == pytest.approx(0.5)
@@ -0,0 +1,106 @@
+import cv2
+import numpy as np
+
+from ocr_backends import CachedOCR, CascadeOCR, CropCache, OCRBackend, clean_text
+
+
+def plate_crop(text, shift=0):
+    # RGB crop of a plate, as cut by `inference.crop_plate`
+    image = np.full((60, 260, 3), 235, dtype=np.uint8)
+    cv2.putText(image, text, (12 + shift, 45), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (20, 20, 20), 3)
+    return image
+
+
+class FakeOCR(OCRBackend):
+    """
+    Reads crops through a lookup table, counting the crops it is asked to read.
+    """
+
+    name = 'fake'
+
+    def __init__(self, texts, confidences=None):
+        self.texts = texts
+        self.confidences = confidences or {}
+        self.reads = 0
+
+    def read_scored(self, images):
+        self.reads += len(images)
+        keys = [image if isinstance(image, str) else self.key(image) for image in images]
+        return [self.texts.get(key, '') for key in keys], [self.confidences.get(key, 1.0) for key in keys]
+
+    def read(self, images):
+        return self.read_scored(images)[0]
+
+    @staticmethod
+    def key(image):
+        return image.tobytes()
+
+
+def test_clean_text():
+    assert clean_text('sb 40-dap.') == 'SB40DAP'
+
+
+def test_cache_never_returns_the_text_of_another_plate():
+    plates = ['SB40DAP', 'SB40DAR', 'SB41DAP', 'SB40DAB', 'CB40DAP']
+    crops = [plate_crop(plate) for plate in plates]
+    backend = FakeOCR({FakeOCR.key(crop): plate for crop, plate in zip(crops, plates)})
+    ocr = CachedOCR(backend, CropCache(maxsize=64))
+
+    # Plates one character apart miss, within a batch and across batches
+    assert ocr.read(crops[:3]) == plates[:3]
+    assert ocr.read(crops[3:]) == plates[3:]
+    assert backend.reads == len(plates)
+    assert ocr.cache.stats['hits'] == 0
+
+
+def test_cache_reads_an_identical_crop_once():
+    crop = plate_crop('SB40DAP')
+    backend = FakeOCR({FakeOCR.key(crop): 'SB40DAP'})
+    ocr = CachedOCR(backend, CropCache(maxsize=64))
+
+    assert ocr.read([crop, crop.copy()]) == ['SB40DAP', 'SB40DAP']
+    assert ocr.read([crop.copy()]) == ['SB40DAP']
+    assert backend.reads == 1
+    assert ocr.cache.stats == {'hits': 1, 'misses': 2, 'size': 1}
+
+
+def test_cache_misses_a_crop_one_pixel_apart():
+    crop = plate_crop('SB40DAP')
+    moved = crop.copy()
+    moved[0, 0] += 1
+    backend = FakeOCR({FakeOCR.key(crop): 'SB40DAP', FakeOCR.key(moved): 'SB40DAP'})
+    ocr = CachedOCR(backend, CropCache(maxsize=64))
+
+    ocr.read([crop])
+    ocr.read([moved])
+    assert backend.reads == 2
+
+
+def test_cache_entries_expire():
+    crop = plate_crop('SB40DAP')
+    backend = FakeOCR({FakeOCR.key(crop): 'SB40DAP'})
+    ocr = CachedOCR(backend, CropCache(maxsize=64, max_age=0))
+
+    ocr.read([crop])
+    ocr.read([crop])
+    assert backend.reads == 2
+
+
+def test_cascade_only_escalates_unsure_or_invalid_reads():
+    small = FakeOCR({'a': 'SB40DAP', 'b': 'SB40DAP', 'c': 'XYZ'}, {'b': 0.5})
+    base = FakeOCR({'b': 'CJ12ABC', 'c': 'NOTAPLATE'})
+    large = FakeOCR({'c': 'B123XYZ'})
+    cascade = CascadeOCR([small, base, large], min_confidence=0.9)
+
+    assert cascade.read(['a', 'b', 'c']) == ['SB40DAP', 'CJ12ABC', 'B123XYZ']
+    assert (small.reads, base.reads, large.reads) == (3, 2, 1)
+    stats = cascade.stats
+    assert stats['crops'] == 3
+    assert stats['escalated'] == 2
+    assert stats['reads_2'] == 1
+
+
+def test_cascade_keeps_a_valid_read_over_an_invalid_one():
+    small = FakeOCR({'a': 'SB40DAP'}, {'a': 0.2})
+    large = FakeOCR({'a': 'SB4'})
+    assert CascadeOCR([small, large]).read(['a']) == ['SB40DAP']
@@ -0,0 +1,39 @@
+from plate_index import PlateIndex, is_valid_plate, normalize_plate
+
+
+def test_normalize_plate_fixes_look_alike_characters():
+    assert normalize_plate('sb-4O dap') == 'SB40DAP'
+    assert normalize_plate('S840DAP') == 'SB40DAP'
+    assert is_valid_plate('B123XYZ')
+    assert not is_valid_plate('XX12ABC')
+
+
+def test_valid_reads_are_never_rewritten():
+    index = PlateIndex()
+    index.add('SB40DAP', valid=True)
+    # One real edit away from a plate with notices: another truck, which must not inherit them
+    assert index.resolve('SB40DAR') == 'SB40DAR'
+    assert index.resolve('SB41DAP') == 'SB41DAP'
+    assert index.resolve('SB40DAP') == 'SB40DAP'
+
+
+def test_invalid_reads_resolve_through_look_alike_swaps_only():
+    index = PlateIndex()
+    index.add('SB40DAD', valid=True)
+    # Q never appears on a plate and the format cannot tell which look-alike it was
+    assert normalize_plate('SB40DAQ') == 'SB40DAQ'
+    assert index.resolve('SB40DAQ') == 'SB40DAD'
+    # A real edit on top of an invalid read stays unresolved
+    assert index.resolve('SB40DA') == 'SB40DA'
+    assert index.resolve('SB40DQQ') == 'SB40DQQ'
+
+
+def test_index_round_trips_through_its_file(tmp_path):
+    path = str(tmp_path / 'plates.json')
+    index = PlateIndex(path=path)
+    index.add('SB40DAP', valid=True)
+    index.add('CJ12ABC')
+    index.save()
+
+    loaded = PlateIndex(path=path)
+    assert loaded.plates == {'SB40DAP': True, 'CJ12ABC': False}
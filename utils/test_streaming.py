@@ -0,0 +1,133 @@
+import time
+
+import cv2
+import numpy as np
+
+from instrumentation import NULL_METRICS
+from plate_quality import BestCropSelector
+from streaming import PlateTracker, read_video_frames, stream_plates
+
+
+def detection(x, y, w=40, h=20, confidence=0.9):
+    # Detector row of a centered (x, y, w, h) box
+    return [x - w / 2, y - h / 2, x + w / 2, y + h / 2, confidence, 0]
+
+
+class FakeDetector:
+    """
+    Detects the boxes scripted for the frame index written in the first pixel of every frame.
+    """
+
+    def __init__(self, script):
+        self.script = script
+
+    def predict(self, images, conf=0.4, iou=0.45):
+        return [np.array(self.script.get(int(image[0, 0, 0]), []), dtype=np.float32).reshape(-1, 6)
+                for image in images]
+
+
+class FakeOCR:
+    """
+    Reads the track id written in the bottom-right pixel of every crop, the first call being slow
+    so the next crops queue up.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def read(self, crops):
+        if not self.calls:
+            time.sleep(0.3)
+        self.calls.append(len(crops))
+        return [f'PLATE{int(crop[-1, -1, 0])}' for crop in crops]
+
+
+class FakeInference:
+
+    def __init__(self, script):
+        self.BB_MODEL = FakeDetector(script)
+        self.ocr = FakeOCR()
+        self.metrics = NULL_METRICS
+
+    def resolve_plate(self, plate):
+        return plate
+
+    def scrape(self, plate):
+        return []
+
+
+def frames(count, plates=()):
+    # The first pixel holds the frame index, the bottom-right pixel of every plate its number
+    for index in range(count):
+        frame = np.zeros((240, 480, 3), dtype=np.uint8)
+        frame[0, 0] = index
+        for number, (x, y) in enumerate(plates):
+            frame[y + 9, x + 19] = number
+        yield index, frame
+
+
+def test_tracks_follow_moving_plates():
+    tracker = PlateTracker(min_hits=2)
+    assert tracker.update([(100, 100, 40, 20), (300, 100, 40, 20)], 0) == []
+    ready = tracker.update([(304, 101, 40, 20), (103, 100, 40, 20)], 1)
+    assert [(track.track_id, box) for track, box in ready] == [(1, (304, 101, 40, 20)), (0, (103, 100, 40, 20))]
+    # A confirmed plate is not sent again, a new plate gets a new id
+    assert tracker.update([(106, 100, 40, 20), (200, 200, 40, 20)], 2) == []
+    assert [track.track_id for track, _ in tracker.matches] == [0, 2]
+
+
+def test_tracks_expire_after_max_age():
+    tracker = PlateTracker(max_age=2, min_hits=1)
+    tracker.update([(100, 100, 40, 20)], 0)
+    tracker.update([], 2)
+    assert tracker.expired == []
+    tracker.update([(100, 100, 40, 20)], 5)
+    assert [track.track_id for track in tracker.expired] == [0]
+    assert [track.track_id for track, _ in tracker.matches] == [1]
+
+
+class ConfidenceGate:
+    """
+    Quality gate scoring crops by their detection confidence, rejecting those under 0.5.
+    """
+
+    def evaluate(self, crops, confidences):
+        scores = np.asarray(confidences, dtype=np.float64)
+        return scores >= 0.5, scores
+
+
+def test_best_crop_selector_releases_the_best_crop_once():
+    tracker = PlateTracker(min_hits=1)
+    selector = BestCropSelector(gate=ConfidenceGate(), window=3, min_hits=2)
+    frame = np.zeros((240, 480, 3), dtype=np.uint8)
+    released = []
+    for index, (confidence, rejected_confidence) in enumerate([(0.6, 0.3), (0.9, 0.4), (0.7, 0.2), (0.8, 0.1)]):
+        tracker.update([(100, 100, 40, 20), (300, 100, 40, 20)], index)
+        released += selector.update(frame, index, tracker.matches, [confidence, rejected_confidence],
+                                    tracker.expired)
+    released += selector.flush()
+    # The plate is read from its most confident frame, the plate never passing the gate is not read
+    assert [(frame_index, track_id) for frame_index, track_id, _, _ in released] == [(1, 0)]
+
+
+def test_stream_reads_every_vehicle_once_in_batched_ocr_calls():
+    plates = [(60, 60), (180, 60), (300, 60), (420, 60)]
+    script = {index: [detection(x, y) for x, y in plates] for index in range(6)}
+    inference = FakeInference(script)
+
+    results = list(stream_plates(inference, frames(6, plates), batch_size=2))
+    assert sorted((result['Track'], result['License Plate']) for result in results) == \
+        [(number, f'PLATE{number}') for number in range(4)]
+    assert sum(inference.ocr.calls) == 4
+    # The crops queued while the first call ran are read together
+    assert len(inference.ocr.calls) < 4
+
+
+def test_video_frames_are_skipped(tmp_path):
+    path = str(tmp_path / 'video.avi')
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48))
+    for _, frame in frames(10):
+        writer.write(np.ascontiguousarray(frame[:48, :64]))
+    writer.release()
+
+    assert [index for index, _ in read_video_frames(path, frame_skip=3)] == [0, 3, 6, 9]
@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from sumal_client import SumalClient, TTLCache
+from sumal_stub import SumalStubServer, make_notice
+
+LATENCY = 0.2
+
+
+@pytest.fixture
+def stub():
+    now = int(time.time() * 1000)
+    codes = ['A1', 'A2', 'A3', 'A4']
+    notices = {code: make_notice(code, 10.0 + index, now, now + 86400000) for index, code in enumerate(codes)}
+    with SumalStubServer({'SB40DAP': codes}, notices, latency=LATENCY) as server:
+        yield server
+
+
+def test_lookup_fetches_the_notices_concurrently(stub):
+    with SumalClient(stub.base_url, max_workers=8) as client:
+        start_time = time.perf_counter()
+        notices = client.lookup('SB40DAP')
+        elapsed = time.perf_counter() - start_time
+
+    assert [notice['Code'] for notice in notices] == ['A1', 'A2', 'A3', 'A4']
+    assert [notice['Volume'] for notice in notices] == [10.0, 11.0, 12.0, 13.0]
+    assert stub.request_count == 5
+    # The plate request, then the four notices at once, instead of five requests in a row
+    assert elapsed < 3.5 * LATENCY
+
+
+def test_lookups_are_cached_until_they_expire(stub):
+    with SumalClient(stub.base_url, cache=TTLCache(ttl=0.5), negative_ttl=0.5) as client:
+        assert len(client.lookup('SB40DAP')) == 4
+        assert client.lookup('CJ12ABC') == []
+        requests = stub.request_count
+        client.lookup('SB40DAP')
+        client.lookup('CJ12ABC')
+        assert stub.request_count == requests
+
+        time.sleep(0.6)
+        client.lookup('SB40DAP')
+        client.lookup('CJ12ABC')
+        assert stub.request_count == requests + 6
+
+
+def test_the_cache_persists_across_clients(stub, tmp_path):
+    path = str(tmp_path / 'sumal_cache.json')
+    with SumalClient(stub.base_url, cache=TTLCache(path=path)) as client:
+        expected = client.lookup('SB40DAP')
+    requests = stub.request_count
+
+    with SumalClient(stub.base_url, cache=TTLCache(path=path)) as client:
+        assert client.lookup('SB40DAP') == expected
+    assert stub.request_count == requests
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from tiling import merge_detections, overlapping_pairs, tile_grid
+
+
+def test_tile_grid_covers_the_frame_with_whole_tiles():
+    tiles = tile_grid(1000, 1500, tile_size=640, overlap=0.2)
+    assert (tiles[:, 2] - tiles[:, 0] == 640).all() and (tiles[:, 3] - tiles[:, 1] == 640).all()
+    assert tiles[:, 2].max() == 1500 and tiles[:, 3].max() == 1000
+    assert len(tile_grid(480, 640)) == 0
+
+
+def test_overlapping_pairs_matches_the_iou_matrix():
+    rng = np.random.default_rng(0)
+    corners = rng.uniform(0, 500, (300, 2)).astype(np.float32)
+    boxes = np.concatenate([corners, corners + rng.uniform(10, 60, (300, 2)).astype(np.float32)], axis=1)
+    first, second = overlapping_pairs(boxes, 0.3)
+
+    from matching import iou_matrix
+
+    ious = iou_matrix(boxes, boxes)
+    np.fill_diagonal(ious, 0)
+    expected = set(zip(*np.nonzero(ious > 0.3)))
+    assert set(zip(first.tolist(), second.tolist())) == expected
+
+
+def test_nms_keeps_the_most_confident_box_per_object_and_class():
+    detections = np.array([
+        [0, 0, 100, 100, 0.6, 0],
+        [5, 5, 105, 105, 0.9, 0],
+        [5, 5, 105, 105, 0.8, 1],
+        [300, 300, 350, 350, 0.5, 0],
+    ], dtype=np.float32)
+    merged = merge_detections(detections, iou=0.5, method='nms')
+    assert merged.tolist() == detections[[1, 2, 3]].tolist()
+
+
+def test_wbf_averages_the_corners_by_confidence():
+    detections = np.array([
+        [0, 0, 100, 100, 0.25, 0],
+        [10, 10, 110, 110, 0.75, 0],
+    ], dtype=np.float32)
+    merged = merge_detections(detections, iou=0.5, method='wbf')
+    assert merged.shape == (1, 6)
+    assert merged[0, :4] == pytest.approx([7.5, 7.5, 107.5, 107.5])
+    assert merged[0, 4:].tolist() == [0.75, 0]
+
+
+def test_unknown_merge_method():
+    with pytest.raises(ValueError):
+        merge_detections(np.zeros((2, 6)), method='mean')
@@ -0,0 +1,248 @@
+"""
+Tiled (sliding-window) inference for high-resolution photos.
+
+The detectors see the whole frame downscaled to their 640 pixel input, so on
+a 4K photo of a loaded truck the small log ends shrink to a few pixels and
+are missed or mis-sized. `TiledDetector` also runs the detector on
+overlapping tiles of the frame at (close to) native resolution: the tiles of
+a whole batch of frames go through the detector together, their detections
+are shifted back to frame pixels and merged with the full-frame pass by a
+vectorized cross-tile NMS or weighted box fusion. In adaptive mode only the
+tiles the full-frame pass finds dense are run, which bounds the cost on
+sparse frames.
+"""
+
+import numpy as np
+
+from detector_backends import DetectorBackend
+
+
+def tile_grid(height, width, tile_size: int = 640, overlap: float = 0.2):
+    """
+    Cover a frame with overlapping square tiles.
+
+    The tiles are spaced `tile_size * (1 - overlap)` apart and the last row and column
+    are aligned with the frame border, so every tile is whole.
+
+    Returns:
+        np.ndarray: N x 4 (x1, y1, x2, y2) int array, no tile when the frame fits in one.
+    """
+    if height <= tile_size and width <= tile_size:
+        return np.zeros((0, 4), dtype=np.int64)
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(size):
+        if size <= tile_size:
+            return np.zeros(1, dtype=np.int64)
+        positions = np.arange(0, size - tile_size, stride)
+        return np.append(positions, size - tile_size)
+
+    ys, xs = np.meshgrid(starts(height), starts(width), indexing='ij')
+    x1, y1 = xs.reshape(-1), ys.reshape(-1)
+    return np.stack([x1, y1, np.minimum(x1 + tile_size, width), np.minimum(y1 + tile_size, height)], axis=1)
+
+
+def dense_tiles(tiles, detections, min_detections: int = 8, small_box: float = 0.0):
+    """
+    Select the tiles the full-frame pass finds dense.
+
+    Parameters:
+        tiles (np.ndarray): N x 4 tiles, see `tile_grid`.
+        detections (np.ndarray): Full-frame detections in frame pixels.
+        min_detections (int): A tile holding this many detection centers is dense.
+        small_box (float): A tile holding a detection whose longest side is under this many
+            frame pixels is dense too: its objects are close to the detector resolution.
+
+    Returns:
+        np.ndarray: Boolean mask of the selected tiles.
+    """
+    if not len(tiles) or not len(detections):
+        return np.zeros(len(tiles), dtype=bool)
+    centers = (detections[:, :2] + detections[:, 2:4]) / 2
+    inside = ((centers[None, :, 0] >= tiles[:, None, 0]) & (centers[None, :, 0] < tiles[:, None, 2])
+              & (centers[None, :, 1] >= tiles[:, None, 1]) & (centers[None, :, 1] < tiles[:, None, 3]))
+    small = np.maximum(detections[:, 2] - detections[:, 0], detections[:, 3] - detections[:, 1]) < small_box
+    return (inside.sum(axis=1) >= min_detections) | (inside & small[None, :]).any(axis=1)
+
+
+def _drop_cut_boxes(detections, tile, shape, margin):
+    # Boxes touching a tile edge that lies inside the frame are cut by the tile. With enough
+    # overlap the whole object is in a neighbouring tile (or in the full-frame pass), and the
+    # partial box would survive the merge as a smaller duplicate.
+    x1, y1, x2, y2 = tile
+    height, width = shape
+    cut = np.zeros(len(detections), dtype=bool)
+    if x1 > 0:
+        cut |= detections[:, 0] <= x1 + margin
+    if y1 > 0:
+        cut |= detections[:, 1] <= y1 + margin
+    if x2 < width:
+        cut |= detections[:, 2] >= x2 - margin
+    if y2 < height:
+        cut |= detections[:, 3] >= y2 - margin
+    return detections[~cut]
+
+
+def overlapping_pairs(boxes, iou_threshold):
+    """
+    Find the pairs of boxes overlapping more than `iou_threshold`, without an N x N matrix.
+
+    The boxes are sorted by their left edge and every box is only compared with the boxes
+    starting before its right edge, so the cost follows the number of nearby boxes.
+
+    Returns:
+        tuple: First and second indices of every overlapping pair, both orders included.
+    """
+    order = np.argsort(boxes[:, 0], kind='stable')
+    sorted_boxes = boxes[order]
+    ends = np.searchsorted(sorted_boxes[:, 0], sorted_boxes[:, 2], side='left')
+    counts = np.maximum(ends - np.arange(1, len(order) + 1), 0)
+    first = np.repeat(np.arange(len(order)), counts)
+    # Offsets 1..count of every box, built without a Python loop
+    second = first + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    top_left = np.maximum(sorted_boxes[first, :2], sorted_boxes[second, :2])
+    bottom_right = np.minimum(sorted_boxes[first, 2:], sorted_boxes[second, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=1)
+    areas = np.prod(sorted_boxes[:, 2:] - sorted_boxes[:, :2], axis=1)
+    ious = intersection / (areas[first] + areas[second] - intersection + 1e-6)
+    overlapping = ious > iou_threshold
+    first, second = order[first[overlapping]], order[second[overlapping]]
+    return np.concatenate([first, second]), np.concatenate([second, first])
+
+
+def merge_detections(detections, iou: float = 0.5, method: str = 'wbf', max_det: int = 3000):
+    """
+    Merge the overlapping detections of several passes over one frame.
+
+    Parameters:
+        detections (np.ndarray): N x 6 (x1, y1, x2, y2, confidence, class) detections.
+        iou (float): Boxes of the same class overlapping more than this are one object.
+        method (str): 'nms' keeps the most confident box of every object, 'wbf' (weighted
+            box fusion) averages the corners of its boxes weighted by their confidence.
+        max_det (int): Maximum number of merged detections.
+
+    Returns:
+        np.ndarray: M x 6 float32 detections, by decreasing confidence.
+    """
+    if method not in ('nms', 'wbf'):
+        raise ValueError(f"Unknown merge method '{method}', expected 'nms' or 'wbf'")
+    detections = np.asarray(detections, dtype=np.float32).reshape(-1, 6)
+    if len(detections) < 2:
+        return detections
+    # Shift every class past the others so a single pass never merges different classes
+    boxes = detections[:, :4] + detections[:, 5:6] * (detections[:, :4].max() + 1)
+    scores = detections[:, 4]
+    first, second = overlapping_pairs(boxes, iou)
+
+    # Greedy NMS over the overlap graph: visit the boxes by decreasing confidence, keep the
+    # ones no kept box overlaps
+    order = np.argsort(-scores, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    by_first = np.argsort(first, kind='stable')
+    neighbours = second[by_first]
+    bounds = np.searchsorted(first[by_first], np.arange(len(order) + 1))
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for index in order:
+        if suppressed[index]:
+            continue
+        keep.append(index)
+        if len(keep) == max_det:
+            break
+        suppressed[neighbours[bounds[index]:bounds[index + 1]]] = True
+    keep = np.asarray(keep, dtype=np.int64)
+    if method == 'nms':
+        return detections[keep]
+
+    # Every box joins the most confident kept box it overlaps (kept boxes never overlap
+    # each other above `iou`)
+    slot = np.full(len(order), -1, dtype=np.int64)
+    slot[keep] = np.arange(len(keep))
+    best = np.where(slot >= 0, rank, np.iinfo(np.int64).max)
+    joins = slot[second] >= 0
+    np.minimum.at(best, first[joins], rank[second[joins]])
+    member = best < len(order)
+    cluster = slot[order[best[member]]]
+    weights = scores[member].astype(np.float64)
+    total = np.bincount(cluster, weights=weights, minlength=len(keep))
+    fused = np.stack([np.bincount(cluster, weights=weights * detections[member, column], minlength=len(keep))
+                      for column in range(4)], axis=1) / total[:, None]
+    return np.concatenate([fused, detections[keep, 4:6]], axis=1).astype(np.float32)
+
+
+class TiledDetector(DetectorBackend):
+    """
+    Wraps a detector backend to run it on overlapping tiles of large frames.
+
+    Parameters:
+        detector (DetectorBackend): Loaded detector, see `detector_backends.load_detector`.
+        tile_size (int): Side of the tiles in frame pixels, the detector input size by default.
+        overlap (float): Fraction of a tile shared with its neighbours, keep it larger than
+            the objects relative to the tile so every object is whole in some tile.
+        merge (str): 'wbf' or 'nms', see `merge_detections`.
+        merge_iou (float): IoU above which detections of two passes are one object.
+        adaptive (bool): Only run the tiles the full-frame pass finds dense, see `dense_tiles`.
+        min_detections (int): Detections making a tile dense in the adaptive mode.
+        small_box (float): Longest side, in detector input pixels, of a full-frame detection
+            making its tile dense in the adaptive mode.
+        edge_margin (float): Distance in pixels to an inner tile edge under which a box is
+            considered cut by the tile.
+    """
+
+    name = 'tiled'
+
+    def __init__(self, detector, tile_size: int = None, overlap: float = 0.2, merge: str = 'wbf',
+                 merge_iou: float = 0.5, adaptive: bool = False, min_detections: int = 8,
+                 small_box: float = 16.0, edge_margin: float = 2.0):
+        super().__init__(detector.model_path, detector.imgsz)
+        self.detector = detector
+        self.tile_size = tile_size or detector.imgsz
+        self.overlap = overlap
+        self.merge = merge
+        self.merge_iou = merge_iou
+        self.adaptive = adaptive
+        self.min_detections = min_detections
+        self.small_box = small_box
+        self.edge_margin = edge_margin
+        self.tiles_run = 0
+        self.tiles_skipped = 0
+
+    def predict(self, images, conf=0.4, iou=0.45):
+        if isinstance(images, np.ndarray):
+            images = [images]
+        coarse = self.detector.predict(images, conf=conf, iou=iou)
+
+        crops = []
+        owners = []
+        for index, (image, detections) in enumerate(zip(images, coarse)):
+            tiles = tile_grid(*image.shape[:2], self.tile_size, self.overlap)
+            if self.adaptive:
+                # Input pixels -> frame pixels, the frame being letterboxed into the input
+                scale = max(image.shape[:2]) / self.imgsz
+                selected = dense_tiles(tiles, detections, self.min_detections, self.small_box * scale)
+                self.tiles_skipped += int(len(tiles) - selected.sum())
+                tiles = tiles[selected]
+            for tile in tiles:
+                # Views of the frame, the detector letterboxes them into its own input buffer
+                crops.append(image[tile[1]:tile[3], tile[0]:tile[2]])
+                owners.append((index, tile))
+        self.tiles_run += len(crops)
+
+        passes = [[frame_detections] for frame_detections in coarse]
+        if crops:
+            # All the tiles of the batch go through the detector together
+            for (index, tile), detections in zip(owners, self.detector.predict(crops, conf=conf, iou=iou)):
+                if not len(detections):
+                    continue
+                detections = detections.copy()
+                detections[:, [0, 2]] += tile[0]
+                detections[:, [1, 3]] += tile[1]
+                passes[index].append(_drop_cut_boxes(detections, tile, images[index].shape[:2],
+                                                     self.edge_margin))
+        return [merge_detections(np.concatenate(frame_passes), self.merge_iou, self.merge)
+                if len(frame_passes) > 1 else frame_passes[0] for frame_passes in passes]
+
+    @property
+    def stats(self):
+        return {'tiles_run': self.tiles_run, 'tiles_skipped': self.tiles_skipped}
@@ -0,0 +1,266 @@
+"""
+Local SQLite store of verified trucks.
+
+Python-side counterpart of the app's `verified_trucks` sqflite table: every
+check keeps the plate, the legal notice codes, the legal and estimated wood
+volumes, the validity window of the notice and the time of the check. The
+database runs in WAL mode so readers never wait for the writer, and checks
+are indexed by plate and by time so "was this truck verified in the last N
+hours" is a single index lookup. Bulk inserts go through one transaction.
+
+The same database can persist the SUMAL lookup cache, see `SqliteTTLCache`.
+"""
+
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+
+from sumal_client import TTLCache
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS verified_trucks (
+    id INTEGER PRIMARY KEY,
+    license_plate TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    notice_codes TEXT NOT NULL DEFAULT '[]',
+    legal_volume REAL,
+    estimated_volume REAL,
+    valid_from INTEGER,
+    valid_to INTEGER
+);
+CREATE INDEX IF NOT EXISTS verified_trucks_plate ON verified_trucks (license_plate, timestamp);
+CREATE INDEX IF NOT EXISTS verified_trucks_time ON verified_trucks (timestamp);
+CREATE TABLE IF NOT EXISTS sumal_cache (
+    key TEXT PRIMARY KEY,
+    expires REAL NOT NULL,
+    value TEXT NOT NULL
+);
+'''
+
+_COLUMNS = ('id', 'license_plate', 'timestamp', 'notice_codes', 'legal_volume', 'estimated_volume',
+            'valid_from', 'valid_to')
+
+_SELECT = f'SELECT {", ".join(_COLUMNS)} FROM verified_trucks'
+
+
+def select_notice(notices, timestamp):
+    """
+    Pick the legal notice a check is compared with: the latest one valid at `timestamp`
+    (ms), or the last one, as the app does, when none was.
+
+    Returns:
+        tuple: (notice, valid), (None, False) without notices.
+    """
+    if not notices:
+        return None, False
+    valid = [notice for notice in notices if notice['Valid From'] <= timestamp <= notice['Valid To']]
+    if valid:
+        return max(valid, key=lambda notice: notice['Valid From']), True
+    return notices[-1], False
+
+
+def make_record(license_plate, notices=(), estimated_volume=None, timestamp=None):
+    """
+    Build the record of a check from the SUMAL notices of the plate.
+
+    Parameters:
+        license_plate (str): Cleaned license plate number.
+        notices (list): Notices of the plate, see `SumalClient.lookup`.
+        estimated_volume (float): Volume estimated from the photo, in m3.
+        timestamp (int): Time of the check in ms, now by default.
+
+    Returns:
+        dict: Record accepted by `VerifiedTruckStore.add_many`.
+    """
+    timestamp = int(time.time() * 1000) if timestamp is None else int(timestamp)
+    notice, _ = select_notice(notices, timestamp)
+    return {'license_plate': license_plate, 'timestamp': timestamp,
+            'notice_codes': [item['Code'] for item in notices],
+            'legal_volume': float(notice['Volume']) if notice else None,
+            'estimated_volume': None if estimated_volume is None else float(estimated_volume),
+            'valid_from': notice['Valid From'] if notice else None,
+            'valid_to': notice['Valid To'] if notice else None}
+
+
+def _row(record):
+    return (record['license_plate'], int(record['timestamp']), json.dumps(list(record.get('notice_codes') or [])),
+            record.get('legal_volume'), record.get('estimated_volume'), record.get('valid_from'),
+            record.get('valid_to'))
+
+
+def _record(row):
+    record = dict(zip(_COLUMNS, row))
+    record['notice_codes'] = json.loads(record['notice_codes'])
+    return record
+
+
+class VerifiedTruckStore:
+    """
+    SQLite table of verified trucks, safe to share between threads.
+
+    Parameters:
+        path (str): Database file, ':memory:' for a throwaway store.
+    """
+
+    def __init__(self, path: str = 'verified_trucks.db'):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            # Durable at every checkpoint of the WAL, enough for a cache of checks
+            self._connection.execute('PRAGMA synchronous=NORMAL')
+            self._connection.executescript(_SCHEMA)
+
+    def add(self, license_plate, notices=(), estimated_volume=None, timestamp=None):
+        """
+        Record one check, see `make_record`.
+
+        Returns:
+            int: Id of the new row.
+        """
+        with self._lock:
+            cursor = self._connection.execute(
+                'INSERT INTO verified_trucks (license_plate, timestamp, notice_codes, legal_volume, '
+                'estimated_volume, valid_from, valid_to) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                _row(make_record(license_plate, notices, estimated_volume, timestamp)))
+            return cursor.lastrowid
+
+    def add_many(self, records):
+        """
+        Record many checks in a single transaction.
+
+        Parameters:
+            records (iterable): Dicts with the keys of `make_record`.
+
+        Returns:
+            int: Number of rows inserted.
+        """
+        rows = [_row(record) for record in records]
+        with self._lock, self._transaction():
+            self._connection.executemany(
+                'INSERT INTO verified_trucks (license_plate, timestamp, notice_codes, legal_volume, '
+                'estimated_volume, valid_from, valid_to) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+        return len(rows)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    def _query(self, sql, parameters=()):
+        with self._lock:
+            return [_record(row) for row in self._connection.execute(sql, parameters).fetchall()]
+
+    def last_verified(self, license_plate, hours: float = None):
+        """
+        Get the latest check of a plate.
+
+        Parameters:
+            license_plate (str): Cleaned license plate number.
+            hours (float): Only consider checks made in the last `hours` hours.
+
+        Returns:
+            dict: The latest record, None when the plate was not verified (recently).
+        """
+        since = int((time.time() - hours * 3600) * 1000) if hours is not None else 0
+        records = self._query(f'{_SELECT} WHERE license_plate = ? AND timestamp >= ? ORDER BY timestamp DESC LIMIT 1',
+                              (license_plate, since))
+        return records[0] if records else None
+
+    def verified_since(self, hours: float):
+        """
+        Get every check made in the last `hours` hours, latest first.
+        """
+        since = int((time.time() - hours * 3600) * 1000)
+        return self._query(f'{_SELECT} WHERE timestamp >= ? ORDER BY timestamp DESC', (since,))
+
+    def history(self, license_plate):
+        """
+        Get every check of a plate, latest first.
+        """
+        return self._query(f'{_SELECT} WHERE license_plate = ? ORDER BY timestamp DESC', (license_plate,))
+
+    def get_all(self):
+        return self._query(f'{_SELECT} ORDER BY timestamp')
+
+    def delete_by_license_plate(self, license_plate):
+        with self._lock:
+            self._connection.execute('DELETE FROM verified_trucks WHERE license_plate = ?', (license_plate,))
+
+    def delete_all(self):
+        with self._lock:
+            self._connection.execute('DELETE FROM verified_trucks')
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM verified_trucks').fetchone()[0]
+
+    def load_cache_entries(self, limit: int = None):
+        """
+        Get the non-expired SUMAL cache entries, oldest expiry first.
+
+        Returns:
+            list: (key, expires, value) tuples.
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT key, expires, value FROM sumal_cache WHERE expires > ? ORDER BY expires DESC LIMIT ?',
+                (time.time(), -1 if limit is None else limit)).fetchall()
+        return [(key, expires, json.loads(value)) for key, expires, value in reversed(rows)]
+
+    def save_cache_entries(self, entries):
+        """
+        Replace the persisted SUMAL cache with `entries`, (key, expires, value) tuples.
+        """
+        rows = [(key, expires, json.dumps(value)) for key, expires, value in entries]
+        with self._lock, self._transaction():
+            self._connection.execute('DELETE FROM sumal_cache')
+            self._connection.executemany('INSERT INTO sumal_cache (key, expires, value) VALUES (?, ?, ?)', rows)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SqliteTTLCache(TTLCache):
+    """
+    `TTLCache` persisted to the `sumal_cache` table of a `VerifiedTruckStore` instead of a
+    JSON file. Lookups stay in memory, the table is read on creation and rewritten by `save`
+    (called by `SumalClient.close`).
+
+    Parameters:
+        store (VerifiedTruckStore): Store holding the cache table.
+        maxsize (int): Maximum number of entries kept in memory.
+        ttl (float): Default lifetime of an entry in seconds.
+    """
+
+    def __init__(self, store: VerifiedTruckStore, maxsize: int = 4096, ttl: float = 6 * 3600):
+        self.store = store
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.load()
+
+    def load(self):
+        entries = self.store.load_cache_entries(self.maxsize)
+        with self._lock:
+            for key, expires, value in entries:
+                self._data[key] = (expires, value)
+
+    def save(self):
+        now = time.time()
+        with self._lock:
+            entries = [(key, expires, value) for key, (expires, value) in self._data.items() if expires > now]
+        self.store.save_cache_entries(entries)